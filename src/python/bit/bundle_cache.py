@@ -0,0 +1,307 @@
+#-*-coding:utf-8-*-
+"""
+@package bit.bundle_cache
+@brief A memory-mappable, columnar storage format for the results of Bundler.bundle()
+
+@author Sebastian Thiel
+@copyright [GNU Lesser General Public License](https://www.gnu.org/licenses/lgpl.html)
+"""
+__all__ = ['BundleCache', 'write_bundle_cache']
+
+import sys
+import os
+import mmap
+from array import array
+from itertools import chain
+from struct import (pack,
+                    unpack_from,
+                    calcsize)
+
+
+# ==============================================================================
+## @name Constants
+# ------------------------------------------------------------------------------
+## @{
+
+## Identifies our files, and the byteorder they were written in, as all arrays are stored natively
+MAGIC = 'BITBND2' + sys.byteorder[0]
+
+## magic, is_unicode, num_meta, meta typecodes, num_prefixes, num_versions, num_items, info size
+HEADER_FORMAT = '=8sBB16sQQQQ'
+
+## Maximum amount of meta-data fields per item
+MAX_META_FIELDS = 16
+
+## Columns we always store, in order, along with their typecode.
+# *_offset and *_length locate strings in the string heap, *_end are cumulative indices into the next table
+STRUCTURE_COLUMNS = (('prefix_offset', 'L'),
+                     ('prefix_length', 'L'),
+                     ('prefix_end', 'L'),       # index past the last version of each prefix
+                     ('version_offset', 'L'),
+                     ('version_length', 'L'),
+                     ('version_end', 'L'),      # index past the last item of each version
+                     ('path_offset', 'L'),      # paths are stored relative to their prefix
+                     ('path_length', 'L'))
+
+## -- End Constants -- @}
+
+
+# ==============================================================================
+## @name Utilities
+# ------------------------------------------------------------------------------
+## @{
+
+def _header_size(num_meta):
+    """@return size of the header including the column offsets, in bytes"""
+    return calcsize(HEADER_FORMAT) + calcsize('=%iQ' % (len(STRUCTURE_COLUMNS) + num_meta))
+
+def _align(offset, alignment = 8):
+    """@return offset aligned to the given alignment"""
+    return (offset + alignment - 1) & ~(alignment - 1)
+
+## -- End Utilities -- @}
+
+
+# ==============================================================================
+## @name Interface
+# ------------------------------------------------------------------------------
+## @{
+
+def write_bundle_cache(bundle, path, meta_typecodes, info = ''):
+    """Write the given bundle into a file at the given path
+    @param bundle a dict as produced by Bundler.bundle()
+    @param path at which to write the cache. It will be written to a temporary file first, to never leave
+    incomplete files
+    @param meta_typecodes a string with one array typecode per field of the meta-data tuple of each item.
+    For example, 'ld' would be suitable for (size, ratio) tuples.
+    @param info an arbitrary string to store along with the bundle, see BundleCache.info
+    @return size of the written file in bytes"""
+    assert len(meta_typecodes) <= MAX_META_FIELDS, "Can store at most %i meta-data fields" % MAX_META_FIELDS
+    columns = [array(typecode) for name, typecode in STRUCTURE_COLUMNS]
+    (prefix_offset, prefix_length, prefix_end,
+     version_offset, version_length, version_end,
+     path_offset, path_length) = columns
+    meta_columns = [array(typecode) for typecode in meta_typecodes]
+    meta_appenders = [c.append for c in meta_columns]
+    num_meta = len(meta_columns)
+    is_unicode = None
+
+    tmp_path = path + '.tmp'
+    fp = open(tmp_path, 'wb')
+    try:
+        fp.seek(_header_size(num_meta))
+        fp.write(info)
+        heap_size = [0]
+
+        def write_string(string):
+            """@return (offset, length) of the given string in the heap"""
+            if isinstance(string, unicode):
+                string = string.encode('utf-8')
+            # end handle encoding
+            offset = heap_size[0]
+            fp.write(string)
+            heap_size[0] += len(string)
+            return offset, len(string)
+        # end utility
+
+        for prefix, bundle_dict in bundle.iteritems():
+            if is_unicode is None:
+                is_unicode = isinstance(prefix, unicode)
+            # end remember string type
+            offset, length = write_string(prefix)
+            prefix_offset.append(offset)
+            prefix_length.append(length)
+            lp = len(prefix)
+
+            for version, items in bundle_dict.iteritems():
+                offset, length = write_string(version)
+                version_offset.append(offset)
+                version_length.append(length)
+
+                for item_path, meta in items:
+                    offset, length = write_string(item_path[lp:])
+                    path_offset.append(offset)
+                    path_length.append(length)
+                    for fid in xrange(num_meta):
+                        meta_appenders[fid](meta[fid])
+                    # end for each meta-data field
+                # end for each item
+                version_end.append(len(path_offset))
+            # end for each version
+            prefix_end.append(len(version_offset))
+        # end for each prefix
+
+        column_offsets = list()
+        for column in chain(columns, meta_columns):
+            offset = _align(fp.tell())
+            fp.seek(offset)
+            column.tofile(fp)
+            column_offsets.append(offset)
+        # end for each column
+        size = fp.tell()
+
+        fp.seek(0)
+        fp.write(pack(HEADER_FORMAT, MAGIC, bool(is_unicode), num_meta, meta_typecodes,
+                      len(prefix_offset), len(version_offset), len(path_offset), len(info)))
+        fp.write(pack('=%iQ' % len(column_offsets), *column_offsets))
+    finally:
+        fp.close()
+    # end assure file is closed
+    os.rename(tmp_path, path)
+    return size
+
+
+class BundleCache(object):
+    """Provides read-only access to a file written by write_bundle_cache().
+
+    The file is memory-mapped, and only the parts which are actually accessed will be read and converted into
+    python objects. This makes it possible to filter prefixes without materializing the entire bundle.
+    """
+    __slots__ = (
+                    '_map',             # memory map of the entire file
+                    '_is_unicode',      # if True, strings are returned as unicode
+                    '_meta_typecodes',  # typecodes of all meta-data fields
+                    '_columns',         # dict of column name -> (offset, typecode)
+                    '_heap_start',      # offset at which our string heap starts
+                    'info',             # the info string stored along with the bundle
+                    '_prefixes',        # cached array of prefix_offset, prefix_length, prefix_end
+                    'num_prefixes',     # amount of prefixes we store
+                    'num_versions',     # amount of versions we store
+                    'num_items'         # amount of items we store
+                )
+
+    def __init__(self, path):
+        """Open the cache at the given path
+        @throw ValueError if the file is not a bundle cache or was written on a host with different byte order"""
+        fp = open(path, 'rb')
+        try:
+            self._map = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            fp.close()
+        # end file object isn't needed anymore
+
+        if len(self._map) < calcsize(HEADER_FORMAT):
+            raise ValueError("File at '%s' is too small to be a bundle cache" % path)
+        # end check size
+        (magic, is_unicode, num_meta, meta_typecodes,
+         self.num_prefixes, self.num_versions, self.num_items, info_size) = unpack_from(HEADER_FORMAT, self._map)
+        if magic != MAGIC:
+            raise ValueError("File at '%s' is no bundle cache of this host" % path)
+        # end verify magic
+
+        self._is_unicode = bool(is_unicode)
+        self._meta_typecodes = meta_typecodes[:num_meta]
+        self._heap_start = _header_size(num_meta) + info_size
+        self.info = self._map[self._heap_start - info_size:self._heap_start]
+        column_offsets = unpack_from('=%iQ' % (len(STRUCTURE_COLUMNS) + num_meta), self._map,
+                                     calcsize(HEADER_FORMAT))
+        self._columns = dict()
+        for (name, typecode), offset in zip(STRUCTURE_COLUMNS, column_offsets):
+            self._columns[name] = (offset, typecode)
+        # end for each structure column
+        for fid, (typecode, offset) in enumerate(zip(self._meta_typecodes, column_offsets[len(STRUCTURE_COLUMNS):])):
+            self._columns[fid] = (offset, typecode)
+        # end for each meta column
+        self._prefixes = None
+
+    def __len__(self):
+        return self.num_prefixes
+
+    # -------------------------
+    ## @name Utilities
+    # @{
+
+    def _column(self, name, start, end):
+        """@return array with values of the given column, in the range [start, end["""
+        offset, typecode = self._columns[name]
+        itemsize = array(typecode).itemsize
+        return array(typecode, self._map[offset + start * itemsize:offset + end * itemsize])
+
+    def _string(self, offset, length):
+        """@return string in our heap at the given location"""
+        offset += self._heap_start
+        string = self._map[offset:offset + length]
+        if self._is_unicode:
+            return string.decode('utf-8')
+        # end handle unicode
+        return string
+
+    def _prefix_columns(self):
+        """@return tuple of (prefix_offset, prefix_length, prefix_end) arrays"""
+        if self._prefixes is None:
+            self._prefixes = tuple(self._column(name, 0, self.num_prefixes)
+                                   for name in ('prefix_offset', 'prefix_length', 'prefix_end'))
+        # end load lazily
+        return self._prefixes
+
+    ## -- End Utilities -- @}
+
+    # -------------------------
+    ## @name Interface
+    # @{
+
+    def prefixes(self):
+        """@return iterator yielding all prefixes in the order they are stored in"""
+        offsets, lengths, ends = self._prefix_columns()
+        string = self._string
+        for pid in xrange(self.num_prefixes):
+            yield string(offsets[pid], lengths[pid])
+        # end for each prefix
+
+    def bundle_dict(self, pid):
+        """@return a dict of version -> list((path, meta)) for the prefix at the given index,
+        similar to what Bundler.bundle() produces"""
+        offsets, lengths, ends = self._prefix_columns()
+        prefix = self._string(offsets[pid], lengths[pid])
+        vstart = pid and ends[pid - 1] or 0
+        vend = ends[pid]
+        if vstart == vend:
+            return dict()
+        # end handle empty
+
+        version_offset = self._column('version_offset', vstart, vend)
+        version_length = self._column('version_length', vstart, vend)
+        version_end = self._column('version_end', vstart, vend)
+        istart = vstart and self._column('version_end', vstart - 1, vstart)[0] or 0
+        iend = version_end[-1]
+
+        path_offset = self._column('path_offset', istart, iend)
+        path_length = self._column('path_length', istart, iend)
+        if self._meta_typecodes:
+            metas = zip(*[self._column(fid, istart, iend) for fid in xrange(len(self._meta_typecodes))])
+        else:
+            metas = [tuple()] * (iend - istart)
+        # end handle meta-data
+        string = self._string
+
+        res = dict()
+        first = 0
+        for vid in xrange(vend - vstart):
+            last = version_end[vid] - istart
+            res[string(version_offset[vid], version_length[vid])] = \
+                [(prefix + string(path_offset[iid], path_length[iid]), metas[iid]) for iid in xrange(first, last)]
+            first = last
+        # end for each version
+        return res
+
+    def to_bundle(self, keep_prefix = None):
+        """@return a dict of prefix -> bundle_dict, as produced by Bundler.bundle()
+        @param keep_prefix if not None, a function f(prefix) -> bool returning True for each prefix to keep.
+        The bundles of all other prefixes will never be read."""
+        res = dict()
+        for pid, prefix in enumerate(self.prefixes()):
+            if keep_prefix is not None and not keep_prefix(prefix):
+                continue
+            # end skip filtered prefixes
+            res[prefix] = self.bundle_dict(pid)
+        # end for each prefix
+        return res
+
+    def close(self):
+        """Release our memory map. Calling any method afterwards is undefined"""
+        self._map.close()
+        self._prefixes = None
+
+    ## -- End Interface -- @}
+
+# end class BundleCache
@@ -6,17 +6,37 @@
 @author Sebastian Thiel
 @copyright [GNU Lesser General Public License](https://www.gnu.org/licenses/lgpl.html)
 """
-__all__ = ['VersionBundleList', 'VersionBundle', 'Bundler']
+__all__ = ['VersionBundleList', 'VersionBundle', 'CompactItemList', 'Bundler']
 
 import sys
 import os
 import re
-from itertools import chain
+import multiprocessing
+from array import array
+from itertools import (chain,
+                       izip)
 
 from butility import (LazyMixin,
                       Meta)
 
 
+# ==============================================================================
+## @name Parallel Rebuild Utilities
+# ------------------------------------------------------------------------------
+## @{
+
+## The bundler and bundle to use in worker processes of Bundler.rebuild_bundle(). They are inherited when forking.
+_rebuild_bundler = None
+_rebuild_bundle = None
+
+def _rebuild_chunk(chunk):
+    """@return list of compact rebuild results for each prefix in chunk, see Bundler._compact_bundle_list()"""
+    bundler, bundle = _rebuild_bundler, _rebuild_bundle
+    return [bundler._compact_bundle_list(prefix, bundle[prefix]) for prefix in chunk]
+
+## -- End Parallel Rebuild Utilities -- @}
+
+
 class ListAggregatorMeta(Meta):
     """A metaclass to automatically generate methods which aggregate information on a list of items.
     The algorithm does so lazily and all at once upon first request. That way, the list is iterated only once"""
@@ -138,6 +158,163 @@ class ListAggregatorBase(list, LazyMixin):
 # end class ListAggregatorBase
 
 
+class CompactItemList(object):
+    """A list of (path, meta) tuples whose paths share a common prefix, as created by Bundler.bundle().
+
+    Paths are stored relative to the prefix, split into an interned directory and a file name. Meta-data tuples
+    are stored in parallel arrays, one per field, as long as all values of a field are integers or floats.
+    Items are created on the fly when they are accessed.
+    """
+    __slots__ = (
+                    '_prefix',   # prefix common to all paths
+                    '_intern',   # dict for interning directories, possibly shared with other lists
+                    '_dirs',     # list of interned directories, relative to the prefix
+                    '_names',    # list of file names
+                    '_fields',   # list of arrays or lists, one per meta-data field, or None if there is no item yet
+                    '_is_tuple'  # if False, meta-data isn't a tuple and stored as is in our only field
+                )
+
+    ## Array typecodes for python types we can store compactly
+    typecodes = {int : 'l', long : 'l', float : 'd'}
+
+    def __init__(self, prefix, intern = None):
+        """Initialize this instance
+        @param prefix common to all paths to be stored
+        @param intern a dict to intern directories with. Should be shared among lists to be most effective"""
+        if intern is None:
+            intern = dict()
+        # end create intern dict
+        self._prefix = prefix
+        self._intern = intern
+        self._dirs = list()
+        self._names = list()
+        self._fields = None
+        self._is_tuple = True
+
+    def __getstate__(self):
+        # the intern dict is shared, and doesn't need to be pickled
+        return (self._prefix, self._dirs, self._names, self._fields, self._is_tuple)
+
+    def __setstate__(self, state):
+        self._prefix, self._dirs, self._names, self._fields, self._is_tuple = state
+        self._intern = dict()
+
+    def __len__(self):
+        return len(self._names)
+
+    def __iter__(self):
+        prefix = self._prefix
+        if not self._fields:
+            metas = self._fields is not None and [tuple()] * len(self) or tuple()
+        elif self._is_tuple:
+            metas = izip(*self._fields)
+        else:
+            metas = self._fields[0]
+        # end handle meta-data
+        for dir, name, meta in izip(self._dirs, self._names, metas):
+            yield (prefix + dir + name, meta)
+        # end for each item
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in xrange(*index.indices(len(self)))]
+        # end handle slices
+        path = self._prefix + self._dirs[index] + self._names[index]
+        if self._is_tuple:
+            return (path, tuple(field[index] for field in self._fields))
+        return (path, self._fields[0][index])
+
+    def __eq__(self, other):
+        try:
+            if len(self) != len(other):
+                return False
+            # end handle length
+        except TypeError:
+            return False
+        # end handle non-sequences
+        for lhs, rhs in izip(self, other):
+            if lhs != rhs:
+                return False
+            # end handle difference
+        # end for each item
+        return True
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __repr__(self):
+        return '%s(%r)' % (type(self).__name__, list(self))
+
+    # -------------------------
+    ## @name Utilities
+    # @{
+
+    def _new_field(self, value):
+        """@return a new, empty field suitable to store values like the given one"""
+        typecode = self.typecodes.get(type(value))
+        if typecode is None:
+            return list()
+        return array(typecode)
+
+    def _append_value(self, fid, value):
+        """Append the given value to the field at fid, converting it into a list if needed"""
+        field = self._fields[fid]
+        if type(field) is not list and self.typecodes.get(type(value)) != field.typecode:
+            # don't alter the type of values, and store everything else as is
+            field = self._fields[fid] = list(field)
+        # end convert field
+        try:
+            field.append(value)
+        except OverflowError:
+            field = self._fields[fid] = list(field)
+            field.append(value)
+        # end handle values which are too large
+
+    ## -- End Utilities -- @}
+
+    # -------------------------
+    ## @name Interface
+    # @{
+
+    def append(self, item):
+        """Append the given (path, meta) tuple. path must start with our prefix"""
+        path, meta = item
+        suffix = path[len(self._prefix):]
+        pos = suffix.rfind('/') + 1
+        dir = suffix[:pos]
+        self._dirs.append(self._intern.setdefault(dir, dir))
+        self._names.append(suffix[pos:])
+
+        if self._fields is None:
+            self._is_tuple = type(meta) is tuple
+            if self._is_tuple:
+                self._fields = [self._new_field(value) for value in meta]
+            else:
+                self._fields = [list()]
+            # end handle meta-data type
+        # end initialize fields
+
+        if not self._is_tuple:
+            self._fields[0].append(meta)
+        elif type(meta) is not tuple or len(meta) != len(self._fields):
+            raise ValueError("All meta-data tuples need to have the same length, got %r" % (meta,))
+        else:
+            for fid, value in enumerate(meta):
+                self._append_value(fid, value)
+            # end for each value
+        # end handle meta-data
+
+    def extend(self, items):
+        """Append all given (path, meta) tuples"""
+        for item in items:
+            self.append(item)
+        # end for each item
+
+    ## -- End Interface -- @}
+
+# end class CompactItemList
+
+
 class VersionBundleList(ListAggregatorBase):
     """A sorted list of VersionBundle instances which provides some methods to accumulate information about them.
 
@@ -164,9 +341,14 @@ class VersionBundle(ListAggregatorBase):
     Sorting order is ascending by the first item (path) in the contained tuple.
     It can be used to aggregate information about the contained entries, similar to what the VersionBundleList
     can do.
+
+    A bundle can be a view on items of another sequence, like a CompactItemList, see set_view(). That way, items 
+    are only created when accessed. Altering the bundle copies all viewed items into it.
     """
     __slots__ = (
                     'version',   # The version shared by all of our members
+                    '_view'      # None, or tuple of (items, indices) with the sequence we are a view on, and 
+                                 # an array of indices of our items within it, or None if we contain all of them
                 )
 
     _aggregator = tuple()
@@ -174,10 +356,151 @@ class VersionBundle(ListAggregatorBase):
     def __new__(cls, version):
         inst = list.__new__(cls)
         inst.version = version
+        inst._view = None
         return inst
 
+    def __getnewargs__(self):
+        return (self.version, )
+
+    def __getstate__(self):
+        # viewed items are pickled like our own ones, as we iterate them
+        state = dict()
+        for cls in type(self).__mro__:
+            for name in cls.__dict__.get('__slots__', tuple()):
+                try:
+                    state[name] = object.__getattribute__(self, name)
+                except AttributeError:
+                    pass
+                # end ignore unset slots
+            # end for each slot
+        # end for each type
+        state['_view'] = None
+        return (None, state)
+
     def __init__(self, *args):
         """do nothing"""
+
+    def __len__(self):
+        view = self._view
+        if view is None:
+            return list.__len__(self)
+        elif view[1] is None:
+            return len(view[0])
+        return len(view[1])
+
+    def __iter__(self):
+        view = self._view
+        if view is None:
+            return list.__iter__(self)
+        items, indices = view
+        if indices is None:
+            return iter(items)
+        return (items[index] for index in indices)
+
+    def __reversed__(self):
+        if self._view is None:
+            return list.__reversed__(self)
+        return iter(self[::-1])
+
+    def __getitem__(self, index):
+        view = self._view
+        if view is None:
+            return list.__getitem__(self, index)
+        elif isinstance(index, slice):
+            return [self[i] for i in xrange(*index.indices(len(self)))]
+        items, indices = view
+        if indices is None:
+            return items[index]
+        return items[indices[index]]
+
+    def __getslice__(self, start, end):
+        if self._view is None:
+            return list.__getslice__(self, start, end)
+        return self[start:end:]
+
+    def __contains__(self, item):
+        if self._view is None:
+            return list.__contains__(self, item)
+        return any(member == item for member in self)
+
+    def __eq__(self, other):
+        if self._view is None and getattr(other, '_view', None) is None:
+            return list.__eq__(self, other)
+        try:
+            return list(self) == list(other)
+        except TypeError:
+            return False
+        # end handle non-sequences
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __repr__(self):
+        if self._view is None:
+            return list.__repr__(self)
+        return repr(list(self))
+
+    def _materializing(name):
+        """@return a method which copies viewed items into the list before altering it with the list method 
+        of the given name"""
+        list_method = getattr(list, name)
+        def method(self, *args, **kwargs):
+            self._materialize()
+            return list_method(self, *args, **kwargs)
+        method.__name__ = name
+        return method
+    # end materializing method generator
+
+    def _copying(name):
+        """@return a method which calls the list method of the given name on a copy of our items, and on copies 
+        of the items of other bundles"""
+        list_method = getattr(list, name)
+        def method(self, *args):
+            args = [isinstance(arg, VersionBundle) and list(arg) or arg for arg in args]
+            return list_method(list(self), *args)
+        method.__name__ = name
+        return method
+    # end copying method generator
+
+    for name in ('append', 'extend', 'insert', 'pop', 'remove', 'reverse', 'sort',
+                 '__setitem__', '__delitem__', '__setslice__', '__delslice__', '__iadd__', '__imul__'):
+        locals()[name] = _materializing(name)
+    # end for each method which alters items
+    for name in ('index', 'count', '__add__', '__mul__', '__rmul__', '__lt__', '__le__', '__gt__', '__ge__'):
+        locals()[name] = _copying(name)
+    # end for each method which just reads items
+    del name
+    del _materializing
+    del _copying
+
+    # -------------------------
+    ## @name Utilities
+    # @{
+
+    def _materialize(self):
+        """Copy all viewed items into our list, which makes us a plain list again"""
+        if self._view is not None:
+            items = list(self)
+            self._view = None
+            list.extend(self, items)
+        # end handle view
+
+    ## -- End Utilities -- @}
+
+    # -------------------------
+    ## @name Interface
+    # @{
+
+    def set_view(self, items, indices = None):
+        """Make this bundle a view on the given items, replacing all items it contained so far
+        @param items an indexable sequence of (path, meta) tuples, like a CompactItemList
+        @param indices a sequence of indices into items of all items to contain, or None to contain all of them
+        @return this instance"""
+        list.__delitem__(self, slice(None))
+        self._view = (items, indices)
+        return self.clear_cache()
+
+    ## -- End Interface -- @}
         
 # end class VersionBundle
 
@@ -193,12 +516,22 @@ class Bundler(object):
     ## A regular expression to find versions
     re_version = re.compile(r"([_/\\-]v)(\d+)([_/\\-\\.])")
 
+    ## A regular expression matching the end of all prefixes re_version could produce
+    re_prefix_end = re.compile(r"[_/\\-]v")
+
     ## type of bundle we create
     BundleType = VersionBundle
 
     ## type of bundle list we create
     BundleListType = VersionBundleList
 
+    ## amount of prefixes to send to worker processes at once
+    rebuild_chunk_size = 1000
+
+    ## If True, bundle() stores items in CompactItemList instances, which saves a lot of memory.
+    # Otherwise, plain lists are used, which allows to marshal the result
+    compact_items = True
+
     ## -- End Configuration -- @}
 
 
@@ -256,10 +589,14 @@ class Bundler(object):
     def _list_to_bundle(self, version, version_list):
         """@return a VersionBundle list as converted from the given list of versions
         @param version the version as returned by _convert_version()
-        @param version_list a list of (path, meta) tuples which will all have the same version and prefix"""
-        res = self.BundleType(version)
-        res.extend(item for item in version_list if self._keep_item(item))
-        return res
+        @param version_list a list of (path, meta) tuples which will all have the same version and prefix
+        @note the bundle is a view on the kept items of version_list, see VersionBundle.set_view()"""
+        keep = self._keep_item
+        indices = array('l', (index for index, item in enumerate(version_list) if keep(item)))
+        if len(indices) == len(version_list):
+            indices = None
+        # end handle unfiltered list
+        return self.BundleType(version).set_view(version_list, indices)
 
     def _iter_bundles_in_dict(self, bundle_dict):
         """@return iterator for all bundles in the given dict. It will filter and prune as needed."""
@@ -270,17 +607,131 @@ class Bundler(object):
             yield bundle
         # end for each prefix, bundle list
         
+    def _bundle_state(self, bundle):
+        """@return a simple value representing the state of the given bundle, which was set during 
+        _dict_to_bundle_list(). It must be possible to pickle it.
+        @note default implementation has no state"""
+        return None
+
+    def _set_bundle_state(self, bundle, state):
+        """Apply a state previously obtained by _bundle_state() to the given bundle"""
+
+    def _new_bundle_list(self, prefix):
+        """@return a new and empty bundle list for use at the given prefix"""
+        return self.BundleListType()
+
     def _dict_to_bundle_list(self, prefix, bundle_dict):
         """@return a VersionBundleList instance as built from the given bundle_dict.
         We assure the versions are sorted ascending by their converted version value
         @param prefix which is common to all versions of the bundle_dict
         @param bundle_dict as found at the prefix"""
-        bundle_list = self.BundleListType()
+        bundle_list = self._new_bundle_list(prefix)
         bundle_list.extend(self._iter_bundles_in_dict(bundle_dict))
         bundle_list.sort(key=lambda b: b.version)
         return bundle_list
         
     ## -- End Subclass Interface -- @}
+
+
+    # -------------------------
+    ## @name Parallel Rebuild
+    # @{
+
+    def _rebuild_prefix(self, prefix, bundle_dict):
+        """@return a bundle list for the given prefix, or None if it should be dropped"""
+        if not self._keep_prefix(prefix):
+            return None
+        # end prune by prefix
+
+        blist = self._dict_to_bundle_list(prefix, bundle_dict)
+        if not any(blist):
+            return None
+        # skip items which are now empty (due to filtering of subclasses)
+        return blist
+
+    def _compact_bundle_list(self, prefix, bundle_dict):
+        """Rebuild the given prefix, and describe the result without repeating the items themselves.
+        @return None if the prefix should be dropped, or a list of (version_key, item_indices, state) tuples, 
+        one for each bundle in the bundle list. version_key is the key into bundle_dict, item_indices are indices
+        of all kept items in the respective version list, or None if all are kept, and state is the result of
+        _bundle_state()"""
+        blist = self._rebuild_prefix(prefix, bundle_dict)
+        if blist is None:
+            return None
+        # end handle dropped prefix
+
+        # Bundles are usually views on their version list, which tells us all we need
+        keys = dict((id(version_list), key) for key, version_list in bundle_dict.iteritems())
+        item_locations = None
+        res = list()
+        for bundle in blist:
+            view = bundle._view
+            if view is not None and id(view[0]) in keys:
+                res.append((keys[id(view[0])], view[1], self._bundle_state(bundle)))
+                continue
+            # end handle views
+
+            if item_locations is None:
+                # Items may be created on the fly by their version list, so we locate them by path
+                item_locations = dict()
+                for key, version_list in bundle_dict.iteritems():
+                    for index, item in enumerate(version_list):
+                        item_locations.setdefault(item[0], (key, list()))[1].append(index)
+                    # end for each item
+                # end for each version
+            # end build locations once
+            key = item_locations[bundle[0][0]][0]
+            indices = None
+            if len(bundle) != len(bundle_dict[key]):
+                # duplicate paths are consumed in order
+                indices = tuple(item_locations[item[0]][1].pop(0) for item in bundle)
+            # end handle filtered items
+            res.append((key, indices, self._bundle_state(bundle)))
+        # end for each bundle
+        return res
+
+    def _expand_bundle_list(self, prefix, bundle_dict, compact_list):
+        """@return a bundle list as described by compact_list, see _compact_bundle_list()"""
+        blist = self._new_bundle_list(prefix)
+        for key, indices, state in compact_list:
+            version_list = bundle_dict[key]
+            bundle = self.BundleType(self._convert_version(key))
+            if indices is not None:
+                indices = array('l', indices)
+            # end handle filtered items
+            bundle.set_view(version_list, indices)
+            self._set_bundle_state(bundle, state)
+            blist.append(bundle)
+        # end for each bundle
+        return blist
+
+    def _iter_rebuilt_prefixes(self, bundle, prefixes, processes):
+        """@return iterator yielding (prefix, bundle_list_or_None) tuples in order of prefixes, using 
+        the given amount of worker processes"""
+        global _rebuild_bundler, _rebuild_bundle
+        chunks = [prefixes[i:i + self.rebuild_chunk_size] for i in xrange(0, len(prefixes), self.rebuild_chunk_size)]
+
+        # Workers obtain the bundler and the bundle when forking, which saves us from pickling them. 
+        # Changes to the bundle after the pool was created are not seen by workers.
+        _rebuild_bundler, _rebuild_bundle = self, bundle
+        pool = multiprocessing.Pool(processes)
+        try:
+            for chunk, results in zip(chunks, pool.imap(_rebuild_chunk, chunks)):
+                for prefix, compact_list in zip(chunk, results):
+                    if compact_list is None:
+                        yield prefix, None
+                    else:
+                        yield prefix, self._expand_bundle_list(prefix, bundle[prefix], compact_list)
+                    # end handle dropped prefixes
+                # end for each result
+            # end for each chunk
+            pool.close()
+        finally:
+            pool.terminate()
+            _rebuild_bundler = _rebuild_bundle = None
+        # end assure pool is shut down
+
+    ## -- End Parallel Rebuild -- @}
         
 
     # -------------------------
@@ -296,12 +747,19 @@ class Bundler(object):
         * [1] = any kind of meta-data which will remain attached to the corresponding path
         @param options compatible to default_options, accessible using plain getattr
         @return dict of prefixes associated with a dict of version->list((path, metadata)) instances.
-        @note the returned value supports marshaling 
+        Lists are CompactItemList instances if compact_items is True.
+        @note the returned value supports marshaling if compact_items is False
         """
         out = dict()
         set_default = out.setdefault
         dirname = os.path.dirname
         extract_span = self._extract_version_span
+        if self.compact_items:
+            interned = dict()
+            new_list = lambda prefix: CompactItemList(prefix, interned)
+        else:
+            new_list = lambda prefix: list()
+        # end handle item list type
 
         cur_prefix = None
         for path, meta in record_iterator:
@@ -311,7 +769,10 @@ class Bundler(object):
                 version = path[sp[0]:sp[1]]
 
                 bundle_dict = set_default(prefix, {})
-                bundle = bundle_dict.setdefault(version, [])
+                bundle = bundle_dict.get(version)
+                if bundle is None:
+                    bundle = bundle_dict[version] = new_list(prefix)
+                # end create version list
 
                 # either there is no prefix yet, or it matches
                 if cur_prefix and prefix != cur_prefix:
@@ -330,26 +791,154 @@ class Bundler(object):
 
         return out
 
-    def rebuild_bundle(self, bundle):
+    def iter_bundles(self, record_iterator):
+        """Similar to bundle(), but yields each prefix as soon as it is complete, which allows to process
+        prefixes with bounded memory.
+        As all paths starting with a prefix are contiguous if records are ordered by path, a prefix is complete 
+        once we see the first path which doesn't start with it.
+        @param record_iterator like in bundle(), but ordered by path
+        @return iterator yielding (prefix, bundle_dict) tuples, where bundle_dict is like the values of the 
+        dict returned by bundle()
+        @note if records are not ordered, prefixes may be yielded multiple times"""
+        out = dict()
+        extract_span = self._extract_version_span
+        if self.compact_items:
+            interned = dict()
+            new_list = lambda prefix: CompactItemList(prefix, interned)
+        else:
+            new_list = lambda prefix: list()
+        # end handle item list type
+
+        # Stack of prefixes which may still receive items, each one starts with the ones below it
+        open_prefixes = list()
+        cur_prefix = None
+        for path, meta in record_iterator:
+            while open_prefixes and not path.startswith(open_prefixes[-1]):
+                prefix = open_prefixes.pop()
+                if prefix == cur_prefix:
+                    # bundle() would prune it as well, as this path is in another prefix
+                    self._prune_entry(out, prefix)
+                # end handle current prefix
+                bundle_dict = out.pop(prefix, None)
+                if bundle_dict:
+                    yield prefix, bundle_dict
+                # end handle pruned entry
+            # end for each prefix we left
+
+            sp = extract_span(path)
+            if sp:
+                prefix = path[:sp[0]]
+                version = path[sp[0]:sp[1]]
+
+                bundle_dict = out.get(prefix)
+                if bundle_dict is None:
+                    bundle_dict = out[prefix] = dict()
+                    if not open_prefixes or open_prefixes[-1] != prefix:
+                        open_prefixes.append(prefix)
+                    # end track prefix
+                # end create prefix
+                bundle = bundle_dict.get(version)
+                if bundle is None:
+                    bundle = bundle_dict[version] = new_list(prefix)
+                # end create version list
+
+                if cur_prefix and prefix != cur_prefix:
+                    self._prune_entry(out, cur_prefix)
+                # end handle prefix change  
+
+                bundle.append((path, meta))
+                cur_prefix = prefix
+            else:
+                self._prune_entry(out, cur_prefix)
+                cur_prefix = None
+            # end handle span
+        # end for each rec
+
+        while open_prefixes:
+            prefix = open_prefixes.pop()
+            bundle_dict = out.pop(prefix, None)
+            if bundle_dict:
+                yield prefix, bundle_dict
+            # end handle pruned entry
+        # end for each remaining prefix
+
+    def iter_rebuilt_bundles(self, record_iterator):
+        """Bundle and rebuild records as they come in, see iter_bundles() and rebuild_bundle().
+        @param record_iterator like in iter_bundles()
+        @return iterator yielding (prefix, bundle_list) tuples of all prefixes which are kept"""
+        for prefix, bundle_dict in self.iter_bundles(record_iterator):
+            blist = self._rebuild_prefix(prefix, bundle_dict)
+            if blist is not None:
+                yield prefix, blist
+            # end handle dropped prefix
+        # end for each prefix
+
+    def rebuild_bundle(self, bundle, processes = 1):
         """Take product of bundle() method and rebuild it to better types to help analysing and mining it
         It will call methods to delegate certain decisions to subclasses.
         @param bundle product of bundle() method. It will be changed in place !
+        @param processes if larger than 1, prefixes will be rebuilt by the given amount of worker processes.
+        Subclasses must implement _bundle_state() and _set_bundle_state() if they alter bundles in 
+        _dict_to_bundle_list(), and must rebuild each prefix independently of all others, as each worker only 
+        sees some of them.
         @return the rebuilt bundle, which was changed in place"""
-        for prefix in bundle.keys():
-            if not self._keep_prefix(prefix):
+        prefixes = bundle.keys()
+        if processes > 1 and len(prefixes) > self.rebuild_chunk_size:
+            results = self._iter_rebuilt_prefixes(bundle, prefixes, processes)
+        else:
+            results = ((prefix, self._rebuild_prefix(prefix, bundle[prefix])) for prefix in prefixes)
+        # end handle parallelism
+
+        for prefix, blist in results:
+            if blist is None:
                 del bundle[prefix]
-                continue
-            # end prune by prefix
-
-            blist = self._dict_to_bundle_list(prefix, bundle[prefix])
-            if not any(blist):
-                del bundle[prefix]
-                continue
-            # skip items which are now empty (due to filtering of subclasses)
-            bundle[prefix] = blist
+            else:
+                bundle[prefix] = blist
+            # end handle dropped prefix
         # end for each prefix
 
         return bundle
 
+    def affected_prefixes(self, bundle, paths):
+        """@return set of all prefixes whose entry in the given bundle may change if the given paths were added, 
+        changed or removed.
+        @param bundle product of the bundle() method
+        @param paths iterable of paths"""
+        res = set()
+        extract_span = self._extract_version_span
+        for path in paths:
+            sp = extract_span(path)
+            if sp:
+                res.add(path[:sp[0]])
+            # end handle versioned path
+
+            # As paths are ordered, any path could affect the pruning of all prefixes it starts with
+            for m in self.re_prefix_end.finditer(path):
+                prefix = path[:m.end()]
+                if prefix in bundle:
+                    res.add(prefix)
+                # end keep existing prefix
+            # end for each possible prefix
+        # end for each path
+        return res
+
+    def rebundle_prefix(self, bundle, prefix, record_iterator):
+        """Replace the entry at prefix in the given bundle with one built from the given records.
+        That way, a bundle can be updated without bundling all records again.
+        @param bundle product of the bundle() method. It will be changed in place !
+        @param prefix the prefix to rebuild, see affected_prefixes()
+        @param record_iterator like in bundle(), which must yield at least all records with paths starting
+        with prefix, in the same order they were provided to bundle() in. Other records are ignored.
+        @return the bundle which was changed in place"""
+        out = self.bundle(record for record in record_iterator if record[0].startswith(prefix))
+        self._prune_entry(out, prefix)
+
+        if prefix in out:
+            bundle[prefix] = out[prefix]
+        else:
+            bundle.pop(prefix, None)
+        # end handle pruned prefix
+        return bundle
+
     ## -- End Interface -- @}
 # end class Bundler
@@ -8,11 +8,14 @@
 """
 __all__ = ['ReportCommandMixin']
 
+import os
 import sys
 
 import bapp
+from bcmd import InputError
 from .base import OverridableSubCommandMixin
 from bit.reports import Report
+from bit.deletion import DeletionExecutor
 
 
 
@@ -32,7 +35,9 @@ class ReportCommandMixin(OverridableSubCommandMixin, bapp.plugin_type()):
     OUTPUT_GENERATE_TTY = 'generate'
     OUTPUT_GENERATE_CSV = 'generate-csv'
     OUTPUT_GENERATE_SCRIPT = 'generate-script'
-    output_schemas = (OUTPUT_SCHEMA, OUTPUT_GENERATE_TTY, OUTPUT_GENERATE_CSV, OUTPUT_GENERATE_SCRIPT)
+    OUTPUT_EXECUTE_FIX = 'execute-fix'
+    output_schemas = (OUTPUT_SCHEMA, OUTPUT_GENERATE_TTY, OUTPUT_GENERATE_CSV, OUTPUT_GENERATE_SCRIPT,
+                      OUTPUT_EXECUTE_FIX)
 
     ## -- End Constants -- @}
 
@@ -63,6 +68,21 @@ class ReportCommandMixin(OverridableSubCommandMixin, bapp.plugin_type()):
         types = self.report_types()
         assert types, "Didn't find a single report"
 
+        help = "Amount of threads to remove files with in %s mode" % self.OUTPUT_EXECUTE_FIX
+        parser.add_argument('--threads', dest='threads', type=int, default=8, help=help)
+
+        help = "Maximum amount of files and directories to remove per second in %s mode, or 0 for no limit" \
+                                                                                        % self.OUTPUT_EXECUTE_FIX
+        parser.add_argument('--max-iops', dest='max_iops', type=float, default=0, help=help)
+
+        help = "A file to record all removed paths in, in %s mode. " % self.OUTPUT_EXECUTE_FIX
+        help += "If it exists, all paths recorded in it will be skipped, which allows to resume after an interruption"
+        parser.add_argument('--journal', dest='journal', metavar='PATH', help=help)
+
+        help = "If set, the amount of records to determine column widths from in %s mode. " % self.OUTPUT_GENERATE_TTY
+        help += "Records are printed as soon as they are generated, instead of after all of them are known"
+        parser.add_argument('--window', dest='window', type=int, help=help)
+
         help = 'The name of the report to run'
         spg = parser.add_subparsers(title="Reports", help=help)
         for cls in types:
@@ -74,7 +94,13 @@ class ReportCommandMixin(OverridableSubCommandMixin, bapp.plugin_type()):
             help = 'The kind of output you want.'
             help += "%s: show all configured values influencing the report." % self.OUTPUT_SCHEMA
             subparser.add_argument('mode', choices=self.output_schemas, help=help)
-            subparser.set_defaults(report_type=cls)
+
+            if cls.supports_fix_deletions():
+                help = "Must be '%s' to actually delete files in %s mode. It will be a dry-run otherwise" \
+                                                            % (cls.DELETE_MAGIC, self.OUTPUT_EXECUTE_FIX)
+                subparser.add_argument('magic', nargs='?', help=help)
+            # end handle deletion support
+            subparser.set_defaults(report_type=cls, magic=None)
         # end for each type
 
         # parser.add_argument('--', dest='terminator', action='store_true',
@@ -89,15 +115,36 @@ class ReportCommandMixin(OverridableSubCommandMixin, bapp.plugin_type()):
             print >> sys.stderr, (generator.configuration())
         elif args.mode in (self.OUTPUT_GENERATE_CSV, self.OUTPUT_GENERATE_TTY):
             mode = (args.mode == self.OUTPUT_GENERATE_CSV) and Report.SERIALIZE_CSV or Report.SERIALIZE_TTY
-            report = generator.generate()
+            report = generator.generate_stream()
             if report.is_empty():
                 print >> sys.stderr, "Report didn't yield a result"
             else:
-                report.serialize(mode, sys.stdout.write)
+                report.serialize(mode, sys.stdout.write, window=args.window)
             # end handle no results
         elif args.mode == self.OUTPUT_GENERATE_SCRIPT:
             # make a report, then write a fix script
             generator.generate_fix_script(generator.generate(), sys.stdout.write)
+        elif args.mode == self.OUTPUT_EXECUTE_FIX:
+            # Provide the same safety as the scripts do
+            if os.getuid() != 0:
+                raise InputError("must be root to remove files")
+            # end verify user
+            deletions = generator.fix_deletions(generator.generate())
+            if deletions is None:
+                raise InputError("Report '%s' doesn't support %s" % (generator.type_name, args.mode))
+            # end handle unsupported
+            if raw_input("This operation will delete files and folders. Are you sure ? yn [n]:") != 'y':
+                print >> sys.stderr, "aborted by user"
+                return self.ERROR
+            # end handle confirmation
+
+            executor = DeletionExecutor(dry_run = args.magic != generator.DELETE_MAGIC,
+                                        num_threads = args.threads,
+                                        max_iops = args.max_iops,
+                                        journal_path = args.journal)
+            if executor.execute(*deletions).num_failed:
+                return self.ERROR
+            # end handle failures
         else:
             raise NotImplementedError("'%s' mode not implemented" % args.mode)
         # end handle mode
@@ -0,0 +1,313 @@
+#-*-coding:utf-8-*-
+"""
+@package bit.deletion
+@brief An executor for removing plenty of files and directories in parallel
+
+@author Sebastian Thiel
+@copyright [GNU Lesser General Public License](https://www.gnu.org/licenses/lgpl.html)
+"""
+__all__ = ['DeletionExecutor']
+
+import os
+import sys
+import errno
+import threading
+import Queue
+from time import (time,
+                  sleep)
+
+
+class _RateLimiter(object):
+    """Hands out time slots to any amount of threads, to not exceed a given amount of operations per second"""
+    __slots__ = (
+                    '_interval',    # seconds between two operations
+                    '_next',        # time at which the next operation may start
+                    '_lock'         # protects _next
+                )
+
+    def __init__(self, rate):
+        self._interval = 1.0 / rate
+        self._next = time()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        """Block until the calling thread may perform its operation"""
+        self._lock.acquire()
+        try:
+            now = time()
+            slot = max(now, self._next)
+            self._next = slot + self._interval
+        finally:
+            self._lock.release()
+        # end assure lock is released
+        if slot > now:
+            sleep(slot - now)
+        # end wait for our slot
+
+# end class _RateLimiter
+
+
+class DeletionExecutor(object):
+    """Removes files using a pool of threads, and directories thereafter, deepest ones first.
+
+    As removing files on network filesystems is bound by latency, it's more efficient to have many requests
+    in flight than to run one process at a time.
+    Completed operations are written to an optional journal. If the deletion is interrupted, running it again
+    with the same journal will skip all paths that were handled already.
+
+    Unless dry_run is False, nothing will be deleted, and each path is just written to the log instead.
+    Progress, failures and a summary are written to the log as well.
+    """
+    __slots__ = (
+                    'dry_run',          # if True, we don't touch the filesystem
+                    'num_threads',      # amount of threads to delete with
+                    'max_iops',         # maximum amount of operations per second, or 0 for no limit
+                    'journal_path',     # path to our journal, or None
+                    'log',              # function to write lines to
+                    'num_files',        # amount of files we removed
+                    'num_directories',  # amount of directories we removed
+                    'num_skipped',      # amount of paths skipped as the journal said they were handled
+                    'num_failed',       # amount of paths we failed to remove
+                    '_journal',         # file object of our journal, or None
+                    '_done',            # set of paths handled according to the journal
+                    '_lock',            # protects our counters and the journal
+                    '_limiter'          # a _RateLimiter, or None
+                )
+
+    ## Amount of paths to queue per thread, to bound memory
+    queue_size_per_thread = 64
+
+    ## Amount of files after which we print our progress
+    progress_interval = 10000
+
+    ## errno values of rmdir() to ignore, which is like rmdir --ignore-fail-on-non-empty
+    ignored_rmdir_errors = (errno.ENOTEMPTY, errno.EEXIST, errno.ENOENT)
+
+    def __init__(self, dry_run = True, num_threads = 8, max_iops = 0, journal_path = None, log = sys.stdout.write):
+        """Initialize this instance
+        @param dry_run if True, nothing will be deleted
+        @param num_threads amount of threads to delete with
+        @param max_iops if not 0, the maximum amount of unlink or rmdir calls per second, across all threads
+        @param journal_path if not None, path to a file which records all handled paths, and which is read to
+        skip them if it exists. Not used in dry-run mode.
+        @param log a function to write lines to, like file.write. It is only called by one thread at a time"""
+        if num_threads < 1:
+            raise AssertionError("Need at least one thread, got %i" % num_threads)
+        # end verify threads
+        self.dry_run = dry_run
+        self.num_threads = num_threads
+        self.max_iops = max_iops
+        self.journal_path = journal_path
+        self.log = log
+        self.num_files = self.num_directories = self.num_skipped = self.num_failed = 0
+        self._journal = None
+        self._done = set()
+        self._lock = threading.Lock()
+        self._limiter = None
+
+    # -------------------------
+    ## @name Utilities
+    # @{
+
+    def _log(self, message):
+        """Write the given message as line to our log, which is shared with our threads"""
+        self._lock.acquire()
+        try:
+            self.log(message + '\n')
+        finally:
+            self._lock.release()
+        # end assure lock is released
+
+    def _open_journal(self):
+        """Read our journal if it exists, and open it for appending"""
+        if self.dry_run or not self.journal_path:
+            return
+        # end handle no journal
+
+        complete = True
+        if os.path.isfile(self.journal_path):
+            for line in open(self.journal_path):
+                # the last line may be incomplete if we were killed
+                complete = line.endswith('\n')
+                if complete:
+                    self._done.add(line[2:-1])
+                # end handle complete line
+            # end for each line
+            self._log("Resuming with %i paths handled according to journal at '%s'"
+                                                                        % (len(self._done), self.journal_path))
+        # end read journal
+        self._journal = open(self.journal_path, 'a')
+        if not complete:
+            # don't let the next record extend the incomplete one
+            self._journal.write('\n')
+        # end terminate incomplete line
+
+    def _close_journal(self):
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+        # end close journal
+
+    def _record(self, kind, path):
+        """Record the given path as handled, and count it. Must be called with _lock held
+        @param kind either 'f' or 'd' """
+        if kind == 'f':
+            self.num_files += 1
+        else:
+            self.num_directories += 1
+        # end count
+        if self._journal is not None:
+            self._journal.write('%s %s\n' % (kind, path))
+        # end handle journal
+
+    def _remove(self, kind, path):
+        """Remove the file or directory at the given path, or pretend to do so"""
+        if self.dry_run:
+            self._lock.acquire()
+            try:
+                self.log('%s %s\n' % (kind == 'f' and 'rm' or 'rmdir', path))
+                self._record(kind, path)
+            finally:
+                self._lock.release()
+            # end assure lock is released
+            return
+        # end handle dry-run
+
+        if self._limiter is not None:
+            self._limiter.wait()
+        # end throttle
+
+        failed = False
+        try:
+            if kind == 'f':
+                os.unlink(path)
+            else:
+                os.rmdir(path)
+            # end handle kind
+        except OSError, err:
+            if kind == 'f' and err.errno != errno.ENOENT:
+                failed = True
+                self._log("Failed to remove file '%s': %s" % (path, err))
+            elif kind == 'd' and err.errno not in self.ignored_rmdir_errors:
+                failed = True
+                self._log("Failed to remove directory '%s': %s" % (path, err))
+            elif kind == 'd':
+                # directories may legitimately remain, and must be tried again when resuming
+                return
+            # end handle error
+        # end handle errors
+
+        self._lock.acquire()
+        try:
+            if failed:
+                self.num_failed += 1
+            else:
+                self._record(kind, path)
+            # end handle failure
+        finally:
+            self._lock.release()
+        # end assure lock is released
+
+    def _run_parallel(self, kind, paths):
+        """Remove all the given paths using our threads, and return once all of them are done
+        @return amount of paths we queued"""
+        queue = Queue.Queue(self.num_threads * self.queue_size_per_thread)
+
+        def worker():
+            while True:
+                path = queue.get()
+                if path is None:
+                    return
+                # end handle end of work
+                try:
+                    self._remove(kind, path)
+                except Exception, err:
+                    # Keep going, otherwise the producer would block forever
+                    self._log("Unexpected failure when removing '%s': %s" % (path, err))
+                    self._lock.acquire()
+                    try:
+                        self.num_failed += 1
+                    finally:
+                        self._lock.release()
+                    # end assure lock is released
+                # end handle unexpected errors
+            # end while there is work
+        # end worker
+
+        threads = list()
+        for tid in xrange(self.num_threads):
+            thread = threading.Thread(target=worker, name='deletion-%i' % tid)
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        # end for each thread
+
+        count = 0
+        st = time()
+        try:
+            for path in paths:
+                if path in self._done:
+                    self.num_skipped += 1
+                    continue
+                # end skip handled paths
+                queue.put(path)
+                count += 1
+                if count % self.progress_interval == 0:
+                    elapsed = time() - st
+                    self._log("Queued %i paths for removal in %fs (%f paths/s)"
+                                                                    % (count, elapsed, count / (elapsed or 1e-6)))
+                # end handle progress
+            # end for each path
+        finally:
+            for thread in threads:
+                queue.put(None)
+            # end for each thread
+            for thread in threads:
+                thread.join()
+            # end for each thread
+        # end assure threads are stopped
+        return count
+
+    ## -- End Utilities -- @}
+
+    # -------------------------
+    ## @name Interface
+    # @{
+
+    def execute(self, files, directories = tuple()):
+        """Remove all given files, then all given directories which are empty afterwards.
+        Directories are removed deepest first, and those on the same level in parallel.
+        @param files iterable of paths to files, which is consumed as we go
+        @param directories iterable of paths to directories. Directories which are not empty are kept.
+        @return this instance, with num_files, num_directories, num_skipped and num_failed set accordingly"""
+        self.num_files = self.num_directories = self.num_skipped = self.num_failed = 0
+        self._done = set()
+        self._limiter = self.max_iops and _RateLimiter(self.max_iops) or None
+        self._open_journal()
+        try:
+            self._run_parallel('f', files)
+
+            # Children must be gone before their parent can be removed, which is why we handle one level after another
+            levels = dict()
+            for path in set(directories):
+                path = path.rstrip(os.sep) or os.sep
+                levels.setdefault(path.count(os.sep), list()).append(path)
+            # end for each directory
+            for depth in sorted(levels.keys(), reverse=True):
+                self._run_parallel('d', levels[depth])
+                if self._journal is not None:
+                    self._journal.flush()
+                # end keep journal current
+            # end for each level
+        finally:
+            self._close_journal()
+        # end assure journal is closed
+
+        self._log("%s %i files and %i directories, skipped %i, failed %i"
+                        % (self.dry_run and 'Would have removed' or 'Removed', self.num_files,
+                           self.num_directories, self.num_skipped, self.num_failed))
+        return self
+
+    ## -- End Interface -- @}
+
+# end class DeletionExecutor
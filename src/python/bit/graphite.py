@@ -0,0 +1,346 @@
+#-*-coding:utf-8-*-
+"""
+@package bit.graphite
+@brief A sender of samples to graphite's carbon daemon, which doesn't block its callers
+
+@author Sebastian Thiel
+@copyright [GNU Lesser General Public License](https://www.gnu.org/licenses/lgpl.html)
+"""
+__all__ = ['GraphiteSender']
+
+import os
+import sys
+import socket
+import threading
+import Queue
+from time import time
+from struct import (pack,
+                    unpack)
+
+from butility.compat import pickle
+from .utility import CARBON_PORT
+
+
+## Put into the queue to make the sender thread stop
+_STOP = object()
+
+
+class GraphiteSender(object):
+    """Sends samples to carbon using its pickle protocol, through a persistent connection maintained by a
+    background thread.
+
+    Samples are queued by submit(), which doesn't block unless asked to. The thread sends them in batches of
+    batch_size samples, or whatever it has batch_interval seconds after the first sample of a batch arrived.
+
+    If carbon can't be reached, the connection is retried with exponentially growing delays. Batches which
+    can't be sent in the meanwhile are dropped, or written to a spill file if spill_path is set. Spilled batches
+    are sent first once carbon is reachable again, by this or any future sender using the same spill file.
+    """
+    __slots__ = (
+                    'host',             # name of the carbon host
+                    'port',             # port of the carbon pickle receiver
+                    'batch_size',       # maximum amount of samples to send at once
+                    'batch_interval',   # maximum seconds to wait for a batch to fill up
+                    'spill_path',       # path to file for batches we couldn't send, or None to drop them
+                    'max_spill_size',   # maximum size of the spill file in bytes, or 0 if unlimited
+                    'timeout',          # seconds to wait for connecting and sending
+                    'min_backoff',      # seconds to wait before reconnecting after the first failure
+                    'max_backoff',      # maximum seconds to wait before reconnecting
+                    'log',              # function to write messages to
+                    'num_sent',         # amount of samples sent
+                    'num_spilled',      # amount of samples written to the spill file
+                    'num_dropped',      # amount of samples we couldn't send or spill
+                    'num_rejected',     # amount of samples not accepted by submit() as the queue was full
+                    'num_connects',     # amount of successful connection attempts
+                    '_queue',           # a bounded Queue with samples to send
+                    '_thread',          # the thread sending samples, or None if it wasn't started
+                    '_lock',            # protects the thread startup
+                    '_sock',            # our connection, or None
+                    '_backoff',         # seconds we waited before the current connection attempt
+                    '_next_connect'     # time at which we may try to connect next
+                )
+
+    def __init__(self, host, port = CARBON_PORT, max_queue_size = 100000, batch_size = 1000, batch_interval = 1.0,
+                 spill_path = None, max_spill_size = 64 * 1024**2, timeout = 10.0, min_backoff = 1.0,
+                 max_backoff = 60.0, log = sys.stderr.write):
+        """Initialize this instance. The background thread is started by the first call to submit()
+        @param max_queue_size maximum amount of samples we queue
+        @param log f(message) to write information about connection failures to"""
+        assert batch_size > 0 and max_queue_size > 0
+        self.host = host
+        self.port = port
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.spill_path = spill_path
+        self.max_spill_size = max_spill_size
+        self.timeout = timeout
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.log = log
+        self.num_sent = self.num_spilled = self.num_dropped = self.num_rejected = self.num_connects = 0
+
+        self._queue = Queue.Queue(max_queue_size)
+        self._thread = None
+        self._lock = threading.Lock()
+        self._sock = None
+        self._backoff = 0.0
+        self._next_connect = 0.0
+
+    # -------------------------
+    ## @name Connection Utilities
+    # @{
+
+    def _failed(self, err):
+        """Drop our connection after the given error, and schedule the next connection attempt"""
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+        # end close socket
+        self._backoff = min(max(self._backoff * 2, self.min_backoff), self.max_backoff)
+        self._next_connect = time() + self._backoff
+        self.log("Failed to send samples to carbon at %s:%i (%s) - retrying in %.1fs\n"
+                                                            % (self.host, self.port, err, self._backoff))
+
+    def _connect(self):
+        """@return True if we are connected. Otherwise, we try to connect unless we are backing off"""
+        if self._sock is not None:
+            return True
+        # end handle connected
+        if time() < self._next_connect:
+            return False
+        # end handle backoff
+
+        try:
+            self._sock = socket.create_connection((self.host, self.port), self.timeout)
+        except socket.error, err:
+            self._failed(err)
+            return False
+        # end handle connection errors
+        self._backoff = 0.0
+        self.num_connects += 1
+        return True
+
+    def _send(self, message):
+        """@return True if the given message was sent"""
+        if not self._connect():
+            return False
+        # end handle no connection
+        try:
+            self._sock.sendall(message)
+        except socket.error, err:
+            self._failed(err)
+            return False
+        # end handle send errors
+        return True
+
+    ## -- End Connection Utilities -- @}
+
+    # -------------------------
+    ## @name Spill Utilities
+    # @{
+
+    def _spill(self, message):
+        """@return True if the given message could be written to the spill file"""
+        try:
+            size = os.path.isfile(self.spill_path) and os.path.getsize(self.spill_path) or 0
+            if self.max_spill_size and size + len(message) > self.max_spill_size:
+                return False
+            # end handle spill file full
+            fp = open(self.spill_path, 'ab')
+            try:
+                fp.write(message)
+            finally:
+                fp.close()
+            # end assure file is closed
+        except (OSError, IOError), err:
+            self.log("Failed to spill samples to '%s': %s\n" % (self.spill_path, err))
+            return False
+        # end handle io errors
+        return True
+
+    def _send_spilled(self):
+        """Send all messages in our spill file, and remove it
+        @return True if there are no spilled messages left"""
+        if not self.spill_path or not os.path.isfile(self.spill_path):
+            return True
+        # end handle no spill file
+        if not self._connect():
+            return False
+        # end handle no connection
+
+        fp = open(self.spill_path, 'rb')
+        try:
+            data = fp.read()
+        finally:
+            fp.close()
+        # end assure file is closed
+
+        offset = 0
+        # an incomplete message at the end can only be the result of an interrupted write, and is ignored
+        while len(data) - offset >= 4:
+            end = offset + 4 + unpack('!L', data[offset:offset+4])[0]
+            if end > len(data):
+                break
+            # end handle incomplete message
+            if not self._send(data[offset:end]):
+                fp = open(self.spill_path, 'wb')
+                try:
+                    fp.write(data[offset:])
+                finally:
+                    fp.close()
+                # end keep messages we didn't send
+                return False
+            # end handle send failure
+            offset = end
+        # end for each message
+        os.remove(self.spill_path)
+        return True
+
+    ## -- End Spill Utilities -- @}
+
+    # -------------------------
+    ## @name Thread Utilities
+    # @{
+
+    @classmethod
+    def _message(cls, samples):
+        """@return the given samples as message for carbon's pickle receiver"""
+        payload = pickle.dumps(samples, pickle.HIGHEST_PROTOCOL)
+        return pack('!L', len(payload)) + payload
+
+    def _handle_batch(self, batch):
+        """Send the given batch of samples, or spill or drop it if that's not possible"""
+        message = self._message(batch)
+        if self._send_spilled() and self._send(message):
+            self.num_sent += len(batch)
+        elif self.spill_path and self._spill(message):
+            self.num_spilled += len(batch)
+        else:
+            self.num_dropped += len(batch)
+        # end handle send failure
+
+    def _run(self):
+        """Send batches of queued samples until we are asked to stop"""
+        queue = self._queue
+        stop = False
+        while not stop:
+            batch = list()
+            item = queue.get()
+            deadline = time() + self.batch_interval
+            while True:
+                if item is _STOP:
+                    stop = True
+                    queue.task_done()
+                    break
+                # end handle stop
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                # end handle batch full
+                remaining = deadline - time()
+                try:
+                    item = queue.get(remaining > 0, max(remaining, 0))
+                except Queue.Empty:
+                    break
+                # end handle batch interval over
+            # end while filling the batch
+
+            if batch:
+                try:
+                    self._handle_batch(batch)
+                finally:
+                    for item in batch:
+                        queue.task_done()
+                    # end for each item
+                # end assure we don't block flush()
+            # end handle batch
+        # end while we shouldn't stop
+
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+        # end close connection
+
+    ## -- End Thread Utilities -- @}
+
+    # -------------------------
+    ## @name Interface
+    # @{
+
+    def submit(self, samples, block = False):
+        """Queue the given samples for sending
+        @param samples iterable of samples like [(path, (unix_timestamp, numeric))], as for graphite_submit()
+        @param block if True, wait until there is room in the queue. Otherwise, samples which don't fit
+        are rejected
+        @return amount of queued samples"""
+        self._lock.acquire()
+        try:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='GraphiteSender')
+                self._thread.daemon = True
+                self._thread.start()
+            # end start thread
+        finally:
+            self._lock.release()
+        # end assure lock is released
+
+        put = self._queue.put
+        count = 0
+        for sample in samples:
+            try:
+                put(sample, block)
+            except Queue.Full:
+                self.num_rejected += 1
+                continue
+            # end handle full queue
+            count += 1
+        # end for each sample
+        return count
+
+    def flush(self, timeout = None):
+        """Wait until all samples submitted so far were sent, spilled or dropped
+        @param timeout if not None, maximum amount of seconds to wait
+        @return True if all samples were handled, False if the timeout was hit"""
+        queue = self._queue
+        end = timeout is not None and time() + timeout
+        queue.all_tasks_done.acquire()
+        try:
+            while queue.unfinished_tasks:
+                remaining = None
+                if timeout is not None:
+                    remaining = end - time()
+                    if remaining <= 0:
+                        return False
+                    # end handle timeout
+                # end compute remaining time
+                queue.all_tasks_done.wait(remaining)
+            # end while there is work
+        finally:
+            queue.all_tasks_done.release()
+        # end assure lock is released
+        return True
+
+    def close(self, timeout = None):
+        """Handle all queued samples, and stop the background thread, which also closes the connection.
+        It may be restarted by submit().
+        @param timeout if not None, maximum amount of seconds to wait. Samples which weren't handled by then
+        are lost, unless the process keeps running
+        @return True if the thread stopped in time"""
+        if self._thread is None:
+            return True
+        # end handle not started
+        try:
+            self._queue.put(_STOP, True, timeout)
+        except Queue.Full:
+            return False
+        # end handle full queue
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            return False
+        # end handle timeout
+        self._thread = None
+        return True
+
+    ## -- End Interface -- @}
+
+# end class GraphiteSender
@@ -0,0 +1,348 @@
+#-*-coding:utf-8-*-
+"""
+@package bit.pool
+@brief A pool of worker threads with prioritized, measured tasks
+
+@author Sebastian Thiel
+@copyright [GNU Lesser General Public License](https://www.gnu.org/licenses/lgpl.html)
+"""
+__all__ = ['TaskQueue', 'WorkerPool', 'LaneStats']
+
+import inspect
+import threading
+import Queue
+from time import time
+from collections import (deque,
+                         namedtuple)
+
+from .utility import WorkerThread
+
+
+## Statistics about all tasks of a lane which ran so far, with times in seconds
+# * num_tasks - amount of tasks that ran
+# * num_failed - amount of tasks which raised an exception
+# * wait_time - total time tasks waited in the queue
+# * max_wait_time - longest time a task waited in the queue
+# * run_time - total time tasks ran
+# * max_run_time - longest time a task ran
+LaneStats = namedtuple('LaneStats', ('num_tasks', 'num_failed', 'wait_time', 'max_wait_time', 'run_time',
+                                     'max_run_time'))
+
+
+class _Task(object):
+    """A task as parsed by WorkerThread, along with the information we need to measure it"""
+    __slots__ = ('routine', 'args', 'kwargs', 'lane', 'queued_at')
+
+    def __init__(self, routine, args, kwargs, lane):
+        self.routine = routine
+        self.args = args
+        self.kwargs = kwargs
+        self.lane = lane
+        self.queued_at = time()
+
+# end class _Task
+
+
+class TaskQueue(Queue.Queue):
+    """A Queue for WorkerThreads, which hands out tasks of lanes with higher priority first, and tasks of the same
+    lane in the order they were put.
+
+    All tasks understood by WorkerThread are supported. They are wrapped to measure how long they waited, and how
+    long they ran. The last lane, control_lane, is meant for tasks which quit WorkerThreads, which will only
+    see them once all other tasks were handed out.
+
+    If maxsize is set, put() blocks while the queue is full, or raises Queue.Full if it shouldn't block.
+    """
+
+    # -------------------------
+    ## @name Constants
+    # @{
+
+    PRIORITY_HIGH = 0
+    PRIORITY_NORMAL = 1
+    PRIORITY_LOW = 2
+
+    ## -- End Constants -- @}
+
+    def __init__(self, maxsize = 0, num_lanes = 3, default_lane = PRIORITY_NORMAL):
+        """Initialize this instance
+        @param maxsize maximum amount of tasks to hold, or 0 if unbounded
+        @param num_lanes amount of lanes for tasks, with lane 0 having the highest priority
+        @param default_lane the lane to put tasks into if no lane is specified"""
+        assert 0 <= default_lane < num_lanes, "default_lane must be one of our lanes"
+        self.num_lanes = num_lanes
+        self.control_lane = num_lanes
+        self.default_lane = default_lane
+        self._stats = [[0, 0, 0.0, 0.0, 0.0, 0.0] for lane in xrange(num_lanes)]
+        self._stats_lock = threading.Lock()
+        Queue.Queue.__init__(self, maxsize)
+
+    # -------------------------
+    ## @name Queue Overrides
+    # @{
+
+    def _init(self, maxsize):
+        # a deque per lane, holding (is_wrapped, task) tuples
+        self.queue = [deque() for lane in xrange(self.num_lanes + 1)]
+
+    def _qsize(self, len=len):
+        return sum(len(lane) for lane in self.queue)
+
+    def _put(self, item):
+        lane, wrapped, task = item
+        self.queue[lane].append((wrapped, task))
+
+    def _get(self):
+        for lane in self.queue:
+            if lane:
+                wrapped, task = lane.popleft()
+                break
+            # end handle non-empty lane
+        # end for each lane
+        if not wrapped:
+            # Nobody will call task_done() for tasks we don't understand
+            self.unfinished_tasks -= 1
+            if not self.unfinished_tasks:
+                self.all_tasks_done.notify_all()
+            # end notify waiters
+        # end handle tasks we didn't wrap
+        return task
+
+    ## -- End Queue Overrides -- @}
+
+    # -------------------------
+    ## @name Utilities
+    # @{
+
+    def _run_task(self, task):
+        """Run the given task in the calling WorkerThread, and keep statistics"""
+        started = time()
+        failed = True
+        try:
+            rval = threading.current_thread()._call_routine(task.routine, task.args, task.kwargs)
+            failed = False
+            return rval
+        except WorkerThread.QuitException:
+            failed = None
+            raise
+        finally:
+            if failed is not None and task.lane < self.num_lanes:
+                wait_time = started - task.queued_at
+                run_time = time() - started
+                self._stats_lock.acquire()
+                try:
+                    stats = self._stats[task.lane]
+                    stats[0] += 1
+                    stats[1] += failed
+                    stats[2] += wait_time
+                    stats[3] = max(stats[3], wait_time)
+                    stats[4] += run_time
+                    stats[5] = max(stats[5], run_time)
+                finally:
+                    self._stats_lock.release()
+                # end assure lock is released
+            # end record statistics
+            self.task_done()
+        # end measure task
+
+    ## -- End Utilities -- @}
+
+    # -------------------------
+    ## @name Interface
+    # @{
+
+    def put(self, item, block = True, timeout = None, lane = None):
+        """Put the given task into the given lane, see Queue.put()
+        @param item a task as understood by WorkerThread
+        @param lane the lane to put the task into, defaults to our default_lane"""
+        if lane is None:
+            lane = self.default_lane
+        # end handle default lane
+        assert 0 <= lane <= self.control_lane, "invalid lane: %i" % lane
+
+        wrapped = False
+        routine, args, kwargs = WorkerThread._parse_task(item)
+        if inspect.isroutine(routine):
+            item = (self._run_task, (_Task(routine, args, kwargs, lane), ))
+            wrapped = True
+        # end wrap tasks we understand
+        Queue.Queue.put(self, (lane, wrapped, item), block, timeout)
+
+    def clear(self):
+        """Remove all tasks which weren't handed out yet, except for the ones in the control lane
+        @return amount of removed tasks"""
+        self.mutex.acquire()
+        try:
+            count = 0
+            for lane in self.queue[:self.control_lane]:
+                count += len(lane)
+                lane.clear()
+            # end for each lane to clear
+            self.unfinished_tasks -= count
+            if not self.unfinished_tasks:
+                self.all_tasks_done.notify_all()
+            # end notify waiters
+            self.not_full.notify_all()
+        finally:
+            self.mutex.release()
+        # end assure lock is released
+        return count
+
+    def wait_until_done(self, timeout = None):
+        """Wait until all tasks put so far finished running
+        @param timeout if not None, maximum amount of seconds to wait
+        @return True if all tasks are done, False if the timeout was hit"""
+        end = timeout is not None and time() + timeout
+        self.all_tasks_done.acquire()
+        try:
+            while self.unfinished_tasks:
+                remaining = None
+                if timeout is not None:
+                    remaining = end - time()
+                    if remaining <= 0:
+                        return False
+                    # end handle timeout
+                # end compute remaining time
+                self.all_tasks_done.wait(remaining)
+            # end while there are tasks
+        finally:
+            self.all_tasks_done.release()
+        # end assure lock is released
+        return True
+
+    def stats(self):
+        """@return a list with a LaneStats instance for each of our lanes, except for the control lane"""
+        self._stats_lock.acquire()
+        try:
+            return [LaneStats(*stats) for stats in self._stats]
+        finally:
+            self._stats_lock.release()
+        # end assure lock is released
+
+    ## -- End Interface -- @}
+
+# end class TaskQueue
+
+
+class WorkerPool(object):
+    """A pool of WorkerThreads sharing a TaskQueue. Each idle worker takes the next task of the lane with the
+    highest priority, which keeps all workers busy as long as there are tasks.
+
+    Tasks are put into the queue like with WorkerThread.call(), and results or exceptions of tasks end up in the
+    output queue, like they do for a WorkerThread. Use cancel() to let all workers stop once the queue is drained,
+    and join() to wait for them.
+    """
+    __slots__ = (
+                    'queue',            # the TaskQueue all workers pull from
+                    'outq',             # a Queue receiving the results of all tasks
+                    'workers',          # a list of all our WorkerThreads
+                    '_log',             # a logger for our workers
+                    '_num_workers',     # amount of workers to start
+                    '_worker_type',     # the WorkerThread type to instantiate
+                    '_name_format',     # format for the name of each worker, with its index
+                    '_worker_kwargs'    # additional keyword arguments for each worker
+                )
+
+    def __init__(self, log, num_workers, worker_type = WorkerThread, queue = None, outq = None,
+                 name_format = 'worker-%i', **worker_kwargs):
+        """Initialize this instance. Workers are started by start()
+        @param log a logger, as used by WorkerThread
+        @param num_workers amount of workers to start
+        @param worker_type a WorkerThread compatible type
+        @param queue a TaskQueue, or None to create a new one
+        @param outq a Queue for results, or None to create a new one
+        @param name_format a format string with a single integer for the name of each worker
+        @param worker_kwargs passed to each worker upon instantiation"""
+        assert num_workers > 0, "need at least one worker"
+        if queue is None:
+            queue = TaskQueue()
+        # end handle queue
+        self.queue = queue
+        self.outq = outq or Queue.Queue()
+        self.workers = list()
+        self._log = log
+        self._num_workers = num_workers
+        self._worker_type = worker_type
+        self._name_format = name_format
+        self._worker_kwargs = worker_kwargs
+
+    # -------------------------
+    ## @name Interface
+    # @{
+
+    def start(self):
+        """Start all our workers as daemon threads
+        @return this instance"""
+        for wid in xrange(self._num_workers):
+            worker = self._worker_type(self._log, self.queue, self.outq, **self._worker_kwargs)
+            worker.daemon = True
+            worker.name = self._name_format % wid
+            self._log.info("Starting thread %s" % worker.name)
+            worker.start()
+            self.workers.append(worker)
+        # end for each worker to start
+        return self
+
+    def call(self, function, *args, **kwargs):
+        """Like WorkerThread.call(), but the function is called by the next idle worker
+        @return this instance"""
+        self.queue.put((function, args, kwargs))
+        return self
+
+    def call_in_lane(self, lane, function, *args, **kwargs):
+        """Like call(), but puts the task into the given lane of our queue
+        @return this instance"""
+        self.queue.put((function, args, kwargs), lane=lane)
+        return self
+
+    def drain(self, timeout = None):
+        """Wait until all queued tasks are done
+        @return True if they are, False if the timeout was hit"""
+        return self.queue.wait_until_done(timeout)
+
+    def cancel(self, drain = True):
+        """Ask all workers to stop. This method doesn't block
+        @param drain if True, workers stop once all queued tasks are done. Otherwise, all tasks which didn't
+        start yet are discarded
+        @return this instance"""
+        if not drain:
+            self._log.info("Discarded %i queued tasks", self.queue.clear())
+        # end handle drain
+        for worker in self.workers:
+            self.queue.put(WorkerThread.quit, lane=self.queue.control_lane)
+            self._log.info("Canceled thread %s", worker.name)
+        # end for each worker
+        return self
+
+    def join(self, timeout = None):
+        """Wait for all workers to stop, after cancel() was called
+        @param timeout if not None, maximum amount of seconds to wait
+        @return list of workers which are still running"""
+        end = timeout is not None and time() + timeout
+        for worker in self.workers:
+            remaining = None
+            if timeout is not None:
+                remaining = max(end - time(), 0.0)
+            # end compute remaining time
+            worker.join(remaining)
+        # end for each worker
+        self.workers = [worker for worker in self.workers if worker.is_alive()]
+        return self.workers
+
+    def log_stats(self):
+        """Log the statistics of our queue's lanes, for all lanes which had tasks
+        @return this instance"""
+        for lane, stats in enumerate(self.queue.stats()):
+            if not stats.num_tasks:
+                continue
+            # end skip unused lanes
+            self._log.info("Lane %i: %i tasks (%i failed), wait avg %.03fs max %.03fs, run avg %.03fs max %.03fs",
+                           lane, stats.num_tasks, stats.num_failed,
+                           stats.wait_time / stats.num_tasks, stats.max_wait_time,
+                           stats.run_time / stats.num_tasks, stats.max_run_time)
+        # end for each lane
+        return self
+
+    ## -- End Interface -- @}
+
+# end class WorkerPool
@@ -10,3 +10,4 @@ from .base import *
 from .version import *
 from .io_stat import *
 from .file_prune import *
+from .retention_simulation import *
@@ -8,6 +8,12 @@
 """
 __all__ = ['ReportGenerator', 'Report']
 
+import marshal
+from itertools import (chain,
+                       islice,
+                       izip)
+from tempfile import TemporaryFile
+
 from bit.utility import Table
 from bapp import ApplicationSettingsMixin
 from bkvstore import KeyValueStoreSchema
@@ -36,9 +42,15 @@ class Report(Table):
     ## @name Interface
     # @{
 
-    def serialize(self, mode, writer, column_names=True):
+    def serialize(self, mode, writer, column_names=True, window=None):
         """Serialize this instance in the given mode to the given writer, which will be handed the text to write.
+        Records may be a list, or any iterator, see ReportGenerator.generate_stream().
         @param column_names if True, columns names will be printed as first line
+        @param window if None, column widths in tty mode will be exact, which requires all converted records 
+        to be known before writing the first one. Records which are not a list will be spooled to a temporary file,
+        lists are converted twice instead.
+        Otherwise, it is the amount of records to look at before writing anything. Columns will grow if larger 
+        values are encountered afterwards, keeping the memory used bounded.
         @return this instance"""
         if self.is_empty():
             return self
@@ -54,7 +66,6 @@ class Report(Table):
                 writer(sep.join(colnames) + '\n')
             # end handle column names
             for rec in recs:
-                converted = list()
                 for vid, val in enumerate(rec):
                     if vid > 0:
                         writer(sep)
@@ -63,16 +74,36 @@ class Report(Table):
                 writer('\n')
             # end for each record
         elif mode == self.SERIALIZE_TTY:
-            # TODO: pre-compute required column sizes and print accordingly
-            widths = [0] * len(colnames)
-            for cid, name in enumerate(colnames):
-                widths[cid] = len(name)
-            # end for each column
-            for rec in recs:
-                for vid, val in enumerate(rec):
-                    widths[vid] = max(widths[vid], len(str(cols[vid][2](val))))
-                # end for each value
-            # end for each record
+            widths = [len(name) for name in colnames]
+            converters = [t[2] for t in cols]
+
+            def converted(records):
+                """Convert each value, and keep track of the column widths"""
+                for rec in records:
+                    strings = [str(conv(val)) for conv, val in izip(converters, rec)]
+                    for cid, string in enumerate(strings):
+                        if len(string) > widths[cid]:
+                            widths[cid] = len(string)
+                        # end grow column
+                    # end for each string
+                    yield strings
+                # end for each record
+            # end converter
+
+            if window is None:
+                if isinstance(recs, list):
+                    # compute the widths without keeping the strings, and convert again while writing
+                    for strings in converted(recs):
+                        pass
+                    # end for each record
+                    recs = converted(recs)
+                else:
+                    recs = self._spooled(converted(recs))
+                # end handle records type
+            else:
+                recs = converted(recs)
+                recs = chain(list(islice(recs, window)), recs)
+            # end handle column sizing
 
             tab = '  '
             space = ' '
@@ -96,9 +127,9 @@ class Report(Table):
                 # end for each column
             # end handle column names
 
-            for rec in recs:
-                for vid, val in enumerate(rec):
-                    write_col(vid, str(cols[vid][2](val)))
+            for strings in recs:
+                for cid, string in enumerate(strings):
+                    write_col(cid, string)
                 # end for each value
             # end for each record
         else:
@@ -106,7 +137,54 @@ class Report(Table):
         # end handle mode
 
         return self
+
+    def is_empty(self):
+        """@return True if the table has no content.
+        @note if records is an iterator, its first record will be read to find out"""
+        if isinstance(self.records, list):
+            return super(Report, self).is_empty()
+        # end handle list
+        records = iter(self.records)
+        try:
+            first = records.next()
+        except StopIteration:
+            self.records = list()
+            return True
+        # end handle no records
+        self.records = chain((first, ), records)
+        return False
+
     ## -- End Interface -- @}
+
+    # -------------------------
+    ## @name Utilities
+    # @{
+
+    @classmethod
+    def _spooled(cls, records):
+        """Write all given records into a temporary file, and read them back
+        @param records iterator yielding marshallable records
+        @return iterator yielding all records in the order they were written"""
+        spool = TemporaryFile(prefix='report_')
+        for rec in records:
+            marshal.dump(rec, spool)
+        # end for each record
+        spool.seek(0)
+
+        def read():
+            try:
+                while True:
+                    yield marshal.load(spool)
+                # end for each record
+            except EOFError:
+                pass
+            finally:
+                spool.close()
+            # end assure spool is removed
+        # end reader
+        return read()
+
+    ## -- End Utilities -- @}
 # end class Report
 
 
@@ -143,6 +221,9 @@ class ReportGenerator(ApplicationSettingsMixin):
 
     ## Keyname for kvstore at which to store configuration values for all reports
     REPORT_ROOT_KEY = 'itool.report'
+
+    ## The word which must be passed to actually delete something, be it by fix script or by the deletion executor
+    DELETE_MAGIC = 'DOIT'
     
     ## -- End Constants -- @}
 
@@ -197,12 +278,32 @@ class ReportGenerator(ApplicationSettingsMixin):
         """Produce the report based on this instance's configuration
         @return a Report instance, which must be an instance of self.ReportType"""
         
+    def generate_stream(self):
+        """Produce the report based on this instance's configuration, allowing its records to be serialized while
+        they are being generated. Use it if the report is serialized only.
+        @return a Report instance like generate(), whose records may be an iterator which can be consumed only once.
+        @note default implementation returns generate()"""
+        return self.generate()
+        
     @abstractmethod
     def generate_fix_script(self, report, writer):
         """Based on the given report (as previously generated by this instance, produce a shell script to stream
             which would be able to fix the issue if executed on the right host.
         @return True if a script was generated, False if this is not implemented.
         """
+
+    def fix_deletions(self, report):
+        """Based on the given report, as previously generated by this instance, provide all paths which would be
+        removed by the script of generate_fix_script(), for use with a bit.deletion.DeletionExecutor.
+        @return None if this is not implemented, or a tuple of (files, directories) iterables. directories may
+        only be complete once files was iterated.
+        @note default implementation returns None"""
+        return None
+
+    @classmethod
+    def supports_fix_deletions(cls):
+        """@return True if our type implements fix_deletions()"""
+        return cls.fix_deletions.im_func is not ReportGenerator.fix_deletions.im_func
         
     ## -- End Interface -- @}
 
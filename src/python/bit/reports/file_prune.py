@@ -53,9 +53,12 @@ class FilePruneReportGenerator(ReportGenerator, bapp.plugin_type()):
                         ('reason', str, str),
                     )
 
+    ## The command removing files in scripts, which is what fix_deletions() does as well
+    DEFAULT_FILE_REMOVE_COMMAND = "rm -vf"
+
     _schema = ReportGenerator._make_schema(type_name, dict(file_glob="*.rpm", # glob by which to find files of interest
                                                                script=dict(remove_symlink_destination = True,
-                                                                           file_remove_command = "rm -vf"
+                                                                           file_remove_command = DEFAULT_FILE_REMOVE_COMMAND
                                                                             )
                                                           ))
 
@@ -75,8 +78,8 @@ class FilePruneReportGenerator(ReportGenerator, bapp.plugin_type()):
         
     def _build_report(self, config, args):
         """@return TBD"""
-        report = self.ReportType(columns=self.report_schema)
-        record = report.records.append
+        report = self.ReportType(columns=self.report_schema, aggregate=True)
+        record = report.append_record
 
         repo = dict()
         prune_candidates = list()
@@ -196,6 +199,34 @@ class FilePruneReportGenerator(ReportGenerator, bapp.plugin_type()):
         writer('DIRS\n')
         writer('echo "Removed up to %i files and %i directories"\n' % (fcount, dcount))
         return True
+
+    def fix_deletions(self, report):
+        """Provide the same files and directories generate_fix_script() would remove
+        @throw InputError if files are not removed by the default command, which we couldn't honor"""
+        config = self.configuration()
+        if config.script.file_remove_command != self.DEFAULT_FILE_REMOVE_COMMAND:
+            raise InputError("Files would be removed by '%s' instead of '%s' - use generate-script instead"
+                             % (config.script.file_remove_command, self.DEFAULT_FILE_REMOVE_COMMAND))
+        # end refuse custom remove commands
+        directories = set()
+
+        def files():
+            for fn, path, size, mode, reason in report.records:
+                if not isinstance(path, Path):
+                    continue
+                # end safely skip aggregate
+                dir = path.dirname()
+                directories.add(dir)
+                yield path
+
+                # The script resolves relative destinations in the directory of the link
+                if config.script.remove_symlink_destination and S_ISLNK(mode):
+                    yield dir / path.readlink()
+                # end handle symlink removal
+            # end for each entry
+        # end files
+
+        return files(), directories
     
     ## -- End Interface Implementation -- @}
 
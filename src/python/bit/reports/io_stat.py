@@ -8,15 +8,23 @@
 """
 __all__ = ['IOStatReportGenerator']
 
+import os
 import sys
 import socket
+import signal
 import tempfile
 import random
 import mmap
+import ctypes
+import ctypes.util
+import threading
+import multiprocessing
+import Queue
 from time import (time, 
                   sleep)
 
 from butility import (Path,
+                      DictObject,
                       size_to_int,
                       int_to_size_string)
 from .base import ReportGenerator
@@ -50,6 +58,7 @@ class StressorTerminatableThread(TerminatableThread):
                 'elapsed_write_volume',       # time it took to re-write the file randomly
                 'file_size',                # size of file we actually generated
                 'read_volume',              # Amount of bytes randomly read
+                'write_volume',             # Amount of bytes randomly written
                 'exception'                 # Error thrown if we failed
                 )
 
@@ -152,6 +161,7 @@ class StressorTerminatableThread(TerminatableThread):
                             source.flush()
                         # end handle mmap, file
                         self.elapsed_write_volume += time() - st
+                        self.write_volume += len(last_data)
                     #end handle writes
 
                     vr += len(data)
@@ -267,7 +277,7 @@ class StressorTerminatableThread(TerminatableThread):
         self.elapsed_file_generate_write = self.elapsed_file_generate_read = 0
         self.elapsed_file_generate = 0
         self.elapsed_read_volume = self.elapsed_write_volume = 0
-        self.file_size = self.read_volume = 0
+        self.file_size = self.read_volume = self.write_volume = 0
         self.exception = None
         
     
@@ -275,6 +285,262 @@ class StressorTerminatableThread(TerminatableThread):
 
 # end class StressorTerminatableThread
 
+
+## Alignment of buffers, offsets and sizes for IO bypassing the FS cache (O_DIRECT)
+DIRECT_IO_ALIGNMENT = 4096
+
+_libc = None
+
+def libc():
+    """@return the C library, with the system calls we need for unbuffered positional IO configured.
+    They release the GIL, which allows a process to have multiple requests in flight"""
+    global _libc
+    if _libc is None:
+        lib = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        for name in ('pread', 'pwrite'):
+            fun = getattr(lib, name + '64', None) or getattr(lib, name)
+            fun.argtypes = (ctypes.c_int, ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int64)
+            fun.restype = ctypes.c_ssize_t
+            setattr(lib, name, fun)
+        # end for each positional call
+        lib.read.argtypes = (ctypes.c_int, ctypes.c_void_p, ctypes.c_size_t)
+        lib.read.restype = ctypes.c_ssize_t
+        _libc = lib
+    # end initialize library
+    return _libc
+
+def checked(rval):
+    """@return the given return value of a system call, or raise an OSError if it indicates failure"""
+    if rval < 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno))
+    # end handle failure
+    return rval
+
+
+class AlignedBuffer(object):
+    """A buffer whose memory is aligned as required by O_DIRECT"""
+    __slots__ = ('_data',   # the ctypes buffer holding our memory
+                 'address', # aligned address of the first byte of the buffer
+                 'size'     # size of the buffer in bytes
+                )
+
+    def __init__(self, size, alignment = DIRECT_IO_ALIGNMENT):
+        self._data = ctypes.create_string_buffer(size + alignment)
+        address = ctypes.addressof(self._data)
+        self.address = address + (-address % alignment)
+        self.size = size
+
+# end class AlignedBuffer
+
+
+class StressorProcess(multiprocessing.Process):
+    """Performs the stress test in its own process, without being limited by the GIL or python's file objects.
+
+    The file is generated sequentially, to be accessed by queue_depth threads which keep one request in flight each.
+    Requests are random or sequential, reads or writes, as configured. With direct_io, all IO bypasses the FS cache.
+
+    Results are put into the results queue as dict with one entry per name in metric_names.
+    """
+
+    ## Names of all metrics we measure, matching those of the StressorTerminatableThread
+    metric_names = ('name',
+                    'elapsed_file_generate_read', 'elapsed_file_generate_write', 'elapsed_file_generate',
+                    'elapsed_read_volume', 'elapsed_write_volume',
+                    'file_size', 'read_volume', 'write_volume', 'exception')
+
+    def __init__(self, config, results, cancel_event):
+        """Initialize this instance
+        @param config sanitized configuration of the IOStatReportGenerator
+        @param results multiprocessing.Queue to put our metrics into
+        @param cancel_event multiprocessing.Event, which is set if we should stop as soon as possible"""
+        super(StressorProcess, self).__init__()
+        self.config = config
+        self._results = results
+        self._cancel = cancel_event
+        self.reset()
+
+    # -------------------------
+    ## @name Utilities
+    # @{
+
+    def _unique_file_name(self):
+        """@return descriptive and quite unique filename"""
+        prefix = 'io-test_%s_%s' % (socket.gethostname(), self.name)
+        return tempfile.mktemp(prefix=prefix, suffix='.map', dir=str(self.config.output_dir))
+
+    def _fill(self, source, buf, size):
+        """Read size bytes from the given source file descriptor into buf, rewinding it as needed"""
+        filled = 0
+        rewound = False
+        while filled < size:
+            count = checked(libc().read(source, buf.address + filled, size - filled))
+            if not count:
+                if rewound:
+                    raise ValueError("Source at '%s' doesn't provide any data" % self.config.source_path)
+                # end handle empty source
+                os.lseek(source, 0, os.SEEK_SET)
+                rewound = True
+                continue
+            # end handle end of source
+            rewound = False
+            filled += count
+        # end while the buffer isn't full
+
+    def _generate(self, fd):
+        """Write file_size bytes read from our source into the given file descriptor
+        @return amount of bytes written"""
+        config = self.config
+        buf = AlignedBuffer(config.write_chunk_size)
+        source = os.open(str(config.source_path), os.O_RDONLY)
+        written = 0
+        try:
+            while written < config.file_size and not self._cancel.is_set():
+                size = min(buf.size, config.file_size - written)
+                st = time()
+                self._fill(source, buf, size)
+                self.elapsed_file_generate_read += time() - st
+
+                st = time()
+                written += checked(libc().pwrite(fd, buf.address, size, written))
+                self.elapsed_file_generate_write += time() - st
+            # end while there is something to write
+        finally:
+            os.close(source)
+        # end assure source is closed
+        return written
+
+    def _issue_requests(self, fd, buf, tid, count, volumes, errors):
+        """Issue count requests on the given file descriptor, using the given buffer for reading and writing, 
+        and add the bytes read and written to volumes. Exceptions are appended to errors"""
+        config = self.config
+        pread, pwrite = libc().pread, libc().pwrite
+        rng = random.Random()
+        num_blocks = self.file_size / buf.size
+        # each thread reads sequentially from its own region of the file
+        block = num_blocks * tid / config.queue_depth
+        try:
+            for rid in xrange(count):
+                if self._cancel.is_set():
+                    break
+                # end handle cancellation
+                if rng.random() < config.random_ratio:
+                    block = rng.randrange(num_blocks)
+                else:
+                    block = (block + 1) % num_blocks
+                # end handle access pattern
+                if rng.random() < config.read_ratio:
+                    volumes[0] += checked(pread(fd, buf.address, buf.size, block * buf.size))
+                else:
+                    volumes[1] += checked(pwrite(fd, buf.address, buf.size, block * buf.size))
+                # end handle request type
+            # end for each request
+        except Exception, err:
+            errors.append(err)
+        # end keep exceptions
+
+    def _stress(self, fd):
+        """Issue requests until the configured volume is reached, with queue_depth requests in flight"""
+        config = self.config
+        assert self.file_size > config.random_read_chunk_size, "Chunk size must be smaller than the file"
+        qd = config.queue_depth
+        num_requests = max(config.random_read_volume / config.random_read_chunk_size, 1)
+        volumes = [[0, 0] for tid in xrange(qd)]
+        errors = list()
+
+        # Writes use what's in the buffer, which must not be zeros, as those may be compressed or become holes
+        buffers = [AlignedBuffer(config.random_read_chunk_size) for tid in xrange(qd)]
+        source = os.open(str(config.source_path), os.O_RDONLY)
+        try:
+            for buf in buffers:
+                self._fill(source, buf, buf.size)
+            # end for each buffer
+        finally:
+            os.close(source)
+        # end assure source is closed
+
+        threads = [threading.Thread(target=self._issue_requests,
+                                    args=(fd, buffers[tid], tid, num_requests / qd + (tid < num_requests % qd),
+                                          volumes[tid], errors))
+                   for tid in xrange(qd)]
+
+        st = time()
+        for thread in threads:
+            thread.start()
+        # end for each thread to start
+        for thread in threads:
+            thread.join()
+        # end for each thread to wait for
+        # Requests overlap, which is why throughput is measured against the wall-clock time
+        self.elapsed_read_volume = self.elapsed_write_volume = time() - st
+
+        if errors:
+            raise errors[0]
+        # end handle errors
+        self.read_volume = sum(v[0] for v in volumes)
+        self.write_volume = sum(v[1] for v in volumes)
+
+    ## -- End Utilities -- @}
+
+    # -------------------------
+    ## @name Subclass Interface
+    # @{
+
+    def run(self):
+        """Perform all operations, and put our metrics into the results queue"""
+        # Interruptions are handled by our parent, which will set the cancel event
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        path = self._unique_file_name()
+        flags = os.O_RDWR | os.O_CREAT | os.O_EXCL
+        if self.config.direct_io:
+            flags |= os.O_DIRECT
+        # end handle direct io
+        try:
+            try:
+                fd = os.open(path, flags, 0600)
+                try:
+                    st = time()
+                    self.file_size = self._generate(fd)
+                    self.elapsed_file_generate = time() - st
+                    if not self._cancel.is_set():
+                        self._stress(fd)
+                    # end handle cancellation
+                finally:
+                    os.close(fd)
+                # end assure file is closed
+            finally:
+                # The file may exist even if it couldn't be opened, like if the filesystem doesn't support O_DIRECT
+                if os.path.isfile(path):
+                    os.remove(path)
+                # end remove file
+            # end assure cleanup
+        except Exception, err:
+            self.exception = str(err)
+        # end keep exceptions
+        self._results.put(self.metrics())
+
+    ## -- End Subclass Interface -- @}
+
+    # -------------------------
+    ## @name Interface
+    # @{
+
+    def reset(self):
+        """Reset all internal counter variables"""
+        self.elapsed_file_generate_write = self.elapsed_file_generate_read = 0
+        self.elapsed_file_generate = 0
+        self.elapsed_read_volume = self.elapsed_write_volume = 0
+        self.file_size = self.read_volume = self.write_volume = 0
+        self.exception = None
+
+    def metrics(self):
+        """@return a dict with all our metrics"""
+        return dict((name, getattr(self, name)) for name in self.metric_names)
+
+    ## -- End Interface -- @}
+
+# end class StressorProcess
+
 ## -- End Utility Types -- @}
 
 
@@ -289,7 +555,12 @@ class IOStatReportGenerator(ReportGenerator, bapp.plugin_type()):
     * Do all of the above in X threads and collect some metrics in the process. Those should be gathered in a Report.
     * react to SIGTERM properly and make sure the test cleans up afterwards.
 
-    @note we are assuming that most of the load will be spent in IO, which is multi-threaded. If not, have to use multiprocessing
+    With engine=process, each worker is a process using unbuffered system calls instead, with queue_depth requests 
+    in flight. Its requests are a mix of random and sequential ones (random_ratio), and of reads and writes 
+    (read_ratio), amounting to random_read_volume bytes. With direct_io, the FS cache is bypassed entirely.
+
+    @note the thread engine assumes that most of the load will be spent in IO, which is multi-threaded. 
+    Use the process engine to measure the storage, and not python.
     """
     __slots__ = ('_error')
 
@@ -323,7 +594,12 @@ class IOStatReportGenerator(ReportGenerator, bapp.plugin_type()):
                                                                file_size='1g', # Size of file to generate
                                                                random_writes=0, # If True, the test will also alter the file randomly, flushing after each change
                                                                random_read_chunk_size='1m',  # chunk size when reading randomly
-                                                               random_read_volume='4g' # amount of volume to read from the file
+                                                               random_read_volume='4g', # amount of volume to read from the file
+                                                               engine='thread', # 'thread' or 'process', see our class description
+                                                               queue_depth=1, # amount of requests in flight per worker process
+                                                               direct_io=0, # If True, worker processes bypass the FS cache using O_DIRECT
+                                                               read_ratio=1.0, # fraction of requests which are reads, the others are writes
+                                                               random_ratio=1.0 # fraction of requests at random offsets, the others are sequential
                                                                 ))
 
     def __init__(self, *args, **kwargs):
@@ -344,9 +620,66 @@ class IOStatReportGenerator(ReportGenerator, bapp.plugin_type()):
 
         assert config.num_threads >= 1, "Must set at least 1 or more workers"
         assert config.output_dir, "Output directory (output_dir) must be set"
-        assert config.output_dir.isdir(), "output directory at '%s' must be an accessible directory" % self.output_dir
+        assert config.output_dir.isdir(), "output directory at '%s' must be an accessible directory" % config.output_dir
+        assert config.engine in ('thread', 'process'), "engine must be 'thread' or 'process'"
+
+        if config.engine == 'process':
+            assert config.queue_depth >= 1, "queue_depth must be 1 or more"
+            assert 0.0 <= config.read_ratio <= 1.0 and 0.0 <= config.random_ratio <= 1.0, "ratios must be between 0 and 1"
+            if config.random_writes and config.read_ratio == 1.0:
+                # Like the thread engine, write as much as we read
+                config.read_ratio = 0.5
+            # end handle random writes
+            if config.direct_io:
+                assert hasattr(os, 'O_DIRECT'), "This platform doesn't support direct IO"
+                for size_attr in ('write_chunk_size', 'random_read_chunk_size', 'file_size'):
+                    assert getattr(config, size_attr) % DIRECT_IO_ALIGNMENT == 0, \
+                                        "%s must be a multiple of %i for direct IO" % (size_attr, DIRECT_IO_ALIGNMENT)
+                # end for each size to check
+            # end handle direct io
+        else:
+            assert not config.direct_io, "direct_io is only supported by the process engine"
+        # end handle engine
 
         return config
+
+    def _run_processes(self, config, record_worker):
+        """Run the stress test in config.num_threads processes, calling record_worker(metrics) for each of them 
+        once it is done"""
+        results = multiprocessing.Queue()
+        cancel = multiprocessing.Event()
+        processes = [StressorProcess(config, results, cancel) for wid in range(config.num_threads)]
+        for process in processes:
+            process.start()
+        # end for each process
+
+        pending = dict((process.name, process) for process in processes)
+        while pending:
+            try:
+                metrics = results.get(True, 0.5)
+            except Queue.Empty:
+                # Processes which were killed can't send their results
+                for name, process in pending.items():
+                    if not process.is_alive() and results.empty():
+                        metrics = dict.fromkeys(StressorProcess.metric_names, 0)
+                        metrics.update(name=name, exception='process exited with code %s' % process.exitcode)
+                        record_worker(DictObject(metrics))
+                        del pending[name]
+                    # end handle dead process
+                # end for each pending process
+                continue
+            except KeyboardInterrupt:
+                print >> sys.stderr, "Sending cancellation request to all workers - they will stop as soon as possible"
+                cancel.set()
+                continue
+            # end handle interrupts
+            record_worker(DictObject(metrics))
+            del pending[metrics['name']]
+        # end while there are pending processes
+
+        for process in processes:
+            process.join()
+        # end for each process
         
     
     ## -- End Utilities -- @}
@@ -356,11 +689,26 @@ class IOStatReportGenerator(ReportGenerator, bapp.plugin_type()):
     # @{
 
     def generate(self):
-        report = self.ReportType(columns=self.report_schema)
+        report = self.ReportType(columns=self.report_schema, aggregate=True)
         config = self._sanitize_configuration()
-        record = report.records.append
+        record = report.append_record
         workers = list()
 
+        def _record_worker(w):
+            self._error |= w.exception is not None
+            record((    w.name,
+                        w.elapsed_file_generate_read,
+                        mb(w.file_size / (w.elapsed_file_generate_read or 1)),
+                        w.elapsed_file_generate_write,
+                        mb(w.file_size / (w.elapsed_file_generate_write or 1)),
+                        w.elapsed_file_generate,
+                        w.elapsed_read_volume,
+                        w.read_volume,
+                        mb(w.read_volume / (w.elapsed_read_volume or 1)),
+                        w.elapsed_write_volume and mb(w.write_volume / w.elapsed_write_volume) or 0,
+                        w.exception))
+        # end utility
+
         def _record_worker_result():
             # poll them, as join will block
             while workers:
@@ -368,25 +716,26 @@ class IOStatReportGenerator(ReportGenerator, bapp.plugin_type()):
                     if w.is_alive():
                         continue
                     # end ignore unfinished workers
-                    self._error |= w.exception is not None
-                    record((    w.name,
-                                w.elapsed_file_generate_read,
-                                mb(w.file_size / (w.elapsed_file_generate_read or 1)),
-                                w.elapsed_file_generate_write,
-                                mb(w.file_size / (w.elapsed_file_generate_write or 1)),
-                                w.elapsed_file_generate,
-                                w.elapsed_read_volume,
-                                w.read_volume,
-                                mb(w.read_volume / (w.elapsed_read_volume or 1)),
-                                w.elapsed_write_volume and mb(w.read_volume / w.elapsed_write_volume) or 0,
-                                w.exception))
+                    _record_worker(w)
                     workers.remove(w)
                 # end for each worker
                 sleep(0.5)
             # end while we have workers to check
-            record(report.aggregate_record())
         # end utility
         print >> sys.stderr, self.configuration()
+        if config.engine == 'process':
+            print >> sys.stderr, "Creating %s dataset, and a %s volume with %i%% reads and %i%% random requests, " \
+                                 "in %i processes with queue depth %i%s" % \
+                                                    (int_to_size_string(config.num_threads * config.file_size),
+                                                     int_to_size_string(config.num_threads * config.random_read_volume),
+                                                     config.read_ratio * 100, config.random_ratio * 100,
+                                                     config.num_threads, config.queue_depth,
+                                                     config.direct_io and ', bypassing the FS cache' or '')
+            self._run_processes(config, _record_worker)
+            record(report.aggregate_record())
+            return report
+        # end handle process engine
+
         print >> sys.stderr, "Creating %s dataset, and a %s %s volume, in %i threads" % \
                                                     (int_to_size_string(config.num_threads * config.file_size),
                                                      int_to_size_string(config.num_threads * config.random_read_volume),
@@ -414,6 +763,7 @@ class IOStatReportGenerator(ReportGenerator, bapp.plugin_type()):
             print >> sys.stderr, "Waiting for workers to finish - they will stop as soon as possible"
             _record_worker_result()
         # end handle SIGTERM
+        record(report.aggregate_record())
 
         return report
 
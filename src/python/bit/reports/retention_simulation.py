@@ -0,0 +1,106 @@
+#-*-coding:utf-8-*-
+"""
+@package bit.reports.retention_simulation
+@brief A report showing how a retention policy would treat snapshots over time
+
+@author Sebastian Thiel
+@copyright [GNU Lesser General Public License](https://www.gnu.org/licenses/lgpl.html)
+"""
+__all__ = ['RetentionSimulationReportGenerator']
+
+import sys
+
+from butility import (size_to_int,
+                      int_to_size_string)
+from .base import ReportGenerator
+
+from bit.retention import RetentionPolicy
+from bit.retention_simulator import RetentionSimulator
+from bit.utility import (seconds_to_datetime,
+                         utc_datetime_to_date_time_string,
+                         rsum)
+
+import bapp
+from bcmd import InputError
+
+
+class RetentionSimulationReportGenerator(ReportGenerator, bapp.plugin_type()):
+    """Simulates snapshots taken over a long period of time, and shows which of them a retention policy keeps"""
+    __slots__ = ()
+
+    type_name = 'retention-simulation'
+    description = """Simulates snapshots taken at a cadence over months of time, applying a retention policy
+    as time advances. Shows the amount of kept snapshots, the storage they use, and how long each application of
+    the policy took. Use it to try policies before using them, or to benchmark the retention implementation."""
+
+    report_schema = (   ('time', float, lambda t: utc_datetime_to_date_time_string(seconds_to_datetime(t))),
+                        ('taken', int, str),
+                        ('kept', int, str),
+                        ('removed', int, str, rsum),
+                        ('storage', int, int_to_size_string),
+                        ('filter[ms]', float, lambda s: "%.03f" % (s * 1000.0)),
+                    )
+
+    _schema = ReportGenerator._make_schema(type_name, dict(policy=str(), # the retention policy to simulate
+                                                               cadence='1h', # time between two snapshots
+                                                               applied_every='1h', # time between applications of the policy
+                                                               duration='1y', # the simulated time
+                                                               jitter=0.0, # fraction of the cadence by which snapshots are early or late
+                                                               gap_probability=0.0, # probability for a snapshot to be missing
+                                                               change_per_day='1g', # data changed per day, which snapshots keep
+                                                               report_every=24, # show one record per this amount of applications
+                                                               seed=0 # seed for random numbers, for reproducible results
+                                                          ))
+
+    # -------------------------
+    ## @name Interface Implementation
+    # @{
+
+    def generate(self):
+        config = self.configuration()
+        if not config.policy:
+            raise InputError("policy must be set, like policy=1h:1d,1d:14d")
+        # end verify policy
+        if config.report_every < 1:
+            raise InputError("report_every must be 1 or larger")
+        # end verify report_every
+
+        try:
+            simulator = RetentionSimulator(RetentionPolicy(config.policy), config.cadence,
+                                           applied_every = config.applied_every,
+                                           jitter = config.jitter,
+                                           gap_probability = config.gap_probability,
+                                           change_rate = size_to_int(config.change_per_day) / (24.0 * 3600),
+                                           seed = config.seed)
+        except ValueError, err:
+            raise InputError(str(err))
+        # end convert errors
+
+        report = self.ReportType(columns=self.report_schema)
+        record = report.records.append
+        filter_times = list()
+        removed = 0
+        for sid, step in enumerate(simulator.run(config.duration)):
+            filter_times.append(step.filter_time)
+            removed += step.num_removed
+            if (sid + 1) % config.report_every == 0:
+                record((step.time, step.num_taken, step.num_kept, removed, step.storage, step.filter_time))
+                removed = 0
+            # end handle record
+        # end for each step
+
+        if filter_times:
+            filter_times.sort()
+            print >> sys.stderr, "Applied policy %i times in %.03fs, latency: min = %.03fms, median = %.03fms, max = %.03fms" \
+                                    % (len(filter_times), sum(filter_times), filter_times[0] * 1000.0,
+                                       filter_times[len(filter_times) / 2] * 1000.0, filter_times[-1] * 1000.0)
+        # end print benchmark
+        return report
+
+    def generate_fix_script(self, report, writer):
+        """There is nothing to fix in a simulation"""
+        return False
+
+    ## -- End Interface Implementation -- @}
+
+# end class RetentionSimulationReportGenerator
@@ -11,16 +11,17 @@ __all__ = ['VersionReportGenerator']
 import sys
 import os
 import re
-from time import time
+import glob
+import hashlib
 import marshal
-# We can't assume lz4, so lets use zip, which can decompress reasonably fast at least
-import zlib
+from time import time
 from datetime import datetime
 from itertools import chain
 
 from sqlalchemy import (create_engine,
                         MetaData,
-                        select)
+                        select,
+                        func)
 
 from butility import (Path,
                       int_to_size_string)
@@ -31,11 +32,16 @@ from bit.utility import (  delta_to_tty_string,
                            datetime_to_seconds,
                            ravg,
                            rsum,
-                           DistinctStringReducer)
+                           external_sort,
+                           regex_literal_prefix,
+                           DistinctStringReducer,
+                           TableAggregator)
 
 from bit.bundler import (  Bundler,
                            VersionBundleList,
                            VersionBundle)
+from bit.bundle_cache import (BundleCache,
+                              write_bundle_cache)
 
 import bapp
 from bcmd import InputError
@@ -154,14 +160,45 @@ class StatVersionBundleList(VersionBundleList):
 
 class FilteringVersionBundler(Bundler):
     """A bundler which rebuilds using our types, and which applies a filter in the process"""
-    __slots__ = ('config')
+    __slots__ = (
+                    'config',       # our configuration, with compiled regular expressions
+                    'prefilter',    # if True, paths of filtered prefixes are treated as unversioned while bundling
+                    '_last_prefix', # the prefix we checked most recently while prefiltering
+                    '_last_keep'    # the result of _keep_prefix() for _last_prefix
+                )
 
     BundleListType = StatVersionBundleList
     BundleType = StatVersionBundle
 
-    def __init__(self, config):
+    def __init__(self, config, prefilter = False):
+        """Initialize this instance
+        @param config our configuration
+        @param prefilter if True, prefixes which are filtered anyway will never enter the bundle. This changes
+        nothing about the results of rebuild_bundle(), but makes the bundle depend on the filter"""
         super(FilteringVersionBundler, self).__init__()
         self.config = config
+        self.prefilter = prefilter
+        self._last_prefix = None
+        self._last_keep = True
+
+    def _extract_version_span(self, path):
+        """Paths of filtered prefixes behave like unversioned ones when prefiltering, which prunes the
+        current prefix just like the first path of another prefix would"""
+        sp = super(FilteringVersionBundler, self)._extract_version_span(path)
+        if sp is None or not self.prefilter:
+            return sp
+        # end handle unfiltered
+
+        # paths of a prefix are usually consecutive, so the regex runs once per prefix
+        prefix = path[:sp[0]]
+        if prefix != self._last_prefix:
+            self._last_prefix = prefix
+            self._last_keep = self._keep_prefix(prefix)
+        # end update cached decision
+        if not self._last_keep:
+            return None
+        # end handle filtered prefix
+        return sp
 
     def _keep_prefix(self, prefix):
         if self.config.prefix_include_regex:
@@ -177,6 +214,17 @@ class FilteringVersionBundler(Bundler):
             return self.config.path_exclude_regex.match(item[0]) is None
         return True
 
+    def _bundle_state(self, bundle):
+        return bundle.removed
+
+    def _set_bundle_state(self, bundle, state):
+        bundle.removed = state
+
+    def _new_bundle_list(self, prefix):
+        bundle_list = self.BundleListType()
+        bundle_list.prefix = prefix
+        return bundle_list
+
     def _dict_to_bundle_list(self, prefix, bundle_dict):
         """Assure we apply retention per-version-bundle list"""
         if not self.config.retention_policy and self.config.keep_latest_version_count < 0:
@@ -186,11 +234,14 @@ class FilteringVersionBundler(Bundler):
             ###########################
             # NOTE: When using the policy, it is very important that newer versions are also newer regarding the date.
             # This is why we resort to the min_created attribute, the youngest item counts (just in case people overwrite versions)
-            bundle_list = self.BundleListType()
+            bundle_list = self._new_bundle_list(prefix)
             if self.config.retention_policy:
-                samples, removed_samples = self.config.retention_policy.filter(time(),
-                                                                               ((seconds_to_datetime(b.min_created), b) for b in self._iter_bundles_in_dict(bundle_dict)),
-                                                                               ordered=False)
+                # filter_groups() keeps the initial samples of x-<policy> for each prefix. filter() would use them
+                # up with the first prefixes it sees, which depend on the order and the process rebuilding them
+                groups = self.config.retention_policy.filter_groups(time(),
+                                                                    [(prefix, [(seconds_to_datetime(b.min_created), b) for b in self._iter_bundles_in_dict(bundle_dict)])],
+                                                                    ordered=False)
+                samples, removed_samples = groups.next()[1]
                 for t, b in removed_samples:
                     b.removed = True
                 # end for each sample
@@ -206,7 +257,6 @@ class FilteringVersionBundler(Bundler):
             # end handle policy or stupid keep count
         # end handle bundle list conversion
 
-        bundle_list.prefix = prefix
         return bundle_list
 
 # end class FilteringVersionBundler
@@ -228,6 +278,7 @@ class VersionReportGenerator(ReportGenerator, bapp.plugin_type()):
     ORDER_DESC = 'descending'
 
     sort_orders = (ORDER_ASC, ORDER_DESC)
+
     report_schema = (   ('prefix', StatVersionBundleList, lambda v: isinstance(v, str) and v or dirname(v.prefix), DistinctStringReducer()),
                         ('num_versions', int, str, rsum),
                         ('num_del_versions', int, str, rsum),
@@ -245,6 +296,7 @@ class VersionReportGenerator(ReportGenerator, bapp.plugin_type()):
     _schema = ReportGenerator._make_schema(type_name, dict(db_url=str(), # sqlalchemy url to database to use
                                                                table=str(),  # name of the table to use, compatible to fsstat
                                                                cache_path=Path(), # an optional path to a cache - auto-tried based on table name if set
+                                                               cache_count=3, # amount of most recently used caches to keep per table
 
                                                                prefix_include_regex=str(), # regular expression of prefix whitelist
                                                                prefix_exclude_regex=str(), # inverse of above
@@ -255,37 +307,255 @@ class VersionReportGenerator(ReportGenerator, bapp.plugin_type()):
                                                                sort_order=ORDER_ASC, # sort order
 
                                                                retention_policy=str(), # Standard retention policy
-                                                               keep_latest_version_count=-1 # amount of newest versions to keep
+                                                               keep_latest_version_count=-1, # amount of newest versions to keep
+                                                               num_processes=1, # amount of processes to filter prefixes with
+                                                               streaming=False # if True, read the database directly and keep only aggregates in memory
                                                           ))
 
+    ## Array typecodes of the meta-data of each item, see record_iterator() in _build_database()
+    # (size, ctime, mtime, mode, ratio)
+    cache_meta_typecodes = 'lllLd'
+
+    ## If more than the given fraction of prefixes of the previous cache is affected by changes, we will rebuild 
+    # the cache from scratch instead of updating it
+    incremental_max_prefix_ratio = 0.25
+
+    ## Maximum amount of records to sort in memory when streaming
+    streaming_sort_chunk_size = 100000
+
     # -------------------------
     ## @name Utilities
     # @{
 
-    def _cache_path(self, name):
-        """@return Path to cache file based on table name"""
-        return Path(name + '_%04i-%02i-%02i.cache.z' % (now.year, now.month, now.day))
+    def _cache_path(self, name, fingerprint):
+        """@return Path to cache file based on table name and the fingerprint of its contents"""
+        return Path('%s_%s.cache' % (name, fingerprint))
+
+    def _cache_paths(self, name):
+        """@return list of paths to all caches of the given table name, most recently used first"""
+        # The glob also matches caches of tables whose name starts with ours
+        pattern = re.compile(re.escape(os.path.basename(name)) + r'_[0-9a-f]{16}\.cache$')
+        paths = [Path(path) for path in glob.glob(self._cache_path(name, '*'))
+                                    if pattern.match(os.path.basename(path))]
+        return sorted(paths, key=lambda p: p.stat().st_mtime, reverse=True)
+
+    def _prune_caches(self, name, count):
+        """Delete all but the count most recently used caches of the given table"""
+        for path in self._cache_paths(name)[max(count, 1):]:
+            print >> sys.stderr, "Removing least recently used cache at '%s'" % path
+            path.remove()
+        # end for each path to remove
+
+    def _source_state(self, connection, table):
+        """@return a dict with information about the state of the given table, allowing to detect changes"""
+        c = table.c
+        count, max_id, max_mtime, max_ctime = connection.execute(select([func.count(c.id), 
+                                                                         func.max(c.id), 
+                                                                         func.max(c.mtime),
+                                                                         func.max(c.ctime)])).fetchone()
+        return dict(count=count,
+                    max_id=max_id,
+                    max_mtime=max_mtime and to_s(max_mtime),
+                    max_ctime=max_ctime and to_s(max_ctime))
+
+    def _fingerprint(self, state):
+        """@return a string which changes whenever the given source state, or the way we bundle it, changes.
+        @param state as returned by _source_state()
+        @note filters and retention are applied when loading the cache, and don't affect it"""
+        sha = hashlib.sha1()
+        for value in (state['count'], state['max_id'], state['max_mtime'], state['max_ctime'],
+                      FilteringVersionBundler.re_version.pattern, self.cache_meta_typecodes):
+            sha.update(str(value) + '\0')
+        # end for each value
+        return sha.hexdigest()[:16]
+
+    def _record_iterator(self, connection, table, condition = None):
+        """@return iterator yielding (path, meta) records suitable for Bundler.bundle(), ordered by path
+        @param condition if not None, an additional where clause"""
+        c = table.c
+        clause = (c.ctime != None) & (c.mtime != None) & (c.sha1 != None)
+        if condition is not None:
+            clause = clause & condition
+        # end handle condition
+        selector = select(  [c.path,
+                             c.size,
+                             c.ctime,
+                             c.mtime,
+                             c.mode,
+                             c.ratio], clause).order_by(c.path)
+
+        for row in connection.execute(selector):
+            yield (row[0], (row[1],
+                            to_s(row[2]),
+                            to_s(row[3]),
+                            row[4],
+                            row[5] or 1.0))
+        # end for each row
+
+    def _prefilter_condition(self, connection, table, config):
+        """@return a where clause selecting only paths which could pass the include regexes of the given 
+        configuration, or None if there is no such clause. It uses the literal each regex starts with.
+        @note the clause only drops paths which are filtered anyway, and which belong to different prefixes than
+        all paths that are kept, see _iter_prefiltered_records()"""
+        literals = list()
+        if config.prefix_include_regex:
+            # all kept prefixes start with the literal, and so do all of their paths
+            literals.append(regex_literal_prefix(config.prefix_include_regex.pattern))
+        # end handle prefix include
+        if config.path_include_regex:
+            # Truncate it before anything that could end a prefix, which assures that the prefixes of all 
+            # selected paths start with the literal. Otherwise we would drop paths of prefixes we keep.
+            literal = regex_literal_prefix(config.path_include_regex.pattern)
+            m = FilteringVersionBundler.re_prefix_end.search(literal.lower())
+            if m:
+                literal = literal[:m.start()]
+            # end truncate literal
+            literals.append(literal)
+        # end handle path include
+
+        c = table.c
+        # Regexes ignore case, and so does LIKE in mysql and sqlite
+        like = connection.dialect.name == 'postgresql' and c.path.ilike or c.path.like
+        clause = None
+        for literal in literals:
+            # backslashes would escape the next character in mysql, and LIKE wildcards just match more
+            literal = literal.split('\\')[0]
+            if not literal:
+                continue
+            # end skip empty literals
+            condition = like(literal + '%')
+            if clause is not None:
+                condition = clause & condition
+            # end combine conditions
+            clause = condition
+        # end for each literal
+        return clause
+
+    def _iter_prefiltered_records(self, connection, table, config):
+        """@return iterator like _record_iterator(), which doesn't read paths that will be filtered anyway.
+        To be used with a bundler that prefilters, as they yield the same results as without prefiltering"""
+        condition = self._prefilter_condition(connection, table, config)
+        last_path = None
+        for record in self._record_iterator(connection, table, condition):
+            last_path = record[0]
+            yield record
+        # end for each record
+
+        if condition is None or last_path is None:
+            return
+        # end handle nothing was dropped
+
+        # Any path after the last one we read would have pruned its prefix, and an unversioned path does the same
+        c = table.c
+        clause = (c.ctime != None) & (c.mtime != None) & (c.sha1 != None) & (c.path > last_path)
+        if connection.execute(select([c.path], clause).limit(1)).first() is not None:
+            yield ('', None)
+        # end handle trailing paths
+
+    def _update_previous_cache(self, connection, table, config, state):
+        """Load the most recently used cache of the given table and update the prefixes affected by all changes
+        in the table since the cache was built.
+        @param state the current state of the table, see _source_state()
+        @return the updated bundle, or None if there was no suitable cache, or if it's cheaper to rebuild it"""
+        for path in self._cache_paths(config.table):
+            try:
+                cache = self._deserialize_db(path)
+            except ValueError:
+                continue
+            # end ignore invalid caches
+            break
+        else:
+            return None
+        # end find usable cache
+
+        try:
+            try:
+                prev = marshal.loads(cache.info)
+            except (EOFError, ValueError, TypeError):
+                return None
+            # end handle missing state
+
+            c = table.c
+            if prev.get('max_id') is None or state['max_id'] is None:
+                return None
+            # end handle empty tables
+
+            # Updates keep the id, so if all new rows have larger ids, nothing was removed
+            num_new = connection.execute(select([func.count(c.id)], c.id > prev['max_id'])).scalar()
+            if state['count'] - prev['count'] != num_new:
+                print >> sys.stderr, "Rows were removed from '%s' - cannot update cache at '%s'" % (config.table, path)
+                return None
+            # end check for removals
+
+            # Deletions and modifications set mtime or ctime, additions have a new id
+            st = time()
+            changed = c.id > prev['max_id']
+            for attr in ('mtime', 'ctime'):
+                if prev['max_' + attr] is not None:
+                    changed = changed | (getattr(c, attr) >= seconds_to_datetime(prev['max_' + attr]))
+                # end handle unset times
+            # end for each time attribute
+            bundler = FilteringVersionBundler(config)
+            db = cache.to_bundle()
+            prefixes = bundler.affected_prefixes(db, (row[0] for row in connection.execute(select([c.path], changed))))
+            print >> sys.stderr, "Found %i prefixes affected by changes since cache at '%s' was built in %fs" \
+                                    % (len(prefixes), path, time() - st)
+            if len(prefixes) > max(len(db), 1) * self.incremental_max_prefix_ratio:
+                return None
+            # end handle too many changes
 
-    def _serialize_db(self, db, path):
+            st = time()
+            for prefix in sorted(prefixes):
+                # NOTE: '_' and '%' act as wildcards, but the bundler only keeps paths within the prefix anyway
+                bundler.rebundle_prefix(db, prefix, self._record_iterator(connection, table, c.path.like(prefix + '%')))
+            # end for each prefix
+            print >> sys.stderr, "Updated %i prefixes in %fs" % (len(prefixes), time() - st)
+            return db
+        finally:
+            cache.close()
+        # end assure cache is closed
+
+    def _serialize_db(self, db, path, info = ''):
         """Serialize the given db fast
+        @param info a string to store along with the db
         @return size of cached data in bytes"""
-        cache = zlib.compress(marshal.dumps(db), 9)
-        open(path, 'wb').write(cache)
-        return len(cache)
+        return write_bundle_cache(db, path, self.cache_meta_typecodes, info)
 
     def _deserialize_db(self, path):
-        """@return the deserialized database, previusly written by _serialize_db()"""
-        return marshal.loads(zlib.decompress(open(path).read()))
+        """@return a BundleCache to lazily access the database previously written by _serialize_db()
+        @throw ValueError if the file at path isn't a valid cache"""
+        return BundleCache(path)
 
     def _build_database(self, config):
         """@return our database ready to be used.
         It will be a list of tuples of (prefix, VersionBundleList) pairs
         Will load from cache or from an sql database (and building the cache in the process)"""
+        mcon = md = state = fingerprint = None
+        if config.db_url and config.table:
+            engine = create_engine(config.db_url)
+            mcon = engine.connect()
+            md = MetaData(engine, reflect=True)
+
+            if config.table not in md.tables:
+                raise AssertionError("Table named '%s' didn't exist in database at '%s'" % (config.table, config.db_url))
+            # end verify table exists
+        # end connect to database
+
         if not config.cache_path:
             if not config.table:
                 raise AssertionError("Please set either db_url and table or the cache_path to specify a data source")
-            config.cache_path = self._cache_path(config.table)
-            print >> sys.stderr, "Would use cache default at %s" % config.cache_path
+            # end verify table is set
+            if mcon is not None:
+                state = self._source_state(mcon, md.tables[config.table])
+                fingerprint = self._fingerprint(state)
+                config.cache_path = self._cache_path(config.table, fingerprint)
+                print >> sys.stderr, "Would use cache default at %s" % config.cache_path
+            else:
+                # without database, fall back to whichever cache we used last
+                caches = self._cache_paths(config.table)
+                config.cache_path = caches and caches[0] or None
+                print >> sys.stderr, "Would use most recent cache at %s" % config.cache_path
+            # end handle fingerprint
         else:
             print >> sys.stderr, "Will attempt to use cache at %s" % config.cache_path
         # end handle cache_path
@@ -296,64 +566,64 @@ class VersionReportGenerator(ReportGenerator, bapp.plugin_type()):
             # LOAD EXISTING CACHE
             ######################
             st = time()
-            db = self._deserialize_db(config.cache_path)
-            elapsed = time() - st
-
-            cstat = config.cache_path.stat()
-            print >> sys.stderr, "Loaded cache of size %s from %s in %fs (%fMB/s)" % \
-                                    (int_to_size_string(cstat.st_size), config.cache_path, elapsed, 
-                                     (cstat.st_size / elapsed) / (1024**2))
+            try:
+                cache = self._deserialize_db(config.cache_path)
+            except ValueError, err:
+                print >> sys.stderr, "Ignoring invalid cache: %s" % err
+            else:
+                # Only materialize prefixes we are going to keep anyway
+                db = cache.to_bundle(FilteringVersionBundler(config)._keep_prefix)
+                cache.close()
+                elapsed = time() - st
+                # mark it as most recently used
+                os.utime(config.cache_path, None)
+
+                cstat = config.cache_path.stat()
+                print >> sys.stderr, "Loaded %i of %i prefixes from cache of size %s at %s in %fs (%fMB/s)" % \
+                                        (len(db), cache.num_prefixes, int_to_size_string(cstat.st_size), 
+                                         config.cache_path, elapsed, (cstat.st_size / elapsed) / (1024**2))
+            # end handle invalid cache
         # end try loading cache
-        elif config.db_url and config.table:
+
+        if db is None and mcon is not None:
             # BUILD CACHE FROM DATABASE
             ############################
-            print >> sys.stderr, "reading from database at '%s/%s'" % (config.db_url, config.table)
-
-            engine = create_engine(config.db_url)
-            mcon = engine.connect()
-            md = MetaData(engine, reflect=True)
-
-            if config.table not in md.tables:
-                raise AssertionError("Table named '%s' didn't exist in database at '%s'" % (config.table, config.db_url))
-            # end verify table exists
-
-            progress_every = 40000
-            def record_iterator():
-                c = md.tables[config.table].c
-                selector = select(  [c.path,
-                                     c.size,
-                                     c.ctime,
-                                     c.mtime,
-                                     c.mode,
-                                     c.ratio], (c.ctime != None) & (c.mtime != None) & (c.sha1 != None)).order_by(c.path)
+            table = md.tables[config.table]
+            if state is None:
+                state = self._source_state(mcon, table)
+                fingerprint = self._fingerprint(state)
+            # end assure fingerprint
+
+            db = self._update_previous_cache(mcon, table, config, state)
+            if db is None:
+                print >> sys.stderr, "reading from database at '%s/%s'" % (config.db_url, config.table)
+                progress_every = 40000
+                def record_iterator():
+                    st = time()
+                    for rid, record in enumerate(self._record_iterator(mcon, table)):
+                        if rid % progress_every == 0:
+                            elapsed = time() - st
+                            print >> sys.stderr, "Read %i records in %fs (%f records/s)" % (rid, elapsed, rid / elapsed)
+                        # end handle progress
+                        yield record
+                    # end for each record
+                # end record iterator
 
                 st = time()
-                for rid, row in enumerate(mcon.execute(selector)):
-                    if rid % progress_every == 0:
-                        elapsed = time() - st
-                        print >> sys.stderr, "Read %i records in %fs (%f records/s)" % (rid, elapsed, rid / elapsed)
-                    # end handle progress
-                    yield (row[0], (row[1],
-                                    to_s(row[2]),
-                                    to_s(row[3]),
-                                    row[4],
-                                    row[5] or 1.0))
-                # end for each row
-            # end record iterator
-
-            st = time()
-            db = FilteringVersionBundler(config).bundle(record_iterator())
-            print >> sys.stderr, "Extracted version %i bundled in %fs" % (len(db), time() - st)
+                db = FilteringVersionBundler(config).bundle(record_iterator())
+                print >> sys.stderr, "Extracted version %i bundled in %fs" % (len(db), time() - st)
+            # end handle full rebuild
 
             # store cache file
             st = time()
-            cpath = self._cache_path(config.table)
-            csize = self._serialize_db(db, cpath)
+            cpath = self._cache_path(config.table, fingerprint)
+            csize = self._serialize_db(db, cpath, marshal.dumps(state))
             elapsed = time() - st
             print >> sys.stderr, "Wrote cache with size %s to '%s' in %fs (%f MB/s)" % \
                                          (int_to_size_string(csize), cpath, elapsed, (csize / elapsed) / 1024**2)
+            self._prune_caches(config.table, config.cache_count)
         # end obtain raw database
-        else:
+        elif db is None:
             raise AssertionError("Could not build cache database - set db_url and table, cache_path, or table to use a default cache from previous run")
         # end handle cache or db url
 
@@ -361,7 +631,7 @@ class VersionReportGenerator(ReportGenerator, bapp.plugin_type()):
         ####################
         # finally, rebuild and filter into our actual structure
         st = time()
-        db = FilteringVersionBundler(config).rebuild_bundle(db)
+        db = FilteringVersionBundler(config).rebuild_bundle(db, config.num_processes)
 
         def prefix(t):
             return t[0]
@@ -385,6 +655,50 @@ class VersionReportGenerator(ReportGenerator, bapp.plugin_type()):
         print >> sys.stderr, "Filtered database in %fs" % elapsed
         return db
 
+    def _iter_streamed_records(self, config):
+        """@return iterator yielding all report records, sorted as configured. They are built while reading 
+        the database, which never keeps more than a single prefix in memory, along with the aggregated records.
+        @note the bundle list of each record only contains the bundles to be removed, as only these are needed
+        by generate_fix_script()"""
+        if not (config.db_url and config.table):
+            raise AssertionError("Streaming requires db_url and table to be set")
+        # end verify config
+
+        engine = create_engine(config.db_url)
+        mcon = engine.connect()
+        md = MetaData(engine, reflect=True)
+        if config.table not in md.tables:
+            raise AssertionError("Table named '%s' didn't exist in database at '%s'" % (config.table, config.db_url))
+        # end verify table exists
+        print >> sys.stderr, "streaming from database at '%s/%s'" % (config.db_url, config.table)
+
+        bundler = FilteringVersionBundler(config, prefilter=True)
+        meta_attrs = [t[0] for t in self.report_schema][1:]
+
+        def records():
+            st = time()
+            record_iterator = self._iter_prefiltered_records(mcon, md.tables[config.table], config)
+            for pid, (prefix, vlist) in enumerate(bundler.iter_rebuilt_bundles(record_iterator)):
+                if pid and pid % 10000 == 0:
+                    elapsed = time() - st
+                    print >> sys.stderr, "Streamed %i prefixes in %fs (%f prefixes/s)" % (pid, elapsed, pid / elapsed)
+                # end handle progress
+                values = tuple(getattr(vlist, attr) for attr in meta_attrs)
+                removed = bundler._new_bundle_list(prefix)
+                removed.extend(bundle for bundle in vlist if bundle.removed)
+                yield (removed, ) + values
+            # end for each prefix
+        # end records
+
+        if config.sort_by == self.report_schema[0][0]:
+            key = lambda r: r[0].prefix
+        else:
+            key_index = [t[0] for t in self.report_schema].index(config.sort_by)
+            key = lambda r: r[key_index]
+        # end handle key
+        return external_sort(records(), key=key, reverse=config.sort_order == self.ORDER_DESC, 
+                             chunk_size=self.streaming_sort_chunk_size)
+
     def _sanitize_configuration(self, config):
         """@return configuration which is assured to have the correct type of values."""
         if config.prefix_include_regex and config.prefix_exclude_regex or \
@@ -425,21 +739,47 @@ class VersionReportGenerator(ReportGenerator, bapp.plugin_type()):
     # @{
 
     def generate(self):
-        report = self.ReportType(columns=self.report_schema)
-        record = report.records.append
+        report = self.ReportType(columns=self.report_schema, aggregate=True)
+        record = report.append_record
         config = self._sanitize_configuration(self.configuration())
 
-        db = self._build_database(config)
+        if config.streaming:
+            for rec in self._iter_streamed_records(config):
+                record(rec)
+            # end for each record
+        else:
+            db = self._build_database(config)
 
-        meta_attrs = [t[0] for t in self.report_schema][1:]
-        for prefix, vlist in db:
-            record((vlist, ) + tuple(getattr(vlist, attr) for attr in meta_attrs))
-        # end for each entry to place
+            meta_attrs = [t[0] for t in self.report_schema][1:]
+            for prefix, vlist in db:
+                record((vlist, ) + tuple(getattr(vlist, attr) for attr in meta_attrs))
+            # end for each entry to place
+        # end handle streaming
 
         record(report.aggregate_record())
 
         return report
 
+    def generate_stream(self):
+        """In streaming mode, records are provided while the database is read, followed by their aggregate"""
+        if not self.configuration().streaming:
+            return self.generate()
+        # end handle non-streaming
+        config = self._sanitize_configuration(self.configuration())
+
+        report = self.ReportType(columns=self.report_schema)
+        aggregator = TableAggregator(report.columns)
+
+        def records():
+            for rec in aggregator.iter_added(self._iter_streamed_records(config)):
+                yield rec
+            # end for each record
+            yield aggregator.record()
+        # end records
+
+        report.records = records()
+        return report
+
     def generate_fix_script(self, report, writer):
         """Generate a script which removes files individually as well as empty folders"""
         # PREAMBLE
@@ -508,6 +848,33 @@ class VersionReportGenerator(ReportGenerator, bapp.plugin_type()):
         
         writer('echo "Removed up to %i files and %i directories"\n' % (fcount, dcount))
         return True
+
+    def fix_deletions(self, report):
+        """Provide the same files and directories generate_fix_script() would remove"""
+        directories = set()
+
+        def files():
+            for rec in report.records:
+                vlist = rec[0]
+                if not isinstance(vlist, StatVersionBundleList):
+                    continue
+                # end ignore aggregated record
+
+                for bundle in vlist:
+                    if not bundle.removed:
+                        continue
+                    # end ignore if not for removal !
+                    directories.add(dirname(vlist.prefix))
+
+                    for item in bundle:
+                        directories.add(dirname(item[0]))
+                        yield item[0]
+                    # end for each item
+                # end for each bundle
+            # end for each record
+        # end files
+
+        return files(), directories
     
     ## -- End Interface Implementation -- @}
 
@@ -519,7 +886,7 @@ class VersionReportGenerator(ReportGenerator, bapp.plugin_type()):
     @classmethod
     def delete_script_safety_prefix(cls, writer):
         """Write a safety section which will make accidental deletion very hard"""
-        magic='DOIT'
+        magic = cls.DELETE_MAGIC
         writer('#!/bin/bash\n')
         writer('# First argument can be magic word "%s" to actually perform the deletion. It will be dry run otherwise\n' % magic)
         writer('if [[ $UID != 0 ]]; then \n')
@@ -9,10 +9,83 @@
 __all__ = ['RetentionPolicy']
 
 from .utility import (  seconds_to_datetime,
+                        datetime_to_seconds,
                         delta_to_seconds )
 from bisect import bisect_left
 from butility import frequncy_to_seconds
 
+import multiprocessing
+
+
+class _RasterDates(object):
+    """A read-only sequence of the ideal sample dates of a retention period, sorted from old to new.
+
+    The first entry is the start of the period, followed by one date per frequency step, the last one being the end 
+    of the period. Dates are computed when accessed, which is why bisect can search periods with plenty of steps
+    without building a list of them."""
+    __slots__ = (
+                    '_to_time',     # seconds since epoch at which the period ends
+                    '_frequency',   # seconds between two steps
+                    '_num_steps',   # amount of steps within the period
+                    '_dates'        # cache of index -> date, for all dates we computed so far
+                )
+
+    def __init__(self, from_date, to_time, frequency, num_steps):
+        self._to_time = to_time
+        self._frequency = frequency
+        self._num_steps = num_steps
+        self._dates = {0 : from_date}
+
+    def __len__(self):
+        return self._num_steps + 1
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self._num_steps + 1
+        # end handle negative index
+        if not 0 <= index <= self._num_steps:
+            raise IndexError(index)
+        # end handle bounds
+        date = self._dates.get(index)
+        if date is None:
+            date = self._dates[index] = seconds_to_datetime(self._to_time - (self._num_steps - index) * self._frequency)
+        # end compute date lazily
+        return date
+
+    def index(self, date):
+        """@return the index of the oldest date which is not older than the given one, like bisect_left()
+        would. It is estimated arithmetically, and verified by looking at the neighbouring dates only"""
+        steps_before_end = int((self._to_time - datetime_to_seconds(date)) // self._frequency)
+        estimate = min(max(self._num_steps - steps_before_end, 0), self._num_steps)
+        lo, hi = max(estimate - 2, 0), min(estimate + 3, self._num_steps + 1)
+        if (lo == 0 or self[lo - 1] < date) and (hi == self._num_steps + 1 or self[hi - 1] >= date):
+            return bisect_left(self, date, lo, hi)
+        # end handle estimate
+        return bisect_left(self, date)
+
+# end class _RasterDates
+
+
+# -------------------------
+## @name Parallel Filtering Utilities
+# @{
+
+## (policy, periods, ordered, keep_initial) for use by worker processes, see RetentionPolicy.filter_groups()
+_group_filter_state = None
+
+def _filter_group_chunk(chunk):
+    """@return list of (kept_indices, removed_indices) tuples for each list of (date, index) samples in chunk"""
+    policy, periods, ordered, keep_initial = _group_filter_state
+    res = list()
+    for samples in chunk:
+        policy._keep_initial = keep_initial
+        ns, ds = policy._filter(periods, samples, ordered)
+        res.append(([s[1] for s in ns], [s[1] for s in ds]))
+    # end for each group
+    return res
+
+## -- End Parallel Filtering Utilities -- @}
+
 
 class RetentionPolicy(object):
     """A policy defined by a string that defines a retention policy.
@@ -111,25 +184,34 @@ class RetentionPolicy(object):
         # end for each period
         return rules, keep_initial
 
-    ## -- End Utilities -- @}
+    def _periods(self, now):
+        """@return a list of (keep, frequency, retention_span, from_date, to_date, raster) tuples, one per rule.
+        They only depend on now, and can be shared by any amount of _filter() calls."""
+        periods = list()
+        to_time = now
+        for keep, frequency, retention_span in self._rules:
+            # Compute the boundary, in datetimes
+            from_time = to_time - retention_span
 
-    # -------------------------
-    ## @name Interface
-    # @{
-    
-    def filter(self, now, samples, ordered=False):
-        """Filter the given samples by the policy we were initialized with
-        @param now seconds since epoch specifying the current time
-        @param samples iterable of tuples of (datetime, data). The only relevant field is the datetime object.
-        It must be sorted ascending, from oldest to newest (native to what we have in the datbase)
-        @param ordered if False, samples will be assumed to be unordered, and thus ordered before we begin.
-        Set this True if your input data is already ordered from most recent to oldest sample
-        @return tuple(new_samples, removed_samples) of a new sample list with all removed_samples removed.
-        The order was reversed, such that a newer samples are before older samples
-        
-        @note The algorithm works like a prune, as such it will start dropping samples if there are too many 
-        in the period it looks at. Samples that a furthest away from their ideal position will be dropped before
-        those that are closer to it."""
+            # from_date --> to_date ---> now
+            from_date = seconds_to_datetime(from_time)
+            to_date = seconds_to_datetime(to_time)
+            assert to_time > from_time
+            assert to_date > from_date
+
+            # The raster is sorted from old to new dates, and starts at the boundary.
+            # Otherwise our calculation can go out of bounds
+            raster = _RasterDates(from_date, to_time, frequency, retention_span / frequency)
+            periods.append((keep, frequency, retention_span, from_date, to_date, raster))
+
+            # Reset cursor to next retention span
+            to_time = from_time
+        # end for each rule
+        return periods
+
+    def _filter(self, periods, samples, ordered):
+        """Implements filter(), see there
+        @param periods as obtained by _periods()"""
         if not ordered:
             samples = sorted(samples, key=lambda k: k[0])
         # end handle ordering
@@ -141,9 +223,8 @@ class RetentionPolicy(object):
 
         assert not hasattr(samples, 'next'), "cannot work with iterators"
 
-        lr = len(self._rules)
+        lr = len(periods)
         ls = len(samples)
-        to_time = now
         sid = 0               # sample id
 
         # For now, we natively work from new to old, just because our retention is sorted that way
@@ -156,17 +237,8 @@ class RetentionPolicy(object):
             return samples[:self._keep_initial], samples[self._keep_initial:]
         # end early bail-out
 
-        for rid, (keep, frequency, retention_span) in enumerate(self._rules):
-            # Compute the boundary, in datetimes
-            from_time = to_time - retention_span
-
+        for rid, (keep, frequency, retention_span, from_date, to_date, raster_lut) in enumerate(periods):
             # from_date --> to_date ---> now
-            from_date = seconds_to_datetime(from_time)
-            to_date = seconds_to_datetime(to_time)
-            assert to_time > from_time
-            assert to_date > from_date
-            
-
             in_last_rule = rid + 1 == lr
 
             # Samples within this retention period
@@ -219,16 +291,7 @@ class RetentionPolicy(object):
             num_samples_in_retention_span = retention_span / frequency
             num_samples_to_remove = len(retention_samples) - num_samples_in_retention_span
             if num_samples_to_remove > 0:
-                # Build the raster map
-                # The lut is sorted from old to new dates
-                raster_lut = list()
-                for step in xrange(num_samples_in_retention_span):
-                    raster_lut.insert(0, seconds_to_datetime(to_time - step * frequency))
-                # end for each frequency step
-                # Add boundary ! Otherwise our calculation can go out of bounds
-                raster_lut.insert(0, from_date)
-
-                # per grid position, keep a list of (distance, sample) tuples for later sorting
+                # per grid position, keep a list of (distance, sample index) tuples for later sorting
                 raster_lut_map = dict()
 
                 # Build a map, associating samples with their closest perfect sample, and keep their distance 
@@ -236,37 +299,35 @@ class RetentionPolicy(object):
                 # be ambiguous samples as they only ever approach from one side.
                 # The last one we always want to keep, so it will not take part in the Russian roulette
                 for rsid in xrange(len(retention_samples)):
-                    sample = retention_samples[rsid]
-                    sample_date = sample[0]
+                    sample_date = retention_samples[rsid][0]
 
-                    closest_raster_index = bisect_left(raster_lut, sample_date)
-                    raster_date = raster_lut[closest_raster_index]
-                    assert raster_date >= sample_date
+                    closest_raster_index = raster_lut.index(sample_date)
+                    assert raster_lut[closest_raster_index] >= sample_date
 
-                    distance_list = raster_lut_map.setdefault(raster_date, list())
-                    distance_list.append((delta_to_seconds(to_date - sample_date), sample))
+                    distance_list = raster_lut_map.setdefault(closest_raster_index, list())
+                    distance_list.append((delta_to_seconds(to_date - sample_date), rsid))
                 # end for each sample to consider
 
                 # Sort every cluster point's samples by distance, and keep only the closest one
                 # We must retain the order, which is new to old, to put new ones onto the list first
                 # NOTE: our samples are newest to oldest, the lut HAD to be ascending. Therefore we inverse 
                 # it to keep the samples in the right order
-                for raster_date in reversed(raster_lut):
+                dropped = set()
+                for raster_index in sorted(raster_lut_map.keys(), reverse=True):
                     if num_samples_to_remove == 0:
                         break
-                    if raster_date not in raster_lut_map:
-                        continue
-                    distance_list = sorted(raster_lut_map[raster_date], key=lambda k: k[0])
+                    distance_list = sorted(raster_lut_map[raster_index], key=lambda k: k[0])
 
-                    for distance, sample in distance_list[1:]:
-                        retention_samples.remove(sample)
-                        ds.append(sample)
+                    for distance, rsid in distance_list[1:]:
+                        dropped.add(rsid)
+                        ds.append(retention_samples[rsid])
                         num_samples_to_remove -= 1
                         if num_samples_to_remove == 0:
                             break
                         # early abort
                     # end for each sample
                 # end for each distance list
+                retention_samples = [sample for rsid, sample in enumerate(retention_samples) if rsid not in dropped]
 
                 # Only remove as many samples as we have, even if they might be clumped up. That way,
                 # Samples can move through the field and distribute themselves more evenly
@@ -285,9 +346,6 @@ class RetentionPolicy(object):
                 sid += 1
             # end remove or re-add samples
 
-            # Reset cursor to next retention span
-            to_time = from_time
-
             # all (remaining) retention samples are valid
             ns.extend(retention_samples)
         # end for each frequency/duration in rules
@@ -307,6 +365,91 @@ class RetentionPolicy(object):
 
         return ns, ds
 
+    def _iter_filtered_groups(self, periods, groups, ordered):
+        """@return iterator over filtered groups, see filter_groups()"""
+        keep_initial = self._keep_initial
+        try:
+            for key, samples in groups:
+                self._keep_initial = keep_initial
+                yield key, self._filter(periods, samples, ordered)
+            # end for each group
+        finally:
+            self._keep_initial = keep_initial
+        # end assure we keep our initial samples
+
+    def _iter_filtered_groups_in_pool(self, periods, groups, ordered, processes):
+        """@return iterator over groups filtered by the given amount of worker processes, see filter_groups()"""
+        global _group_filter_state
+        groups = list(groups)
+        chunks = [[[(sample[0], sid) for sid, sample in enumerate(samples)]
+                                     for key, samples in groups[i:i + self.group_chunk_size]]
+                  for i in xrange(0, len(groups), self.group_chunk_size)]
+
+        # Workers obtain the policy when forking, which saves us from pickling it
+        _group_filter_state = (self, periods, ordered, self._keep_initial)
+        pool = multiprocessing.Pool(processes)
+        try:
+            gid = 0
+            for results in pool.imap(_filter_group_chunk, chunks):
+                for kept, removed in results:
+                    key, samples = groups[gid]
+                    gid += 1
+                    yield key, ([samples[sid] for sid in kept], [samples[sid] for sid in removed])
+                # end for each result
+            # end for each chunk
+            pool.close()
+        finally:
+            pool.terminate()
+            _group_filter_state = None
+        # end assure pool is shut down
+
+    ## -- End Utilities -- @}
+
+    # -------------------------
+    ## @name Configuration
+    # @{
+
+    ## Amount of groups to send to a worker process at once, see filter_groups()
+    group_chunk_size = 100
+
+    ## -- End Configuration -- @}
+
+    # -------------------------
+    ## @name Interface
+    # @{
+    
+    def filter(self, now, samples, ordered=False):
+        """Filter the given samples by the policy we were initialized with
+        @param now seconds since epoch specifying the current time
+        @param samples iterable of tuples of (datetime, data). The only relevant field is the datetime object.
+        It must be sorted ascending, from oldest to newest (native to what we have in the datbase)
+        @param ordered if False, samples will be assumed to be unordered, and thus ordered before we begin.
+        Set this True if your input data is already ordered from most recent to oldest sample
+        @return tuple(new_samples, removed_samples) of a new sample list with all removed_samples removed.
+        The order was reversed, such that a newer samples are before older samples
+        
+        @note The algorithm works like a prune, as such it will start dropping samples if there are too many 
+        in the period it looks at. Samples that a furthest away from their ideal position will be dropped before
+        those that are closer to it."""
+        return self._filter(self._periods(now), samples, ordered)
+
+    def filter_groups(self, now, groups, ordered=False, processes=1):
+        """Filter many groups of samples at once, like filter() would, which is faster as all computations that
+        only depend on now are done once.
+        @param now seconds since epoch specifying the current time
+        @param groups iterable of (key, samples) tuples, where samples are like in filter()
+        @param ordered like in filter()
+        @param processes if larger than 1, groups are filtered by the given amount of worker processes. Only the 
+        dates of the samples are sent to them.
+        @return iterator yielding (key, (new_samples, removed_samples)) tuples in the order of groups, see filter()
+        @note unlike calling filter() repeatedly, each group keeps the amount of initial samples of the policy. 
+        Previously filtered samples would use them up."""
+        periods = self._periods(now)
+        if processes > 1:
+            return self._iter_filtered_groups_in_pool(periods, groups, ordered, processes)
+        # end handle parallel
+        return self._iter_filtered_groups(periods, groups, ordered)
+
     def rules(self):
         """@return a list of triplets of rules we are using. The first entry is the amount of samples to keep in any way,
         the second entry is the frequency, the third is the duration for which to hold it, both values are in
@@ -0,0 +1,148 @@
+#-*-coding:utf-8-*-
+"""
+@package bit.retention_simulator
+@brief Simulates how a retention policy treats snapshots over time
+
+@author Sebastian Thiel
+@copyright [GNU Lesser General Public License](https://www.gnu.org/licenses/lgpl.html)
+"""
+__all__ = ['RetentionSimulator', 'SimulationStep']
+
+import random
+from time import time
+from collections import namedtuple
+
+from .retention import RetentionPolicy
+from .utility import seconds_to_datetime
+from butility import frequncy_to_seconds
+
+
+## The state after applying the policy once.
+# * time - seconds since epoch at which the policy was applied
+# * num_taken - amount of snapshots taken since the simulation started
+# * num_kept - amount of snapshots we keep after applying the policy
+# * num_removed - amount of snapshots the policy removed in this step
+# * storage - bytes used by all snapshots we keep
+# * filter_time - seconds the policy took to filter all snapshots
+SimulationStep = namedtuple('SimulationStep', ('time', 'num_taken', 'num_kept', 'num_removed', 'storage',
+                                               'filter_time'))
+
+
+class RetentionSimulator(object):
+    """Takes snapshots at a cadence and applies a retention policy at regular intervals, to see which snapshots
+    it would keep over months of time, without having to wait that long.
+
+    Each snapshot is assumed to hold all data changed since the previous snapshot was taken, which is freed
+    once the snapshot is removed. This is a rough model of copy-on-write filesystems, but good enough to compare
+    policies.
+    """
+    __slots__ = (
+                    'policy',           # the RetentionPolicy to apply
+                    'cadence',          # seconds between two snapshots
+                    'applied_every',    # seconds between two applications of the policy
+                    'jitter',           # fraction of the cadence by which snapshots are taken early or late
+                    'gap_probability',  # probability for a snapshot not to be taken at all
+                    'change_rate',      # bytes changed per second
+                    '_random'           # our random number generator
+                )
+
+    def __init__(self, policy, cadence, applied_every = None, jitter = 0.0, gap_probability = 0.0,
+                 change_rate = 0, seed = None):
+        """Initialize this instance
+        @param policy a RetentionPolicy, or a string to create one from
+        @param cadence the time between two snapshots, either in seconds or like '1h'
+        @param applied_every the time between two applications of the policy, like cadence. Defaults to cadence
+        @param jitter a fraction of the cadence by which each snapshot may be taken too early or too late
+        @param gap_probability a probability between 0 and 1 for each snapshot not to be taken
+        @param change_rate bytes changed per second, which determines the size of snapshots
+        @param seed if not None, the random sequence will be the same for each simulation"""
+        if isinstance(policy, basestring):
+            policy = RetentionPolicy(policy)
+        # end convert policy
+        self.policy = policy
+        self.cadence = self._seconds(cadence)
+        self.applied_every = applied_every and self._seconds(applied_every) or self.cadence
+        if self.cadence <= 0 or self.applied_every <= 0:
+            raise ValueError("cadence and applied_every must be positive")
+        # end verify times
+        if not 0.0 <= gap_probability < 1.0:
+            raise ValueError("gap_probability must be within [0, 1[, got %f" % gap_probability)
+        # end verify probability
+        self.jitter = jitter
+        self.gap_probability = gap_probability
+        self.change_rate = change_rate
+        self._random = random.Random(seed)
+
+    # -------------------------
+    ## @name Utilities
+    # @{
+
+    @classmethod
+    def _seconds(cls, value):
+        """@return value as seconds, which may be a frequency string like '1h'"""
+        if isinstance(value, basestring):
+            return frequncy_to_seconds(value)
+        # end convert frequency
+        return value
+
+    def _snapshot_times(self, start, end):
+        """@return iterator yielding all times at which a snapshot is taken, in ascending order"""
+        rand = self._random.random
+        max_jitter = self.jitter * self.cadence
+        # the jitter never exceeds half the cadence, which keeps snapshots ordered
+        max_jitter = min(max_jitter, self.cadence / 2.0)
+        ideal = start + self.cadence
+        while ideal <= end:
+            if not self.gap_probability or rand() >= self.gap_probability:
+                yield ideal + (rand() * 2.0 - 1.0) * max_jitter
+            # end handle gap
+            ideal += self.cadence
+        # end while there are snapshots to take
+
+    def _apply(self, now, samples, num_taken):
+        """Apply our policy to the given samples, and keep only the remaining ones in samples
+        @return a SimulationStep"""
+        st = time()
+        key, (kept, removed) = self.policy.filter_groups(now, [(None, samples)]).next()
+        elapsed = time() - st
+        samples[:] = kept
+        return SimulationStep(now, num_taken, len(kept), len(removed), sum(s[1][1] for s in kept), elapsed)
+
+    ## -- End Utilities -- @}
+
+    # -------------------------
+    ## @name Interface
+    # @{
+
+    def run(self, duration, start = None):
+        """Run the simulation
+        @param duration the simulated time, in seconds or like '90d'
+        @param start seconds since epoch at which to start the simulation, defaults to now minus duration
+        @return iterator yielding a SimulationStep after each application of the policy"""
+        duration = self._seconds(duration)
+        if start is None:
+            start = time() - duration
+        # end handle start
+        end = start + duration
+
+        samples = list()
+        num_taken = 0
+        last_taken = start
+        now = start + self.applied_every
+        for taken in self._snapshot_times(start, end):
+            while taken > now:
+                yield self._apply(now, samples, num_taken)
+                now += self.applied_every
+            # end apply policy while the snapshot is in the future
+            samples.append((seconds_to_datetime(taken), (taken, (taken - last_taken) * self.change_rate)))
+            last_taken = taken
+            num_taken += 1
+        # end for each snapshot
+        while now <= end:
+            yield self._apply(now, samples, num_taken)
+            now += self.applied_every
+        # end apply until the end
+
+    ## -- End Interface -- @}
+
+# end class RetentionSimulator
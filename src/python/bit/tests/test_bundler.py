@@ -10,15 +10,19 @@ __all__ = []
 
 from bit.tests import ITTestCaseBase
 from bit.bundler import *
+from bit.bundle_cache import *
 
 
 import sys
 import os
+import tempfile
+import shutil
 from sqlalchemy import (create_engine,
                         MetaData,
                         select)
 
 from marshal import (dump, load)
+from cPickle import (dumps, loads)
 from datetime import datetime
 from time import time
 
@@ -139,3 +143,223 @@ class TestBundler(ITTestCaseBase):
         # end for each name
 
         
+
+    def test_bundle_cache(self):
+        """Verify bundles survive the roundtrip through the cache"""
+        records = list()
+        for pid in range(20):
+            for version in range(pid % 4 + 1):
+                for fid in range(pid % 3 + 1):
+                    records.append((u'/mnt/projects/pr\xe4fix_%02i/shot_v%03i/file.%04i.exr' % (pid, version, fid),
+                                    (pid * 1024**3, 1300000000 + version, 1300000100 + fid, 33188, 0.5)))
+                # end for each file
+            # end for each version
+        # end for each prefix
+        bundle = Bundler().bundle(records)
+        assert bundle
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'bundle.cache')
+            assert write_bundle_cache(bundle, path, 'lllLd', 'info') == os.path.getsize(path)
+
+            cache = BundleCache(path)
+            assert cache.info == 'info'
+            assert len(cache) == len(bundle)
+            assert cache.num_items == sum(len(items) for bd in bundle.itervalues() for items in bd.itervalues())
+            assert cache.to_bundle() == bundle
+
+            kept = cache.to_bundle(lambda prefix: prefix.endswith(u'_07/shot_v'))
+            assert kept.keys() == [u'/mnt/projects/pr\xe4fix_07/shot_v']
+            assert kept.values()[0] == bundle[kept.keys()[0]]
+            cache.close()
+
+            # invalid files are detected
+            open(path, 'wb').write('x' * 100)
+            self.failUnlessRaises(ValueError, BundleCache, path)
+        finally:
+            shutil.rmtree(tmpdir)
+        # end assure cleanup
+
+    def test_incremental_bundle(self):
+        """Updating only affected prefixes yields the same result as bundling everything"""
+        def records_of(paths):
+            return [(path, (len(path),)) for path in sorted(paths)]
+        # end utility
+
+        paths = set()
+        for pid in range(10):
+            for version in range(pid % 3 + 1):
+                for fid in range(pid % 2 + 1):
+                    paths.add('/projects/p%02i/shot_v%03i/file.%04i.exr' % (pid, version, fid))
+                # end for each file
+            # end for each version
+        # end for each prefix
+        # the last prefix wouldn't be pruned by bundle()
+        paths.add('/unversioned/file')
+
+        bdl = Bundler()
+        bundle = bdl.bundle(records_of(paths))
+
+        # p00 gets a second version, p01 loses all but one version, p05 gets a new file, and p10 is new
+        added = set(('/projects/p00/shot_v001/file.0000.exr', '/projects/p05/shot_v000/file.0002.exr',
+                     '/projects/p10/shot_v000/file.0000.exr', '/projects/p10/shot_v001/file.0000.exr'))
+        removed = set(('/projects/p01/shot_v001/file.0000.exr', '/projects/p01/shot_v001/file.0001.exr',
+                       '/projects/p01/shot_v000/file.0001.exr'))
+        assert not removed - paths
+        new_paths = (paths | added) - removed
+
+        prefixes = bdl.affected_prefixes(bundle, added | removed)
+        assert len(prefixes) == 4
+        for prefix in prefixes:
+            bdl.rebundle_prefix(bundle, prefix, records_of(new_paths))
+        # end for each prefix
+        assert bundle == bdl.bundle(records_of(new_paths))
+        assert '/projects/p01/shot_v' not in bundle
+        assert '/projects/p10/shot_v' in bundle
+
+    def test_parallel_rebuild(self):
+        """Rebuilding with multiple processes yields the same result as doing it serially"""
+        class FilteringBundler(Bundler):
+            rebuild_chunk_size = 3
+
+            def _keep_prefix(self, prefix):
+                return not prefix.startswith('/projects/p03')
+
+            def _keep_item(self, item):
+                return not item[0].endswith('0001.exr')
+        # end class FilteringBundler
+
+        records = list()
+        for pid in range(20):
+            for version in range(pid % 4 + 1):
+                for fid in range(pid % 3 + 1):
+                    records.append(('/projects/p%02i/shot_v%03i/file.%04i.exr' % (pid, version, fid), (pid, fid)))
+                # end for each file
+            # end for each version
+        # end for each prefix
+        records.append(('/unversioned/file', (0, 0)))
+
+        bdl = FilteringBundler()
+        def flattened(bundle):
+            return sorted((prefix, [(b.version, list(b)) for b in blist]) for prefix, blist in bundle.iteritems())
+        # end utility
+
+        serial = bdl.rebuild_bundle(bdl.bundle(records))
+        parallel = bdl.rebuild_bundle(bdl.bundle(records), processes=2)
+        assert serial
+        assert flattened(serial) == flattened(parallel)
+        assert '/projects/p03/shot_v' not in parallel
+        for prefix, blist in parallel.iteritems():
+            assert isinstance(blist, VersionBundleList)
+            assert blist.version_min <= blist.version_max
+        # end for each prefix
+
+    def test_rebuilt_bundle_views(self):
+        """Rebuilt bundles are views on the lists created by bundle(), and don't keep items of their own"""
+        class FilteringBundler(Bundler):
+            def _keep_item(self, item):
+                return not item[0].endswith('0001.exr')
+        # end class FilteringBundler
+
+        def retained_size(bundle):
+            """@return amount of bytes kept alive by the bundle alone"""
+            size = sys.getsizeof(bundle)
+            if bundle._view is not None and bundle._view[1] is not None:
+                size += sys.getsizeof(bundle._view[1])
+            # end handle indices
+            for path, meta in list.__iter__(bundle):
+                size += sys.getsizeof((path, meta)) + sys.getsizeof(path) + sys.getsizeof(meta)
+            # end for each item
+            return size
+        # end utility
+
+        num_files = 1000
+        records = [('/projects/shot_v%03i/file.%04i.exr' % (v, f), (v, f * 10)) for v in range(3) 
+                                                                             for f in range(num_files)]
+        bdl = FilteringBundler()
+        bundle = bdl.bundle(records)
+        version_lists = dict(bundle['/projects/shot_v'])
+        blist = bdl.rebuild_bundle(bundle)['/projects/shot_v']
+        assert [b.version for b in blist] == [0, 1, 2]
+
+        for bundle, key in zip(blist, ('000', '001', '002')):
+            assert bundle._view[0] is version_lists[key]
+            expected = [item for item in version_lists[key] if not item[0].endswith('0001.exr')]
+            assert len(bundle) == num_files - 1 and bundle
+            assert bundle == expected and not bundle != expected
+            assert list(bundle) == expected and list(reversed(bundle)) == expected[::-1]
+            assert bundle[1] == expected[1] and bundle[-1] == expected[-1]
+            assert bundle[2:5] == expected[2:5] and bundle[::100] == expected[::100]
+            assert expected[3] in bundle and bundle.index(expected[3]) == 3 and bundle.count(expected[3]) == 1
+
+            view_size = retained_size(bundle)
+            assert loads(dumps(bundle, 2)) == expected
+            bundle.append(expected[0])
+            assert bundle._view is None and bundle == expected + expected[:1]
+            assert view_size * 2 < retained_size(bundle), "views should use a fraction of the memory of items"
+        # end for each bundle
+
+        # bundles which don't filter any item view the whole version list
+        bundle = Bundler().rebuild_bundle(Bundler().bundle(records))['/projects/shot_v'][0]
+        assert bundle._view[1] is None and len(bundle) == num_files
+        assert bundle == records[:num_files]
+
+    def test_compact_item_list(self):
+        """Compact lists behave like lists of (path, meta) tuples"""
+        items = [('/prefix/v001/dir/file.%04i.exr' % i, (i * 10**12, i / 2.0, i % 2 and 'odd' or None)) 
+                 for i in range(10)]
+        interned = dict()
+        cl = CompactItemList('/prefix/v', interned)
+        cl.extend(items)
+        assert len(cl) == len(items)
+        assert list(cl) == items
+        assert cl == items and not cl != items
+        assert cl[3] == items[3] and cl[-1] == items[-1]
+        assert cl[2:5] == items[2:5]
+        assert interned.keys() == ['001/dir/']
+
+        # types of values are retained, even if they can't be stored compactly
+        cl.append(('/prefix/v001/file', (2**70, 1, 'name')))
+        assert type(cl[-1][1][1]) is int and cl[-1][1][0] == 2**70
+        assert cl[0] == items[0]
+        self.failUnlessRaises(ValueError, cl.append, ('/prefix/v001/file', (1,)))
+
+        # arbitrary meta-data
+        ol = CompactItemList('/prefix/v')
+        ol.append(('/prefix/v002/file', None))
+        assert list(ol) == [('/prefix/v002/file', None)]
+
+        # bundles contain compact lists unless disabled
+        bdl = Bundler()
+        records = [('/prefix/v%03i/file.%04i' % (v, f), (v, f)) for v in range(3) for f in range(2)]
+        compact = bdl.bundle(records)
+        assert isinstance(compact['/prefix/v']['000'], CompactItemList)
+        class PlainBundler(Bundler):
+            compact_items = False
+        # end class PlainBundler
+        plain = PlainBundler().bundle(records)
+        assert type(plain['/prefix/v']['000']) is list
+        assert compact == plain
+        assert loads(dumps(compact['/prefix/v']['001'], 2)) == plain['/prefix/v']['001']
+
+    def test_iter_bundles(self):
+        """Streamed bundles are the same as the ones bundled all at once"""
+        paths = ['/projects/p%02i/shot_v%03i/file.%04i.exr' % (pid, version, fid) 
+                 for pid in range(10) for version in range(pid % 3 + 1) for fid in range(pid % 2 + 1)]
+        # nested prefixes and unversioned paths interrupting prefixes
+        paths.extend(('/projects/p04/shot_v000/sub_v001/file.exr', '/projects/p04/shot_v000/sub_v002/file.exr',
+                      '/projects/p04/shot_v000/unversioned', '/projects/p05/shot_vx/file_v001.exr',
+                      '/projects/p05/shot_vx/file_v002.exr', '/unversioned/file'))
+        records = [(path, (len(path), )) for path in sorted(paths)]
+
+        bdl = Bundler()
+        streamed = list(bdl.iter_bundles(records))
+        assert len(streamed) == len(set(prefix for prefix, bundle_dict in streamed))
+        assert dict(streamed) == bdl.bundle(records)
+
+        rebuilt = dict(bdl.iter_rebuilt_bundles(records))
+        for prefix, blist in bdl.rebuild_bundle(bdl.bundle(records)).iteritems():
+            assert [(b.version, list(b)) for b in blist] == [(b.version, list(b)) for b in rebuilt[prefix]]
+        # end for each prefix
+        assert len(rebuilt) == len(bdl.bundle(records))
@@ -0,0 +1,70 @@
+#-*-coding:utf-8-*-
+"""
+@package bit.tests.test_deletion
+@brief tests for bit.deletion
+
+@author Sebastian Thiel
+@copyright [GNU Lesser General Public License](https://www.gnu.org/licenses/lgpl.html)
+"""
+__all__ = []
+
+import os
+import shutil
+import tempfile
+
+from bit.tests import ITTestCaseBase
+from bit.deletion import DeletionExecutor
+
+
+class TestDeletion(ITTestCaseBase):
+    __slots__ = ()
+
+    def test_executor(self):
+        """Verify dry-runs don't touch anything, and that we remove files and directories and resume"""
+        root = tempfile.mkdtemp()
+        try:
+            files, dirs = list(), list()
+            for dir in ('a', 'a/b', 'a/b/c', 'keep'):
+                dirs.append(os.path.join(root, dir))
+                os.mkdir(dirs[-1])
+            # end for each directory
+            for dir in dirs:
+                for fid in range(5):
+                    files.append(os.path.join(dir, 'file_%i' % fid))
+                    open(files[-1], 'w').close()
+                # end for each file
+            # end for each directory
+            kept_file = files.pop()
+            missing_file = os.path.join(root, 'missing')
+            files.append(missing_file)
+
+            lines = list()
+            executor = DeletionExecutor(num_threads=3, log=lines.append).execute(iter(files), dirs)
+            assert len(lines) - 1 == executor.num_files + executor.num_directories == len(files) + len(dirs)
+            assert lines[-1].startswith('Would have removed %i files' % len(files))
+            assert all(os.path.exists(path) for path in files[:-1] + dirs)
+
+            # pretend a previous run was interrupted after removing the first file, while writing the second one
+            journal = os.path.join(root, 'journal')
+            open(journal, 'w').write('f %s\nf %s' % (files[0], files[1]))
+            lines = list()
+            executor = DeletionExecutor(dry_run=False, num_threads=3, max_iops=1000, journal_path=journal,
+                                        log=lines.append)
+            executor.execute(iter(files), dirs)
+            assert lines[0].startswith('Resuming with 1 paths') and lines[-1].startswith('Removed')
+            assert executor.num_failed == 0
+            assert executor.num_skipped == 1
+            assert executor.num_files == len(files) - 1, "missing files count as removed"
+            assert executor.num_directories == 2, "non-empty directories are kept"
+            assert os.path.exists(files[0]) and os.path.isfile(kept_file)
+            assert not any(os.path.exists(path) for path in files[1:] + dirs[1:3])
+
+            # Now all files are handled according to the journal, and so are the removed directories
+            executor = DeletionExecutor(dry_run=False, journal_path=journal, log=lines.append).execute(files, dirs)
+            assert executor.num_skipped == len(files) + 2
+            assert executor.num_files == 0 and executor.num_directories == 0
+        finally:
+            shutil.rmtree(root)
+        # end assure we clean up
+
+# end class TestDeletion
@@ -0,0 +1,129 @@
+#-*-coding:utf-8-*-
+"""
+@package bit.tests.test_graphite
+@brief tests for bit.graphite
+
+@author Sebastian Thiel
+@copyright [GNU Lesser General Public License](https://www.gnu.org/licenses/lgpl.html)
+"""
+__all__ = []
+
+import os
+import socket
+import shutil
+import tempfile
+import threading
+from struct import unpack
+from time import (time,
+                  sleep)
+
+from bit.tests import ITTestCaseBase
+from bit.graphite import GraphiteSender
+from bit.utility import graphite_submit
+from butility.compat import pickle
+
+
+class _CarbonServer(threading.Thread):
+    """Receives messages like carbon's pickle receiver, and keeps all samples"""
+
+    def __init__(self):
+        super(_CarbonServer, self).__init__()
+        self.daemon = True
+        self.samples = list()
+        self.num_connections = 0
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(5)
+        self.port = self.sock.getsockname()[1]
+
+    def _read(self, conn, size):
+        data = ''
+        while len(data) < size:
+            chunk = conn.recv(size - len(data))
+            if not chunk:
+                return None
+            data += chunk
+        # end while data is missing
+        return data
+
+    def received(self, count, timeout = 5.0):
+        """@return our samples, once we received the given amount of them, or after timeout"""
+        end = time() + timeout
+        while len(self.samples) < count and time() < end:
+            sleep(0.01)
+        # end wait for samples
+        return sorted(self.samples)
+
+    def run(self):
+        while True:
+            conn, addr = self.sock.accept()
+            self.num_connections += 1
+            while True:
+                header = self._read(conn, 4)
+                if header is None:
+                    break
+                self.samples.extend(pickle.loads(self._read(conn, unpack('!L', header)[0])))
+            # end for each message
+            conn.close()
+        # end for each connection
+
+# end class _CarbonServer
+
+
+class GraphiteTests(ITTestCaseBase):
+    __slots__ = ()
+
+    def test_sender(self):
+        """Verify samples are sent through one connection, or spilled while carbon is down"""
+        samples = [('hosts.foo.metric%i' % i, (1400000000, i)) for i in range(2500)]
+        server = _CarbonServer()
+        server.start()
+
+        sender = GraphiteSender('localhost', server.port, batch_size=1000, batch_interval=0.05)
+        assert sender.close(), "it's fine to close it if nothing was sent"
+        assert sender.submit(samples[:1000]) == 1000
+        assert sender.flush(5.0)
+        assert sender.submit(samples[1000:]) == 1500
+        assert sender.close(5.0)
+        assert sender.num_sent == len(samples) and sender.num_connects == 1
+        assert server.received(len(samples)) == sorted(samples)
+        assert server.num_connections == 1
+
+        # Find a port nobody listens on
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(('127.0.0.1', 0))
+        dead_port = sock.getsockname()[1]
+        sock.close()
+
+        sender = GraphiteSender('localhost', dead_port, batch_size=1000, batch_interval=0.05, log=lambda m: None)
+        sender.submit(samples)
+        assert sender.close(5.0)
+        assert sender.num_dropped == len(samples) and sender.num_sent == 0
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            spill_path = os.path.join(tmpdir, 'spill')
+            sender = GraphiteSender('localhost', dead_port, batch_size=1000, batch_interval=0.05,
+                                    spill_path=spill_path, log=lambda m: None)
+            sender.submit(samples)
+            assert sender.close(5.0)
+            assert sender.num_spilled == len(samples) and os.path.isfile(spill_path)
+            assert sender.num_connects == 0
+
+            # the next sender sends the spilled samples first
+            server.samples = list()
+            sender = GraphiteSender('localhost', server.port, batch_interval=0.05, spill_path=spill_path)
+            sender.submit(samples[:10])
+            assert sender.close(5.0)
+            assert sender.num_sent == 10
+            assert not os.path.exists(spill_path)
+            assert server.received(len(samples) + 10) == sorted(samples + samples[:10])
+        finally:
+            shutil.rmtree(tmpdir)
+        # end assure temporary files are removed
+
+        server.samples = list()
+        graphite_submit('localhost', samples, port=server.port)
+        assert server.received(len(samples)) == sorted(samples)
+
+# end class GraphiteTests
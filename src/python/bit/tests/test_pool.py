@@ -0,0 +1,106 @@
+#-*-coding:utf-8-*-
+"""
+@package bit.tests.test_pool
+@brief tests for bit.pool
+
+@author Sebastian Thiel
+@copyright [GNU Lesser General Public License](https://www.gnu.org/licenses/lgpl.html)
+"""
+__all__ = []
+
+import logging
+import threading
+import Queue
+
+from bit.tests import ITTestCaseBase
+from bit.utility import WorkerThread
+from bit.pool import (TaskQueue,
+                      WorkerPool)
+
+
+class _RecordingWorker(WorkerThread):
+    """A worker with a method to be called unbound"""
+    __slots__ = ()
+
+    def record(self, value):
+        return (self.name, value)
+
+# end class _RecordingWorker
+
+
+class PoolTests(ITTestCaseBase):
+    __slots__ = ()
+
+    def test_pool(self):
+        """Verify tasks run by priority, results are delivered like for WorkerThread, and statistics are kept"""
+        log = logging.getLogger('bit.tests.pool')
+        release = threading.Event()
+        order = list()
+
+        pool = WorkerPool(log, 1, worker_type=_RecordingWorker).start()
+        assert pool.call(release.wait) is pool
+        for lane, value in ((TaskQueue.PRIORITY_LOW, 'low'), (None, 'normal'), (TaskQueue.PRIORITY_HIGH, 'high')):
+            if lane is None:
+                pool.call(order.append, value)
+            else:
+                pool.call_in_lane(lane, order.append, value)
+            # end handle default lane
+        # end for each lane
+        release.set()
+        assert pool.drain(5.0)
+        assert order == ['high', 'normal', 'low']
+
+        # Results and errors end up in the output queue, unbound methods get the worker
+        outq = pool.outq
+        while not outq.empty():
+            outq.get()
+        # end drain results
+        pool.call(_RecordingWorker.record, 1)
+        pool.call(lambda: 1 / 0)
+        pool.queue.put((sorted, ([3, 1, 2], )))
+        assert pool.drain(5.0)
+        assert outq.get() == (pool.workers[0].name, 1)
+        assert isinstance(outq.get(), ZeroDivisionError)
+        assert outq.get() == [1, 2, 3]
+
+        stats = pool.queue.stats()
+        assert len(stats) == pool.queue.num_lanes
+        assert stats[TaskQueue.PRIORITY_NORMAL].num_tasks == 5 and stats[TaskQueue.PRIORITY_NORMAL].num_failed == 1
+        assert stats[TaskQueue.PRIORITY_HIGH].num_tasks == 1
+        assert stats[TaskQueue.PRIORITY_LOW].max_wait_time > 0.0
+        assert pool.log_stats() is pool
+
+        # Workers drain the queue before stopping
+        release.clear()
+        pool.call(release.wait)
+        pool.call(order.append, 'drained')
+        pool.cancel()
+        assert pool.join(0.05), "worker is still blocked"
+        release.set()
+        assert not pool.join(5.0)
+        assert order[-1] == 'drained'
+
+        # Workers may also discard all queued tasks
+        pool = WorkerPool(log, 2).start()
+        release.clear()
+        pool.call(release.wait).call(release.wait)
+        assert pool.drain(0.05) is False
+        pool.call(order.append, 'discarded')
+        pool.cancel(drain=False)
+        release.set()
+        assert not pool.join(5.0)
+        assert order[-1] == 'drained'
+        assert pool.drain(0.0)
+
+    def test_backpressure(self):
+        """Verify bounded queues reject tasks which don't fit"""
+        queue = TaskQueue(maxsize=2)
+        queue.put(sorted)
+        queue.put(sorted, lane=TaskQueue.PRIORITY_LOW)
+        self.failUnlessRaises(Queue.Full, queue.put, sorted, False)
+        self.failUnlessRaises(Queue.Full, queue.put_nowait, sorted)
+        assert queue.qsize() == 2
+        assert queue.clear() == 2 and queue.empty()
+        queue.put_nowait(sorted)
+
+# end class PoolTests
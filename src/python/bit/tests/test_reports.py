@@ -8,9 +8,19 @@
 """
 __all__ = []
 
+import os
+import shutil
+import tempfile
+
 from bit.tests import ITTestCaseBase
 
 from bit.reports import *
+from bit.reports.version import (VersionReportGenerator,
+                                 FilteringVersionBundler)
+from bit.retention import RetentionPolicy
+from bit.reports.io_stat import IOStatReportGenerator
+from butility import (Path,
+                      DictObject)
 
 
 class ReportTests(ITTestCaseBase):
@@ -19,7 +29,115 @@ class ReportTests(ITTestCaseBase):
 
     def test_base(self):
         # For now, we just test the import itself, serialization is indirectly tested by the zfs tests
-        pass
+        assert VersionReportGenerator.supports_fix_deletions()
+        assert not IOStatReportGenerator.supports_fix_deletions()
+        assert VersionReportGenerator.DELETE_MAGIC == ReportGenerator.DELETE_MAGIC
 
-# end class ReportTests
+    def test_serialize(self):
+        """Verify records can be streamed, and that converted records are not kept in memory"""
+        calls = list()
+        def conv(val):
+            calls.append(val)
+            return val
+        # end counting converter
+        columns = [('name', str, conv), ('size', int, lambda v: '%iB' % v)]
+        records = [('a', 1), ('bb', 22), ('c', 333)]
+
+        def serialized(records, mode=Report.SERIALIZE_TTY, **kwargs):
+            lines = list()
+            Report(columns=columns, records=records).serialize(mode, lines.append, **kwargs)
+            return ''.join(lines)
+        # end utility
+
+        expected = serialized(records)
+        assert len(calls) == len(records) * 2, "lists are converted once for the widths, and once for writing"
+        assert expected.splitlines()[-1] == 'c     333B'
+        del calls[:]
+        assert serialized(iter(records)) == expected, "streamed records are spooled to get the same result"
+        assert len(calls) == len(records)
+
+        # lists are converted again while writing, instead of keeping all converted records
+        del calls[:]
+        Report(columns=columns, records=records).serialize(Report.SERIALIZE_TTY,
+                                                           lambda string: calls.append(('write', string)))
+        assert calls.index(('write', 'a')) < calls.index('c', len(records))
+        assert serialized(iter(records), window=len(records)) == expected
+        assert serialized(iter(records), mode=Report.SERIALIZE_CSV) == serialized(records, mode=Report.SERIALIZE_CSV)
+
+        # a small window can't know about larger values to come
+        lines = serialized(iter(records), window=1).splitlines()
+        assert len(lines) == 4 and lines[1] == 'a     1B'
+
+        assert Report(columns=columns, records=iter(list())).is_empty()
+        assert serialized(iter(list())) == ''
 
+    def test_version_cache_paths(self):
+        """Verify caches of tables sharing a name prefix are kept apart"""
+        gen = VersionReportGenerator.__new__(VersionReportGenerator)
+        tmpdir = tempfile.mkdtemp()
+        cwd = os.getcwd()
+        os.chdir(tmpdir)
+        try:
+            names = ['fs_stat_%016x.cache' % i for i in range(3)] + ['fs_stat_2024_%016x.cache' % 1, 'fs_stat_foo.cache']
+            for mtime, name in enumerate(names):
+                open(name, 'w').close()
+                os.utime(name, (mtime, mtime))
+            # end for each cache
+            assert [str(p) for p in gen._cache_paths('fs_stat')] == list(reversed(names[:3]))
+            assert [str(p) for p in gen._cache_paths('fs_stat_2024')] == [names[3]]
+
+            gen._prune_caches('fs_stat', 1)
+            assert sorted(os.listdir(tmpdir)) == sorted(names[2:])
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(tmpdir)
+        # end assure temporary files are removed
+
+    def test_version_retention_per_prefix(self):
+        """Verify each prefix keeps the initial versions of the retention policy, no matter how many processes
+        rebuild them"""
+        class ChunkedBundler(FilteringVersionBundler):
+            rebuild_chunk_size = 2
+        # end class ChunkedBundler
+
+        config = DictObject(prefix_include_regex=None, prefix_exclude_regex=None, path_include_regex=None,
+                            path_exclude_regex=None, retention_policy=RetentionPolicy('1-1s:1s'),
+                            keep_latest_version_count=-1)
+        records = [('/projects/p%02i/shot_v%03i/file.exr' % (pid, version), (10, 1000 + version, 1000, 0644, 1.0))
+                   for pid in range(5) for version in range(3)]
+        bdl = ChunkedBundler(config)
+        for processes in (1, 2):
+            bundle = bdl.rebuild_bundle(bdl.bundle(records), processes)
+            assert len(bundle) == 5
+            for blist in bundle.itervalues():
+                assert [b.removed for b in blist] == [True, False, False]
+            # end for each prefix
+        # end for each amount of processes
+
+    def test_io_stat_processes(self):
+        """Verify the process engine reports the volume it read and wrote, like the thread engine would"""
+        tmpdir = tempfile.mkdtemp()
+        configuration = IOStatReportGenerator.configuration
+        try:
+            config = DictObject(dict(num_threads=2, source_path=Path('/dev/urandom'), output_dir=Path(tmpdir),
+                                     write_chunk_size='65536', file_size='1048576', random_writes=0,
+                                     random_read_chunk_size='4096', random_read_volume='262144', engine='process',
+                                     queue_depth=2, direct_io=0, read_ratio=0.5, random_ratio=0.5))
+            IOStatReportGenerator.configuration = lambda self: config
+            gen = IOStatReportGenerator(list())
+            report = gen.generate()
+            assert not gen.error() and not os.listdir(tmpdir), "test files are removed"
+            assert len(report.records) == config.num_threads + 1, "one record per worker, and the aggregate"
+            for record in report.records[:-1]:
+                assert len(record) == len(report.columns)
+                assert 0 < record[7] < 262144, "the volume of each worker is read and written"
+                assert record[8] > 0 and record[9] > 0, "reads and writes have a throughput"
+                assert record[-1] is None
+            # end for each worker record
+            assert report.records[-1][7] == sum(record[7] for record in report.records[:-1])
+        finally:
+            IOStatReportGenerator.configuration = configuration
+            shutil.rmtree(tmpdir)
+        # end assure temporary files are removed
+
+# end class ReportTests
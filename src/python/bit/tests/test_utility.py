@@ -11,11 +11,19 @@ __all__ = []
 from bit.tests import ITTestCaseBase
 
 from bit.utility import *
+from bit.utility import WorkerThread
+import bit.utility
 from time import (time,
                   sleep,
                   timezone)
-from datetime import datetime
+from datetime import (datetime,
+                      timedelta)
 from butility import size_to_int
+import os
+import pwd
+import threading
+import grp
+import gc
 
 class TestUtility(ITTestCaseBase):
     __slots__ = ()
@@ -62,6 +70,73 @@ class TestUtility(ITTestCaseBase):
             assert bool(cache.get(key)) == bool(use_update)
             assert len(cache) == use_update
         # end for each use_update mode
+
+        # LRU eviction
+        cache = ExpiringCache(max_size=2)
+        cache.set(1, 'a').set(2, 'b')
+        assert cache.get(1) == 'a', "1 is now the most recently used one"
+        cache.set(3, 'c')
+        assert len(cache) == 2 and 2 not in cache and 1 in cache
+        assert cache.get(2) is None
+        assert (cache.num_hits, cache.num_misses, cache.num_evictions) == (1, 1, 1)
+
+        # refresh in background
+        cache = ExpiringCache(refresh_ahead=0.9)
+        cache.set(key, 1, ttl, update_fun = lambda k, pv: pv + 1)
+        sleep(ttl * 0.5)
+        assert cache.get(key) == 1, "we get the current value right away"
+        for attempt in range(100):
+            if cache.num_refreshes:
+                break
+            sleep(0.01)
+        # end wait for refresh
+        assert cache.num_refreshes == 1
+        assert cache.get(key) == 2
+
+        # the refresher stops once the cache is gone
+        refreshers = [t for t in threading.enumerate() if t.name == 'ExpiringCache refresher']
+        assert refreshers
+        del cache
+        gc.collect()
+        for thread in refreshers:
+            thread.join(5.0)
+            assert not thread.is_alive()
+        # end for each refresher
+
+        # only one reader updates an expired entry, the others wait for its result
+        release = threading.Event()
+        calls = list()
+        def update(key, previous):
+            calls.append(key)
+            release.wait()
+            return previous + 1
+        # end update
+        cache = ExpiringCache()
+        cache.set(key, 1, 10.0, update, time() - 20.0)
+        results = list()
+        readers = [threading.Thread(target=lambda get=cache.get: results.append(get(key))) for i in range(3)]
+        for reader in readers:
+            reader.start()
+        # end for each reader
+        sleep(ttl)
+        assert len(calls) == 1 and key in cache and not results
+        release.set()
+        for reader in readers:
+            reader.join(5.0)
+        # end for each reader
+        assert calls == [key] and results == [2, 2, 2]
+        assert cache.get(key) == 2
+
+        # clearing drops the value of the update in flight
+        release.clear()
+        cache.set(key, 5, 10.0, update, time() - 20.0)
+        reader = threading.Thread(target=lambda get=cache.get: results.append(get(key)))
+        reader.start()
+        sleep(ttl)
+        assert cache.clear() is cache and len(cache) == 0
+        release.set()
+        reader.join(5.0)
+        assert results[-1] == 6 and key not in cache
           
     def test_user_info(self):
         """Verify user information parser works correctly"""
@@ -128,5 +203,133 @@ class TestUtility(ITTestCaseBase):
         parser = TestSpecialCase()
         res = parser.parse('schumaer')
         assert (407, 'role-data-io') in res.groups
-        
+
+    def test_passwd_user_info(self):
+        """Verify reading the user databases directly yields the same as calling id"""
+        login = pwd.getpwuid(os.getuid()).pw_name
+        expected = IDParser().parse(login)
+        gids = getgrouplist(login, expected.gid[0])
+        assert gids is not None and set(gids) == set(gid for gid, name in expected.groups)
+
+        # Without getgrouplist(), groups are enumerated
+        for getgrouplist_fun in (None, False):
+            bit.utility._getgrouplist = getgrouplist_fun
+            try:
+                for parser in (PasswdIDParser(), CachingPasswdIDParser(time_to_live=10.0)):
+                    for attempt in range(2):
+                        res = parser.parse(login)
+                        assert res.uid == expected.uid and res.gid == expected.gid
+                        assert res.groups[0] == expected.gid
+                        assert sorted(res.groups) == sorted(expected.groups)
+                    # end for each attempt, to hit the cache
+                    assert parser.parse('nonexisting-user-name') is None
+                # end for each parser
+            finally:
+                bit.utility._getgrouplist = None
+            # end assure getgrouplist() is reloaded
+        # end for each way to resolve memberships
+
+        index = GroupIndex(time_to_live=0.0)
+        for group in grp.getgrall():
+            assert index.name(group.gr_gid) == group.gr_name
+            for member in group.gr_mem:
+                assert (group.gr_gid, group.gr_name) in index.groups(member)
+            # end for each member
+        # end for each group
+        assert index.groups('nonexisting-user-name') == list()
+
+    def test_external_sort(self):
+        """Verify sorting with runs on disk yields the same as sorting in memory"""
+        items = [(i * 7919 % 101, i) for i in range(1000)]
+        key = lambda item: item[0]
+        for reverse in (False, True):
+            expected = sorted(items, key=key, reverse=reverse)
+            for chunk_size in (1, 33, 1000, 2000):
+                assert list(external_sort(items, key=key, reverse=reverse, chunk_size=chunk_size)) == expected
+            # end for each chunk size
+        # end for each order
+        assert list(external_sort(iter(tuple()))) == list()
+
+    def test_regex_literal_prefix(self):
+        """Verify we find the literal all matches start with, if there is one"""
+        for pattern, literal in (('/mnt/projects/.*', '/mnt/projects/'),
+                                 (r'^/mnt/foo\.bar/x?', '/mnt/foo.bar/'),
+                                 ('/mnt/(a|b)/', '/mnt/'),
+                                 ('a|b', ''),
+                                 ('[ab]c', ''),
+                                 ('(', '')):
+            assert regex_literal_prefix(pattern) == literal
+        # end for each sample
+        assert isinstance(regex_literal_prefix(u'/mnt'), unicode)
+
+    def test_table_aggregation(self):
+        """Verify aggregates are the same whether records are aggregated as they are added or afterwards"""
+        columns = (('name', str, str, DistinctStringReducer()),
+                   ('size', int, str, rsum),
+                   ('ratio', float, str),
+                   ('age', timedelta, str, ravg),
+                   ('created', int, str, min))
+        records = [('a', 1, 1.0, timedelta(1), 5),
+                   ('b', 2, 2.0, timedelta(2), 3),
+                   ('b', 3, 6.0, timedelta(6), None)]
+        table = Table(columns, aggregate=True)
+        for rec in records:
+            table.append_record(rec)
+        # end for each record
+        expected = ['#2', 6, 3.0, timedelta(3), 3]
+        assert table.aggregator.num_records == 3
+        assert table.aggregate_record() == expected, "means are taken over all values"
+        assert Table(columns, list(records)).aggregate_record() == expected
+
+        aggregate = Table(columns, list(records)).aggregate_record(lambda r: r[1] > 1)
+        assert aggregate[1:] == [5, 4.0, timedelta(4), 3]
+
+        # records added directly are not aggregated yet, which is detected
+        table.records.append(records[0])
+        assert table.aggregate_record()[1] == 7
+
+        aggregator = TableAggregator(columns)
+        assert list(aggregator.iter_added(iter(records))) == records
+        assert aggregator.record()[1:] == expected[1:]
+        assert TableAggregator(columns).record()[1:] == [None] * (len(columns) - 1)
+
+    def test_string_mapper(self):
+        """Verify the longest prefix is mapped, in both directions"""
+        mapper = StringMapper(['/mnt/a', '/filer/a', '/mnt/a/b', '/filer2/b', '/mnt', '/old', '/mnt/a', '/ignored'])
+        assert mapper.apply('/mnt/a/file') == '/filer/a/file'
+        assert mapper.apply('/mnt/a/b/mnt/a') == '/filer2/b/mnt/a', "only the prefix is mapped"
+        assert mapper.apply('/mnt/x') == '/old/x'
+        assert mapper.apply('/other') == '/other'
+        assert mapper.apply('/filer2/b/c', reverse=True) == '/mnt/a/b/c'
+        assert mapper.apply('/filer/a', reverse=True) == '/mnt/a'
+        assert mapper.apply('/ignored', reverse=True) == '/mnt/a'
+        assert mapper.apply('/mnt/a', reverse=True) == '/mnt/a'
+        assert StringMapper().apply('/mnt') == '/mnt'
+        assert StringMapper(['', '/root']).apply('/mnt') == '/root/mnt'
+
+    def test_terminatable_thread(self):
+        """Verify waiting threads wake up as soon as they are canceled"""
+        class Sleeper(TerminatableThread):
+            terminated = None
+            started = threading.Event()
+
+            def run(self):
+                self.terminated = self._wait(0.0) or self._wait_until(time() - 1.0)
+                self.started.set()
+                self.terminated = self._wait(60.0)
+        # end class Sleeper
+
+        thread = Sleeper()
+        thread.start()
+        assert thread.started.wait(5.0) and thread.terminated is False
+        st = time()
+        thread.stop_and_join()
+        assert thread.terminated and time() - st < 5.0
+
+        worker = WorkerThread(None)
+        worker.start()
+        assert worker.call(sorted, [2, 1]).outq.get() == [1, 2]
+        worker.stop_and_join()
+        assert not worker.is_alive()
+
 # end class TestUtility
@@ -11,7 +11,9 @@ __all__ = ['date_string_to_datetime', 'ratio_to_float', 'bool_label_to_bool',
            'seconds_to_datetime', 'delta_to_seconds', 'Table', 'ravg', 'rsum', 'float_to_tty_string', 'graphite_submit',
            'DistinctStringReducer', 'TerminatableThread', 'IDParser',
            'ExpiringCache', 'CachingIDParser', 'ThreadsafeCachingIDParser', 'datetime_to_date_time_string',
-           'StringMapper', 'utc_datetime_to_date_time_string', 'none_support']
+           'StringMapper', 'utc_datetime_to_date_time_string', 'none_support', 'external_sort',
+           'regex_literal_prefix', 'TableAggregator', 'GroupIndex', 'PasswdIDParser', 'CachingPasswdIDParser',
+           'getgrouplist']
 
 from time import (strptime,
                   gmtime,
@@ -23,6 +25,13 @@ from datetime import (timedelta,
 
 import os
 import sys
+import pwd
+import grp
+import heapq
+import tempfile
+import sre_parse
+import sre_constants
+import ctypes
 
 from butility.compat import pickle
 from struct import pack
@@ -31,6 +40,8 @@ import Queue
 import inspect
 import subprocess
 import threading
+import weakref
+from collections import OrderedDict
 
 from butility import (Thread,
                         DictObject)
@@ -72,7 +83,8 @@ date_timedelta = timedelta(0, timezone)
 ## @{
 
 def ravg(prev, cur):
-    """@return average of both values"""
+    """@return average of both values
+    @note a TableAggregator uses it as marker to compute the arithmetic mean of all values instead"""
     return (prev + cur) / 2
 
 def rsum(prev, cur):
@@ -113,6 +125,130 @@ def none_support(string_converter):
     # end wrapper
     wrapper.__name__ = string_converter.__name__
     return wrapper
+
+
+def regex_literal_prefix(pattern):
+    """@return the literal string every string matched by the given regular expression from its start must
+    begin with, or an empty string if there is no such literal. Useful to derive LIKE clauses from regexes.
+    @param pattern a regular expression string
+    @note the literal is case-sensitive, even though the regex might not be"""
+    try:
+        tokens = sre_parse.parse(pattern)
+    except (sre_constants.error, TypeError):
+        return ''
+    # end handle invalid patterns
+    to_char = isinstance(pattern, unicode) and unichr or chr
+
+    chars = list()
+    for op, value in tokens:
+        if op == sre_constants.AT and value == sre_constants.AT_BEGINNING and not chars:
+            continue
+        # end skip leading anchor
+        if op != sre_constants.LITERAL:
+            break
+        # end stop at first non-literal
+        chars.append(to_char(value))
+    # end for each token
+    return type(pattern)().join(chars)
+
+
+class _ReversedKey(object):
+    """Inverts the ordering of the key it wraps, for use in a heap"""
+    __slots__ = ('key')
+
+    def __init__(self, key):
+        self.key = key
+
+    def __lt__(self, other):
+        return other.key < self.key
+
+    def __eq__(self, other):
+        return self.key == other.key
+
+# end class _ReversedKey
+
+
+def _iter_sorted_run(fp):
+    """@return iterator over all items pickled into fp by external_sort()"""
+    fp.seek(0)
+    unpickler = pickle.Unpickler(fp)
+    while True:
+        try:
+            yield unpickler.load()
+        except EOFError:
+            break
+        # end handle end of run
+    # end for each item
+
+def external_sort(iterable, key = None, reverse = False, chunk_size = 100000):
+    """Sort the items of the given iterable, keeping at most chunk_size of them in memory.
+    Sorted runs of chunk_size items are pickled into temporary files, which are merged afterwards.
+    @param iterable yielding items which can be pickled
+    @param key like in sorted()
+    @param reverse like in sorted()
+    @param chunk_size maximum amount of items to sort in memory
+    @return iterator yielding all items in sorted order. The sort is stable."""
+    if key is None:
+        key = lambda item: item
+    # end handle key
+
+    runs = list()
+    chunk = list()
+    try:
+        for item in iterable:
+            chunk.append(item)
+            if len(chunk) < chunk_size:
+                continue
+            # end handle chunk full
+            chunk.sort(key=key, reverse=reverse)
+            fp = tempfile.TemporaryFile(prefix='external_sort')
+            pickler = pickle.Pickler(fp, pickle.HIGHEST_PROTOCOL)
+            for sorted_item in chunk:
+                pickler.dump(sorted_item)
+                # don't let the memo keep all items alive
+                pickler.clear_memo()
+            # end for each item
+            runs.append(fp)
+            chunk = list()
+        # end for each item
+
+        chunk.sort(key=key, reverse=reverse)
+        if not runs:
+            for item in chunk:
+                yield item
+            # end for each item
+            return
+        # end handle in-memory sort
+
+        # MERGE RUNS
+        #############
+        # The run index keeps the sort stable
+        wrap = reverse and _ReversedKey or (lambda k: k)
+        heap = list()
+        iterators = [_iter_sorted_run(fp) for fp in runs] + [iter(chunk)]
+        for rid, it in enumerate(iterators):
+            for item in it:
+                heap.append((wrap(key(item)), rid, item))
+                break
+            # end get first item
+        # end for each run
+        heapq.heapify(heap)
+
+        while heap:
+            wkey, rid, item = heap[0]
+            yield item
+            for item in iterators[rid]:
+                heapq.heapreplace(heap, (wrap(key(item)), rid, item))
+                break
+            else:
+                heapq.heappop(heap)
+            # end handle run depleted
+        # end while there are items
+    finally:
+        for fp in runs:
+            fp.close()
+        # end for each run
+    # end assure temporary files are closed
     
 
 ## -- End Utilities -- @}
@@ -125,6 +261,108 @@ def none_support(string_converter):
 # ------------------------------------------------------------------------------
 ## @{
 
+class TableAggregator(object):
+    """Aggregates records of a Table one at a time, as they are produced, to provide the aggregate record 
+    right away once all records have been seen.
+
+    Each column is reduced using the reducer in its description, see Table.columns. By default, every 
+    number and timedelta is averaged. Columns reduced by ravg() yield the mean of all values, which is obtained 
+    from their sum and count."""
+    __slots__ = (
+                    'num_records',  # amount of records we have aggregated so far
+                    '_reducers',    # a list of reducers per column, or None if it isn't reduced
+                    '_reduce_ids',  # ids of all columns that have a reducer
+                    '_reduced',     # reduced value per column, or None if no value was seen yet
+                    '_counts'       # amount of values per column
+                )
+
+    def __init__(self, columns):
+        """Initialize this instance
+        @param columns a list of column descriptions as used by the Table type"""
+        self.num_records = 0
+        self._reducers = list()
+        self._reduce_ids = list()
+
+        for cid, info in enumerate(columns):
+            if len(info) == 3:
+                name, default, conv = info
+                reducer = None
+                if isinstance(default(), (int, float, timedelta)):
+                    reducer = ravg
+                # end handle default reducer
+            else:
+                assert len(info) == 4
+                name, default, conv, reducer = info
+                if isinstance(reducer, DistinctStringReducer):
+                    # schemas are shared, but the strings we count must not be
+                    reducer = type(reducer)()
+                # end handle stateful reducer
+            # end handle
+
+            self._reducers.append(reducer)
+            if reducer is not None:
+                self._reduce_ids.append(cid)
+            # end setup default value
+        # end for each info
+
+        self._reduced = [None] * len(self._reducers)
+        self._counts = [0] * len(self._reducers)
+
+    # -------------------------
+    ## @name Interface
+    # @{
+
+    def add(self, record):
+        """Aggregate the given record
+        @return record"""
+        reduced = self._reduced
+        counts = self._counts
+        reducers = self._reducers
+        for rid in self._reduce_ids:
+            val = record[rid]
+            if val is None:
+                continue
+            # end ignore unset values
+            pval = reduced[rid]
+            if pval is None:
+                # init reduced value
+                reduced[rid] = val
+            elif reducers[rid] is ravg:
+                reduced[rid] = pval + val
+            else:
+                reduced[rid] = reducers[rid](pval, val)
+            # end handle pval
+            counts[rid] += 1
+        # end for each id we should handle
+        self.num_records += 1
+        return record
+
+    def iter_added(self, records):
+        """@return iterator yielding all given records, after adding them to this instance"""
+        add = self.add
+        for record in records:
+            yield add(record)
+        # end for each record
+
+    def record(self):
+        """@return the aggregate of all records we have seen so far, as list matching the table's schema.
+        Columns without reducer, or without any value, are None"""
+        reduced = list(self._reduced)
+        for rid, reducer in enumerate(self._reducers):
+            if reducer is ravg and reduced[rid] is not None:
+                reduced[rid] = reduced[rid] / self._counts[rid]
+            elif isinstance(reducer, DistinctStringReducer):
+                # We know the special needs of our StringReducer
+                reduced[rid] = str(reducer)
+            # end handle special reducers
+        # end for each reduced value
+        return reduced
+
+    ## -- End Interface -- @}
+
+# end class TableAggregator
+
+
 class Table(object):
     """A simple Table which consists of a schema and records"""
     __slots__ = (
@@ -138,76 +376,63 @@ class Table(object):
                     'columns',
 
                     ## A list of records, being a list of lists
-                    'records'
+                    'records',
+
+                    ## A TableAggregator which sees all records added by append_record(), or None
+                    'aggregator'
                 )
 
-    def __init__(self, columns=None, records=None):
-        """Initialize this instance"""
+    def __init__(self, columns=None, records=None, aggregate=False):
+        """Initialize this instance
+        @param aggregate if True, the records added with append_record() will be aggregated right away. 
+        Requires columns to be set"""
         self.columns = columns or list()
         self.records = records or list()
+        self.aggregator = None
+        if aggregate:
+            assert self.columns, "columns must be set to aggregate records"
+            self.aggregator = TableAggregator(self.columns)
+            for rec in self.records:
+                self.aggregator.add(rec)
+            # end for each initial record
+        # end handle aggregation
 
     # -------------------------
     ## @name Interface
     # @{
 
-    def aggregate_record(self, predicate = lambda r: True):
+    def append_record(self, record):
+        """Append the given record, and aggregate it if we have an aggregator
+        @return this instance"""
+        if self.aggregator is not None:
+            self.aggregator.add(record)
+        # end handle aggregation
+        self.records.append(record)
+        return self
+
+    def aggregate_record(self, predicate = None):
         """Create a record which is the aggregate of all records for which predicate(r) returned True
         By default, it will average every number and date, ideally you provide your own reducer as third 
         entry in your column's description
         @param predicate a function to return True for each record that should take part in the aggregation.
         By default, all values take part
-        @return the aggregate record as matching our schema - you can post-process it and append it to your records"""
-        # map all reducers, determine non-string indices
-        reduced = list()
-        reducers = list()
-        reduce_ids = list()
-
-        for cid, info in enumerate(self.columns):
-            if len(info) == 3:
-                name, default, conv = info
-                reducer = None
-                if isinstance(default(), (int, float, timedelta)):
-                    reducer = ravg
-                # end handle default reducer
-            else:
-                assert len(info) == 4
-                name, default, conv, reducer = info
-            # end handle
-
-            reducers.append(reducer)
-            reduced.append(None)
-
-            if reducer is not None:
-                reduce_ids.append(cid)
-            # end setup default value
-        # end for each info
+        @return the aggregate record as matching our schema - you can post-process it and append it to your records
+        @note if all records were added using append_record(), the aggregate is available without looking at 
+        the records again"""
+        if predicate is None:
+            if self.aggregator is not None and self.aggregator.num_records == len(self.records):
+                return self.aggregator.record()
+            # end use aggregated values
+            records = self.records
+        else:
+            records = (rec for rec in self.records if predicate(rec))
+        # end apply predicate
 
-        for rec in self.records:
-            if not predicate(rec):
-                continue
-            # end apply predicate
-
-            for rid in reduce_ids:
-                pval = reduced[rid]
-                val = rec[rid]
-                if pval is None:
-                    # init reduced value
-                    reduced[rid] = val
-                elif val is not None:
-                    reduced[rid] = reducers[rid](pval, val)
-                # end handle pval
-            # end for each id we should handle
+        aggregator = TableAggregator(self.columns)
+        for rec in records:
+            aggregator.add(rec)
         # end for each record
-
-        # We know the special needs of our StringReducer
-        for rid in xrange(len(reduced)):
-            if isinstance(reducers[rid], DistinctStringReducer):
-                reduced[rid] = str(reducers[rid])
-            # end resolve DistinctStringReducer
-        # end for each reduced value
-
-        return reduced
-    
+        return aggregator.record()
 
     def is_empty(self):
         """@return True if the table has no content"""
@@ -226,13 +451,14 @@ class TerminatableThread(Thread):
     t.stop_and_join()
     
     Derived classes call _should_terminate() to determine whether they should 
-    abort gracefully
+    abort gracefully. Instead of sleeping, they call _wait() or _wait_until(), which return as soon as
+    cancel() is called.
     """
     __slots__ = '_terminate'
     
     def __init__(self, *args, **kwargs):
         super(TerminatableThread, self).__init__(*args, **kwargs)
-        self._terminate = False
+        self._terminate = threading.Event()
         
 
     # -------------------------
@@ -241,7 +467,21 @@ class TerminatableThread(Thread):
     
     def _should_terminate(self):
         """:return: True if this thread should terminate its operation immediately"""
-        return self._terminate
+        return self._terminate.is_set()
+
+    def _wait(self, timeout = None):
+        """Sleep for the given amount of seconds, or until we are asked to terminate
+        @param timeout if None, wait until we are asked to terminate
+        @return True if we should terminate"""
+        if timeout is not None:
+            timeout = max(timeout, 0.0)
+        # end clamp timeout
+        return self._terminate.wait(timeout)
+
+    def _wait_until(self, deadline):
+        """Sleep until the given time, as returned by time.time(), or until we are asked to terminate
+        @return True if we should terminate"""
+        return self._wait(deadline - time())
         
     ## -- End Subclass Interface -- @}
         
@@ -250,9 +490,9 @@ class TerminatableThread(Thread):
     # @{
     
     def cancel(self):
-        """Schedule this thread to be terminated as soon as possible.
+        """Schedule this thread to be terminated as soon as possible, waking it up if it is waiting.
         @note this method does not block."""
-        self._terminate = True
+        self._terminate.set()
     
     def stop_and_join(self):
         """Ask the thread to stop its operation and wait for it to terminate
@@ -324,49 +564,56 @@ class WorkerThread(TerminatableThread):
         self.inq.put((function, args, kwargs))
         return self
     
-    def stop_and_join(self):
-        """Send the stop signal to terminate, then join"""
-        self._terminate = True
-        self.inq.put(self.quit)
-        self.join()
-        self._terminated()
-
     def cancel(self):
+        """Stop after the current task. As we may be blocked waiting for a task, a quit task is put into our
+        input queue as well"""
         super(WorkerThread, self).cancel()
         self.inq.put(self.quit)
     
+    @classmethod
+    def _parse_task(cls, tasktuple):
+        """@return (routine, args, kwargs) tuple parsed from the given task, as documented in our class description.
+        routine will be None if the task is neither a routine, nor a tuple or list of supported length"""
+        routine = None
+        args = tuple()
+        kwargs = dict()
+        if isinstance(tasktuple, (tuple, list)):
+            if len(tasktuple) == 3:
+                routine, args, kwargs = tasktuple
+            elif len(tasktuple) == 2:
+                routine, args = tasktuple
+            elif len(tasktuple) == 1:
+                routine = tasktuple[0]
+            # END tasktuple length check
+        elif inspect.isroutine(tasktuple):
+            routine = tasktuple
+        # END tasktuple handling
+        return routine, args, kwargs
+
+    def _call_routine(self, routine, args, kwargs):
+        """Call the given routine as parsed by _parse_task(). Unbound methods are called with this instance
+        @return the routine's return value"""
+        if inspect.ismethod(routine) and routine.im_self is None:
+            return routine(self, *args, **kwargs)
+        # end handle unbound methods
+        return routine(*args, **kwargs)
+    
     def run(self):
         """Process input tasks until we receive the quit signal"""
         while True:
             if self._should_terminate():
                 break
             # END check for stop request
-            routine = self.quit
-            args = tuple()
-            kwargs = dict()
             tasktuple = self.inq.get()
-            
-            if isinstance(tasktuple, (tuple, list)):
-                if len(tasktuple) == 3:
-                    routine, args, kwargs = tasktuple
-                elif len(tasktuple) == 2:
-                    routine, args = tasktuple
-                elif len(tasktuple) == 1:
-                    routine = tasktuple[0]
-                # END tasktuple length check
-            elif inspect.isroutine(tasktuple):
-                routine = tasktuple
-            # END tasktuple handling
+            routine, args, kwargs = self._parse_task(tasktuple)
+            if routine is None:
+                routine = self.quit
+            # END handle unsupported tuples
             
             try:
                 rval = None
-                if inspect.ismethod(routine):
-                    if routine.im_self is None:
-                        rval = routine(self, *args, **kwargs)
-                    else:
-                        rval = routine(*args, **kwargs)
-                elif inspect.isroutine(routine):
-                    rval = routine(*args, **kwargs)
+                if inspect.isroutine(routine):
+                    rval = self._call_routine(routine, args, kwargs)
                 else:
                     # ignore unknown items
                     self.log.error("%s: task %s was not understood - terminating", self.name, str(tasktuple))
@@ -492,19 +739,19 @@ def graphite_submit(carbon_host, sample_list, port=CARBON_PORT):
     @param sample_list a list in the following format: [(path, (unix_timestamp, numeric))]"""
     # make sure payload doesn't get too big - therefore we will just chunk it up into 1000 items, allowing
     # each sample to be 1000 bytes
-    max_size = (2**20) - 100
+    # All chunks are sent through the same connection.
+    # See bit.graphite.GraphiteSender for sending without blocking
     cs = 1000
-    for cursor in xrange(0, len(sample_list), cs):
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.connect((socket.gethostbyname(carbon_host), port))
-        try:
+    sock = socket.create_connection((carbon_host, port))
+    try:
+        for cursor in xrange(0, len(sample_list), cs):
             payload = pickle.dumps(sample_list[cursor:cursor+cs])
             message = pack('!L', len(payload)) + payload
             sock.sendall(message)
-        finally:
-            sock.close()
-        # end assure socket is closed
-    # end for each chunk
+        # end for each chunk
+    finally:
+        sock.close()
+    # end assure socket is closed
 
 
 class ExpiringCache(object):
@@ -513,12 +760,47 @@ class ExpiringCache(object):
 
     None has a special meaning, as is returned if the cache is expired. Even though you can set it, 
     when getting the value you wouldn't know if the cache is expired or if it is your value.
+
+    The cache may be used by multiple threads. If max_size is set, the least recently used entries are evicted 
+    to keep at most max_size entries. If refresh_ahead is set, entries with an update function are updated by a 
+    background thread if they are read shortly before they expire, which saves readers from waiting for it.
+    The thread stops once the cache is deleted.
+
+    Expired entries are updated by only one reader at a time. Other readers of the same key wait for the result.
     """
-    __slots__ = ('_store')
+    __slots__ = (
+                    '_store',           # OrderedDict of key -> (value, time set, ttl, update), least recently used first
+                    '_lock',            # protects our store and counters
+                    '_updated',         # a Condition on our lock, notified whenever a key is done updating
+                    '_refresh_queue',   # a Queue of keys for the refresh thread, or None if it wasn't started yet
+                    '_refreshing',      # a set of keys which are queued for refresh, or which are being updated
+                    'max_size',         # maximum amount of entries, or 0 if unbounded
+                    'refresh_ahead',    # fraction of the time to live before expiry in which a read triggers a refresh
+                    'num_hits',         # amount of get() calls which found a valid value
+                    'num_misses',       # amount of get() calls which found no value, or an expired one
+                    'num_evictions',    # amount of entries removed to stay within max_size
+                    'num_refreshes',    # amount of entries updated in the background
+                    '__weakref__'       # allows our refresh thread to not keep us alive
+                )
 
-    def __init__(self):
-        """Initialize this instance"""
-        self._store = dict()
+    ## Put into the refresh queue to stop the refresh thread
+    _refresh_stop = object()
+
+    def __init__(self, max_size = 0, refresh_ahead = 0.0):
+        """Initialize this instance
+        @param max_size if not 0, the maximum amount of entries we keep
+        @param refresh_ahead if not 0, a fraction of the time to live of an entry. If an entry with update function 
+        is read within this time before it expires, it will be updated in the background"""
+        assert max_size >= 0, "max_size must not be negative"
+        assert 0.0 <= refresh_ahead < 1.0, "refresh_ahead must be within [0, 1["
+        self._store = OrderedDict()
+        self._lock = threading.Lock()
+        self._updated = threading.Condition(self._lock)
+        self._refresh_queue = None
+        self._refreshing = set()
+        self.max_size = max_size
+        self.refresh_ahead = refresh_ahead
+        self.num_hits = self.num_misses = self.num_evictions = self.num_refreshes = 0
         
     def __len__(self):
         return len(self._store)
@@ -526,6 +808,75 @@ class ExpiringCache(object):
     def __contains__(self, key):
         return key in self._store
 
+    # -------------------------
+    ## @name Utilities
+    # @{
+
+    def _schedule_refresh(self, key):
+        """Have the given key refreshed in the background, starting the thread to do it if required
+        @note must be called with our lock acquired"""
+        if key in self._refreshing:
+            return
+        # end skip keys which are already queued
+        if self._refresh_queue is None:
+            queue = self._refresh_queue = Queue.Queue()
+            # The thread only knows us weakly, and is stopped once we are deleted
+            stop = self._refresh_stop
+            ref = weakref.ref(self, lambda ref: queue.put(stop))
+            thread = threading.Thread(target=type(self)._refresh_entries, args=(ref, queue),
+                                      name='ExpiringCache refresher')
+            thread.daemon = True
+            thread.start()
+        # end start refresher
+        self._refreshing.add(key)
+        self._refresh_queue.put(key)
+
+    @classmethod
+    def _refresh_entries(cls, ref, queue):
+        """Refresh all keys put into the given queue, until the cache behind the given weak reference is deleted"""
+        while True:
+            key = queue.get()
+            cache = ref()
+            if key is cls._refresh_stop or cache is None:
+                break
+            # end handle deleted cache
+            cache._refresh(key)
+            del cache
+        # end for each key to refresh
+
+    def _refresh(self, key):
+        """Update the entry at the given key, if it still exists"""
+        entry = self._store.get(key)
+        value = None
+        if entry is not None:
+            try:
+                value = entry[3](key, entry[0])
+            except Exception:
+                # It will just expire, and get() will try to update it again
+                entry = None
+            # end ignore failures
+        # end have entry
+
+        self._lock.acquire()
+        try:
+            self._refreshing.discard(key)
+            self._updated.notify_all()
+            # Values set in the meanwhile take precedence
+            if entry is None or self._store.get(key) is not entry:
+                return
+            # end skip changed entries
+            if value is None:
+                del self._store[key]
+            else:
+                self._store[key] = (value, time(), entry[2], entry[3])
+            # end handle expired value
+            self.num_refreshes += 1
+        finally:
+            self._lock.release()
+        # end assure lock is released
+
+    ## -- End Utilities -- @}
+
     # -------------------------
     ## @name Interface
     # @{
@@ -533,27 +884,71 @@ class ExpiringCache(object):
     def get(self, key):
         """@return value at Key (may be None as well), or None, if the value is expired or if it didn't exist
         @note get mutates the internal storage as it may drop values upon refresh, or update them if update_fun was set."""
-        if key not in self._store:
-            return None
-        # end ignore missing entries
-
-        value, it, ttl, update = self._store[key]
         ct = time()
-        if ct > it + ttl:
-            if update:
-                value = update(key, value)
-                self._store[key] = (value, ct, ttl, update)
-            # end update existing value
+        self._lock.acquire()
+        try:
+            while True:
+                entry = self._store.pop(key, None)
+                if entry is None:
+                    self.num_misses += 1
+                    return None
+                # end ignore missing entries
+
+                value, it, ttl, update = entry
+                if ct <= it + ttl:
+                    # make it the most recently used one
+                    self._store[key] = entry
+                    self.num_hits += 1
+                    if update is not None and self.refresh_ahead and ct > it + ttl * (1.0 - self.refresh_ahead):
+                        self._schedule_refresh(key)
+                    # end handle refresh ahead
+                    return value
+                # end handle valid entry
+
+                if update is None:
+                    self.num_misses += 1
+                    return None
+                # end drop expired entries
+
+                # keep the expired entry while it is updated, so readers know it exists
+                self._store[key] = entry
+                if key not in self._refreshing:
+                    break
+                # end handle entries nobody updates
+                # Someone else is updating it already - wait for the result
+                self._updated.wait()
+            # end while the entry is being updated
 
-            if update is None or value is None:
-                del self._store[key]
-                return None
-            # end
-        # end handle expired cache
+            self.num_misses += 1
+            self._refreshing.add(key)
+        finally:
+            self._lock.release()
+        # end assure lock is released
 
+        # Don't block readers of other keys while updating
+        updated = False
+        try:
+            value = update(key, value)
+            updated = True
+        finally:
+            self._lock.acquire()
+            try:
+                self._refreshing.discard(key)
+                self._updated.notify_all()
+                # Values set in the meanwhile take precedence
+                if updated and self._store.get(key) is entry:
+                    del self._store[key]
+                    if value is not None:
+                        self._store[key] = (value, ct, ttl, update)
+                    # end keep updated value
+                # end handle unchanged entry
+            finally:
+                self._lock.release()
+            # end assure lock is released
+        # end assure waiting readers are notified
         return value
 
-    def set(self, key, value, time_to_live=sys.float_info.max, update_fun=None):
+    def set(self, key, value, time_to_live=sys.float_info.max, update_fun=None, set_time=None):
         """Set the given value to be found at the given key, as long as the lifetime of it is positive, it will 
         be returned by successive calls of get(key)
         @param key at which to store the value
@@ -561,8 +956,30 @@ class ExpiringCache(object):
         @param time_to_live time in seconds (int or float) after which the object should expire and be expunged from the cache
         @param update_fun if not None, f(key, expired_value) -> new_value . If set, a function that returns the new value 
         given the now expired one. If it returns None, the value is expired
+        @param set_time if not None, the time in seconds since epoch at which the value was obtained. Defaults to now
         @return this instance"""
-        self._store[key] = (value, time(), time_to_live, update_fun)
+        self._lock.acquire()
+        try:
+            self._store.pop(key, None)
+            self._store[key] = (value, set_time is None and time() or set_time, time_to_live, update_fun)
+            while self.max_size and len(self._store) > self.max_size:
+                self._store.popitem(last=False)
+                self.num_evictions += 1
+            # end evict least recently used
+        finally:
+            self._lock.release()
+        # end assure lock is released
+        return self
+
+    def clear(self):
+        """Remove all entries. Entries which are being updated right now will not be stored
+        @return this instance"""
+        self._lock.acquire()
+        try:
+            self._store.clear()
+        finally:
+            self._lock.release()
+        # end assure lock is released
         return self
         
     ## -- End Interface -- @}
@@ -689,11 +1106,13 @@ class CachingIDParser(IDParser):
     """An ID parser which caches parse results for a given amount of seconds"""
     __slots__ = ('_cache', '_ttl')
 
-    def __init__(self, time_to_live):
+    def __init__(self, time_to_live, max_size = 0, refresh_ahead = 0.0):
         """Initialize this instance
-        @param time_to_live amount of time in seconds our id information should remain valid for"""
+        @param time_to_live amount of time in seconds our id information should remain valid for
+        @param max_size maximum amount of logins to cache, see ExpiringCache
+        @param refresh_ahead see ExpiringCache"""
         self._ttl = time_to_live
-        self._cache = ExpiringCache()
+        self._cache = ExpiringCache(max_size, refresh_ahead)
 
     
     # -------------------------
@@ -702,21 +1121,20 @@ class CachingIDParser(IDParser):
 
     def parse(self, login):
         """Similar to subclass, but implements caching"""
-        if login not in self._cache:
-            # First time call - set up the cache
+        value = self._cache.get(login)
+        if value is None and login not in self._cache:
+            # First time call, or evicted - set up the cache
             update = lambda key, pv: super(CachingIDParser, self).parse(key)
             value = update(login, None)
             self._cache.set(login, value, self._ttl, update)
-            return value
         # end handle initial setup (we expect auto-update)
-
-        return self._cache.get(login)
+        return value
 
     def set_cache_expires_after(self, time_to_live):
         """Set how fast items in this cache are expiring.
         If set, the entire cache will be expired right away
         @return this instance"""
-        self._cache = ExpiringCache()
+        self._cache.clear()
         self._ttl = time_to_live
         return self
 
@@ -747,9 +1165,213 @@ class ThreadsafeCachingIDParser(CachingIDParser):
 # end class ThreadsafeCachingIDParser
 
 
+## getgrouplist(3) of the C library, None if it wasn't loaded yet, or False if it isn't available
+_getgrouplist = None
+
+def getgrouplist(login, gid):
+    """@return list of gids of all groups the given login is a member of, including the given gid, as resolved by 
+    the name service like 'id' does it. This works even if groups can't be enumerated, like with LDAP.
+    Returns None if the C library doesn't provide getgrouplist(3)
+    @param login name of the user
+    @param gid the primary group id of the user"""
+    global _getgrouplist
+    if _getgrouplist is None:
+        try:
+            _getgrouplist = getattr(ctypes.CDLL(None), 'getgrouplist', False)
+        except OSError:
+            _getgrouplist = False
+        # end handle missing library
+    # end load function
+    if not _getgrouplist:
+        return None
+    # end handle unavailable function
+
+    if isinstance(login, unicode):
+        login = login.encode('utf-8')
+    # end convert login
+    count = 64
+    while True:
+        ngroups = ctypes.c_int(count)
+        groups = (ctypes.c_uint * count)()
+        if _getgrouplist(login, ctypes.c_uint(gid), groups, ctypes.byref(ngroups)) >= 0:
+            return [int(member_gid) for member_gid in groups[:ngroups.value]]
+        # end handle success
+        # ngroups is the required amount, on systems which provide it
+        count = max(ngroups.value, count * 2)
+    # end while the buffer is too small
+
+
+class GroupIndex(object):
+    """An index of all group memberships, read from the group database in one go and kept for a while.
+    It makes looking up the groups of many logins cheap.
+    @note the name service must allow enumerating all groups for the index to be complete, which is why
+    PasswdIDParser uses it only if getgrouplist() isn't available"""
+    __slots__ = (
+                    'time_to_live', # seconds after which the index is read again
+                    '_members',     # dict of login -> [(gid, name), ...] of all groups the login is a member of
+                    '_names',       # dict of gid -> group name
+                    '_read_at',     # time at which we last read the group database, or None
+                    '_lock'         # assures only one thread reads the database
+                )
+
+    def __init__(self, time_to_live = 300.0):
+        """Initialize this instance
+        @param time_to_live amount of seconds after which the group database will be read again"""
+        self.time_to_live = time_to_live
+        self._members = dict()
+        self._names = dict()
+        self._read_at = None
+        self._lock = threading.Lock()
+
+    # -------------------------
+    ## @name Utilities
+    # @{
+
+    def _update(self):
+        """Read the group database if our index expired"""
+        ct = time()
+        if self._read_at is not None and ct - self._read_at <= self.time_to_live:
+            return
+        # end handle up-to-date index
+
+        self._lock.acquire()
+        try:
+            if self._read_at is not None and ct - self._read_at <= self.time_to_live:
+                return
+            # end another thread was faster
+            members = dict()
+            names = dict()
+            for group in grp.getgrall():
+                names[group.gr_gid] = group.gr_name
+                for login in group.gr_mem:
+                    members.setdefault(login, list()).append((group.gr_gid, group.gr_name))
+                # end for each member
+            # end for each group
+            self._members, self._names = members, names
+            self._read_at = time()
+        finally:
+            self._lock.release()
+        # end assure lock is released
+
+    ## -- End Utilities -- @}
+
+    # -------------------------
+    ## @name Interface
+    # @{
+
+    def groups(self, login):
+        """@return list of (gid, name) tuples of all groups the given login is an explicit member of, which 
+        doesn't include its primary group, unless it is listed as member"""
+        self._update()
+        return self._members.get(login, list())
+
+    def name(self, gid):
+        """@return name of the group with the given gid, or None if there is no such group"""
+        self._update()
+        return self._names.get(gid)
+
+    ## -- End Interface -- @}
+
+# end class GroupIndex
+
+
+class PasswdIDParser(IDParser):
+    """An IDParser which reads the user and group databases using the pwd and grp modules, instead of calling 
+    the 'id' program in a subprocess. It yields the same information, with the primary group as first group.
+
+    Group memberships are resolved with getgrouplist(), like 'id' does. Only if it isn't available, all groups are
+    enumerated, which may miss groups of name services that don't support enumeration."""
+    __slots__ = ()
+
+    # -------------------------
+    ## @name Configuration
+    # @{
+
+    ## A GroupIndex to look up group names, and memberships if getgrouplist() isn't available, or None to read 
+    # the group database for each login
+    group_index = None
+    
+    ## -- End Configuration -- @}
+
+    # -------------------------
+    ## @name Utilities
+    # @{
+
+    def _group_name(self, gid):
+        """@return the name of the group with the given gid, or None if it doesn't exist"""
+        if self.group_index is not None:
+            name = self.group_index.name(gid)
+            if name is not None:
+                return name
+            # end handle indexed group
+        # end use index
+        try:
+            return grp.getgrgid(gid).gr_name
+        except KeyError:
+            return None
+        # end handle unknown groups
+
+    def _member_groups(self, login, gid):
+        """@return list of (gid, name) tuples of all groups login is a member of, which may include its 
+        primary group gid"""
+        gids = getgrouplist(login, gid)
+        if gids is not None:
+            return [(member_gid, self._group_name(member_gid)) for member_gid in gids]
+        # end use name service
+        if self.group_index is not None:
+            return self.group_index.groups(login)
+        # end use index
+        return [(group.gr_gid, group.gr_name) for group in grp.getgrall() if login in group.gr_mem]
+
+    ## -- End Utilities -- @}
+
+    # -------------------------
+    ## @name Interface Overrides
+    # @{
+
+    def parse(self, login):
+        """See IDParser.parse(), but without calling 'id'"""
+        try:
+            info = pwd.getpwnam(login)
+        except KeyError:
+            return None
+        # end handle unknown logins
+
+        gid = (info.pw_gid, self._group_name(info.pw_gid))
+        groups = [gid]
+        groups.extend(group for group in self._member_groups(login, info.pw_gid)
+                                                                                if group[0] != info.pw_gid)
+        return DictObject(dict(uid = (info.pw_uid, info.pw_name),
+                               gid = gid,
+                               groups = groups))
+
+    ## -- End Interface Overrides -- @}
+
+# end class PasswdIDParser
+
+
+class CachingPasswdIDParser(CachingIDParser, PasswdIDParser):
+    """A CachingIDParser which doesn't need to call 'id', using a GroupIndex to look up group names.
+    It is threadsafe, as the cache is, and as no subprocesses are involved.
+    @note group memberships are at most time_to_live seconds old, plus whatever the name service caches. Only if 
+    getgrouplist() isn't available, they come from the index, and may be up to time_to_live + 
+    group_index.time_to_live seconds old"""
+    __slots__ = ()
+
+    group_index = GroupIndex()
+
+# end class CachingPasswdIDParser
+
+
 class StringMapper(object):
-    """Allows to map a path from a source to a destination based on a simple map"""
-    __slots__ = ('_map_list')
+    """Allows to map a path from a source to a destination based on a simple map.
+
+    Each direction uses a prefix tree, which finds the longest matching prefix in time proportional to the length
+    of the string, independently of the amount of pairs in the map"""
+    __slots__ = (
+                    '_map_list',    # list of (source, destination) pairs, longest source first
+                    '_tries'        # a prefix tree of sources, and one of destinations
+                )
 
 
     def __init__(self, map_list=list()):
@@ -760,6 +1382,22 @@ class StringMapper(object):
         self._map_list = sorted(zip(map_list[0::2], map_list[1::2]), # zip the list together, to get a tuple
                                     key=lambda t: len(t[0]),         # sort by first element string length
                                     reverse=True)                    # longest string first        
+        self._tries = (self._make_trie(self._map_list, 0), self._make_trie(self._map_list, 1))
+
+    @classmethod
+    def _make_trie(cls, pairs, key_index):
+        """@return a prefix tree of nested dicts keyed by character. The node of each key of the given pairs 
+        maps None to (len(key), value). If a key occurs multiple times, the first one wins"""
+        root = dict()
+        for pair in pairs:
+            key = pair[key_index]
+            node = root
+            for char in key:
+                node = node.setdefault(char, dict())
+            # end for each character
+            node.setdefault(None, (len(key), pair[1 - key_index]))
+        # end for each pair
+        return root
 
 
     # -------------------------
@@ -767,7 +1405,7 @@ class StringMapper(object):
     # @{
 
     def apply(self, string, reverse=False):
-        """Maps strings looked up in a string map.
+        """Maps strings looked up in a string map, replacing the longest matching prefix.
         @param string the string to map
         @param reverse if False, map from source to destination. Otherwise, map form destination to source.
         Used for reverse mapping the string again.
@@ -775,16 +1413,21 @@ class StringMapper(object):
         """
         assert string
 
-        idxKey      = (0 if reverse == False else 1)
-        idxValue    = (1 if reverse == False else 0)
-
-        for entry in self._map_list:
-            if string.startswith(entry[idxKey]):
-                return string.replace(string[:len(entry[idxKey])], entry[idxValue])
-            # end match found
-        #end loop through string map
-
-        return string
+        node = self._tries[bool(reverse)]
+        match = node.get(None)
+        for char in string:
+            node = node.get(char)
+            if node is None:
+                break
+            # end handle mismatch
+            match = node.get(None, match)
+        # end for each character
+
+        if match is None:
+            return string
+        # end handle no match
+        length, value = match
+        return value + string[length:]
 
     ## -- End Interface -- @}
 # end class StringMapper
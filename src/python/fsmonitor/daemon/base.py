@@ -11,8 +11,7 @@ __all__ = ['DaemonThread']
 import logging
 
 from Queue import Queue
-from time import (time, 
-                  sleep)
+from time import time
 
 import bapp
 from ..base import Dropbox
@@ -22,6 +21,8 @@ from .utility import (SQLPackageDifferMixin,
                       DaemonDropboxFinderMixin)
 
 from bit.utility import TerminatableThread
+from bit.pool import (TaskQueue,
+                      WorkerPool)
 from bkvstore import FrequencyStringAsSeconds
 
 from bkvstore import (KeyValueStoreSchema,
@@ -106,8 +107,8 @@ class DaemonThread(TerminatableThread, ApplicationSettingsMixin, DaemonDropboxFi
         
         self._config = config = self.settings_value()
         assert config.search.paths, "Need to specify at least one dropbox search path"
-        self._ops_queue    = Queue()
-        self._update_queue = Queue()
+        self._ops_queue    = TaskQueue()
+        self._update_queue = TaskQueue()
 
         # init mixins
         SQLPackageDifferMixin.__init__(self)
@@ -290,13 +291,13 @@ class DaemonThread(TerminatableThread, ApplicationSettingsMixin, DaemonDropboxFi
 
         log.debug("Scheduling package updates")
         for key in db_keys:
-            self._update_queue.put((self._handle_packages_diff, [key]))
+            self._update_queue.put((self._handle_packages_diff, [key]), lane=TaskQueue.PRIORITY_LOW)
         # end for each dropbox to handle
 
     def _schedule_transaction_check(self):
         """place a task which will check if packages can be run"""
         # NOTE: The transaction check will always be queued. Otherwise it would defeat the purpose
-        self._update_queue.put(self._check_transactions)
+        self._update_queue.put(self._check_transactions, lane=TaskQueue.PRIORITY_HIGH)
 
     ## -- End Task Schedulers -- @}
 
@@ -314,7 +315,6 @@ class DaemonThread(TerminatableThread, ApplicationSettingsMixin, DaemonDropboxFi
         # SETUP THREADS
         ################
         result_handler = ResultLoggerThread(result_queue)
-        workers = list()
 
         assert config.db.url, "The url must be set to allow storing package data in a central database"
         assert config.authentication.privileged_group, "Privileged group must be set to prevent misuse"
@@ -328,22 +328,15 @@ class DaemonThread(TerminatableThread, ApplicationSettingsMixin, DaemonDropboxFi
         assert 0 < config.threads.num_update_threads < self.MAX_WORKERS, "Need to set at least one update thread, max %i" % self.MAX_WORKERS
         assert 0 < config.threads.num_operation_threads < self.MAX_WORKERS, "Need to set at least one operation thread, max %i" % self.MAX_WORKERS
 
-        def start_workers(inq, format, count):
-            for tid in xrange(count):
-                thread = SessionWorkerThread(log, inq, result_queue, url=config.db.url)
-                # We are making sure it will not go down, but in case something is very wrong, it's nicer
-                # if the process doesn't hang and can be cleaned up.
-                thread.daemon = True
-                thread.name = format % tid
-                log.info("Starting thread %s" % thread.name)
-                thread.start()
-                workers.append(thread)
-            # end for each thread to create
-        # end for each update worker    
-
+        # Workers are daemons - we are making sure they will not go down, but in case something is very wrong,
+        # it's nicer if the process doesn't hang and can be cleaned up.
         result_handler.start()
-        start_workers(self._update_queue, "t-check-%i", config.threads.num_update_threads)
-        start_workers(self._ops_queue, "t-operation-%i", config.threads.num_operation_threads)
+        pools = [WorkerPool(log, count, worker_type=SessionWorkerThread, queue=queue, outq=result_queue,
+                            name_format=name_format, url=config.db.url).start()
+                 for queue, name_format, count in ((self._update_queue, "t-check-%i",
+                                                                        config.threads.num_update_threads),
+                                                   (self._ops_queue, "t-operation-%i",
+                                                                        config.threads.num_operation_threads))]
 
 
 
@@ -374,30 +367,32 @@ class DaemonThread(TerminatableThread, ApplicationSettingsMixin, DaemonDropboxFi
                     info[0] = current_time
                 # end perform update
             # end for each scheduler id
-            sleep(1.0)
+            self._wait_until(min(last_runtime + update_every for last_runtime, update_every, _ in schedulers))
         # end task loop
 
 
         # SHUTDOWN
         ############
-        for thread in workers:
-            thread.cancel()
-            log.info("Canceled thread %s", thread.name)
-        # end for each thread
+        # Workers stop once they handled all queued tasks
+        for pool in pools:
+            pool.cancel()
+        # end for each pool
 
         # Wait for threads
         st = time()
-        while workers:
+        while True:
+            workers = sum((pool.join(1.0) for pool in pools), list())
+            if not workers:
+                break
+            # end handle all workers down
             elapsed = time() - st
             log.info("Waiting for workers to shut down ... %i still active after %.02fs", len(workers), elapsed)
-            for thread in workers[:]:
-                if not thread.is_alive():
-                    workers.remove(thread)
-                # end worker is down already
-            # end for each worker to possibly remove
-            sleep(1)
         # end while there are workers to wait for
 
+        for pool in pools:
+            pool.log_stats()
+        # end for each pool
+
     ## -- End Interface -- @}
 
 # end class DaemonThread
@@ -70,12 +70,18 @@ class ResultLoggerThread(TerminatableThread):
                 break
             # end handle abort requests
 
-            # Note: Don't block forever, as we have to keep responding to termination requests
+            # Note: cancel() wakes us up while we block
             res = self.inq.get()
             if isinstance(res, Exception):
                 log.error("A task failed with error: %s", str(res))
             # end handle exceptions
         # end run forever
+
+    def cancel(self):
+        """Wake up the thread, which is likely to wait for results"""
+        super(ResultLoggerThread, self).cancel()
+        self.inq.put(None)
+
 # end class ResultLoggerThread
 
 
@@ -92,7 +98,8 @@ class SessionWorkerThread(WorkerThread):
         super(SessionWorkerThread, self).__init__(*args, **kwargs)
 
     def cancel(self):
-        """Only cancel through the queue, to assure we handle what has to be handled.
+        """Only cancel through the queue, to assure we handle what has to be handled. Therefore we never
+        set our termination event.
         Otherwise un-finished jobs will remain queued and confuse the logic if the daemon goes down in the meanwhile, 
         and restarts."""
         self.inq.put(self.quit)
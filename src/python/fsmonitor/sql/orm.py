@@ -27,7 +27,7 @@ from sqlalchemy.orm import (object_session,
 from datetime import datetime
 
 from butility import Path
-from bit.utility import ThreadsafeCachingIDParser
+from bit.utility import CachingPasswdIDParser
 
 log = logging.getLogger('dropbox.sql.orm')
 
@@ -234,9 +234,11 @@ class SQLPackageTransaction(SQLBase):
     def __str__(self):
         return "SQLPackageTransaction(id=%s,type_name=%s,in_package_id=%s)" % (self.id, self.type_name, self.in_package_id)
 
-    ## An ID parser to help us evaluate 'id' calls, in a thread-safe version. For now ttl is hardcoded
+    ## An ID parser to obtain group memberships, in a thread-safe version. For now ttl is hardcoded
     # but could be overridden by users using set_cache_expires_after()
-    _id_parser = ThreadsafeCachingIDParser(time_to_live=60.0)
+    # Logins used often are refreshed in the background, and we never keep more than the given amount
+    # It reads the user and group databases directly, instead of calling 'id' for each login
+    _id_parser = CachingPasswdIDParser(time_to_live=60.0, max_size=10000, refresh_ahead=0.25)
     
     ## -- End Class Level Utilities -- @}
 
@@ -10,4 +10,5 @@
 from .base import *
 from .fsstat import *
 from .report import *
+from .fsstat_query import *
 from .dropbox_interface import *
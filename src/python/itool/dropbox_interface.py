@@ -20,7 +20,7 @@ from bit.cmd import OverridableSubCommandMixin
 from bit.reports import Report
 from bit.utility import (  utc_datetime_to_date_time_string,
                            float_percent_to_tty_string,
-                           IDParser,
+                           PasswdIDParser,
                            none_support)
 
 from butility import (login_name,
@@ -336,7 +336,7 @@ class DropboxInterfaceSubCommand(IToolSubCommand, OverridableSubCommandMixin, ba
         config = DaemonThread.settings_value()
 
         # Assure the caller may actually call us
-        res = IDParser().parse(login_name())
+        res = PasswdIDParser().parse(login_name())
         if config.authentication.privileged_group not in [g[1] for g in res.groups]:
             self.log().error("Your are not authorized to run this program - user '%s' is not in group '%s'" %
                                                                         (login_name(), config.authentication.privileged_group))
@@ -10,8 +10,17 @@ __all__ = []
 
 import sys
 import os
-import hashlib
+import re
 import socket
+import shutil
+import tempfile
+import anydbm
+import threading
+import Queue
+from struct import (pack,
+                    unpack,
+                    calcsize)
+from fnmatch import translate as glob_to_regex
 from itertools import chain
 
 from os import (readlink,
@@ -37,12 +46,22 @@ except ImportError:
 from bit.utility import seconds_to_datetime
 import bapp
 from bapp import ApplicationSettingsMixin
-from bkvstore import KeyValueStoreSchema
+from bkvstore import (KeyValueStoreSchema,
+                      StringList,
+                      AnyKey)
 from .base import IToolSubCommand
 from . import fsstat_schema
+from .fsstat_digest import (digest_names,
+                            digest_constructor,
+                            benchmark_digests,
+                            fastest_digest,
+                            DIGEST_SHA1,
+                            DIGEST_FASTEST)
+from bit.reports import Report
 
 from butility import (Path,
-                      int_to_size_string)
+                      int_to_size_string,
+                      size_to_int)
 import bcmd.argparse as argparse
 
 from sqlalchemy import (create_engine,
@@ -84,6 +103,334 @@ def to_ascii(uni_string):
 ## -- End Utilities -- @}
 
 
+class PathFilter(object):
+    """Compiles include and exclude rules into a single regular expression each, to decide which paths
+    should be crawled.
+
+    Rules are globs, or regular expressions if prefixed with 're:'. Globs without a slash are matched against
+    the last path component (like '.snapshot'), globs with slashes and regular expressions are matched against
+    the path relative to the root the rules were added for. Rules added for all roots match any trailing part of
+    a path instead, so 'renders/*.exr' matches '/mnt/proj/renders/a.exr'.
+
+    Exclude rules apply to directories and files alike, and excluded directories are not descended into.
+    If there are include rules, only files matching at least one of them are kept. Directories are not affected
+    by include rules.
+    """
+    __slots__ = (
+                    '_exclude',         # list of regular expression strings of exclude rules
+                    '_include',         # list of regular expression strings of include rules
+                    '_include_scope',   # list of regular expressions matching all roots with include rules
+                    '_exclude_regex',   # compiled regex of all exclude rules, or None
+                    '_include_regex',   # compiled regex of all include rules, or None
+                    '_scope_regex'      # compiled regex of all roots with include rules, or None
+                )
+
+    ## Prefix indicating the rule is a regular expression
+    REGEX_PREFIX = 're:'
+
+    def __init__(self):
+        self._exclude = list()
+        self._include = list()
+        self._include_scope = list()
+        self._exclude_regex = self._include_regex = self._scope_regex = None
+
+    # -------------------------
+    ## @name Utilities
+    # @{
+
+    def _rule_to_regex(self, root_regex, rule):
+        """@return regular expression string matching the given rule below the given root regex"""
+        if rule.startswith(self.REGEX_PREFIX):
+            return root_regex + '.*?(?:%s)' % rule[len(self.REGEX_PREFIX):]
+        # end handle regex
+
+        # fnmatch appends an end-of-string marker and global flags - both don't work within an alternation
+        regex = glob_to_regex(rule)
+        suffix = '\\Z(?ms)'
+        if regex.endswith(suffix):
+            regex = regex[:-len(suffix)]
+        # end strip suffix
+        if '/' not in rule or not root_regex:
+            # match basenames, or any trailing part of the path if the rule has no root
+            regex = '(?:.*/)?' + regex
+        # end match basename
+        return root_regex + regex + '$'
+
+    def _compile(self, regexes):
+        """@return a single compiled regex matching all given regular expressions, or None if there is none"""
+        if not regexes:
+            return None
+        # end handle no rules
+        return re.compile('|'.join('(?:%s)' % r for r in regexes), re.DOTALL)
+
+    ## -- End Utilities -- @}
+
+    # -------------------------
+    ## @name Interface
+    # @{
+
+    def add_rules(self, root, include=tuple(), exclude=tuple()):
+        """Add the given rules, which will only apply to paths below root.
+        @param root an absolute path, or an empty string to make the rules apply to all paths
+        @param include iterable of include rules
+        @param exclude iterable of exclude rules
+        @return self
+        @note call compile() once all rules were added"""
+        root_regex = ''
+        if root:
+            root_regex = re.escape(root.rstrip('/')) + '/'
+        # end handle root
+
+        self._exclude.extend(self._rule_to_regex(root_regex, r) for r in exclude)
+        if include:
+            self._include.extend(self._rule_to_regex(root_regex, r) for r in include)
+            self._include_scope.append(root_regex)
+        # end handle include
+        return self
+
+    def compile(self):
+        """Compile all previously added rules into their respective regular expression
+        @return self"""
+        self._exclude_regex = self._compile(self._exclude)
+        self._include_regex = self._compile(self._include)
+        self._scope_regex = self._compile(self._include_scope)
+        return self
+
+    def is_empty(self):
+        """@return True if there are no rules"""
+        return self._exclude_regex is None and self._include_regex is None
+
+    def excludes(self, path):
+        """@return True if the given path (file or directory) is excluded"""
+        return self._exclude_regex is not None and self._exclude_regex.match(path) is not None
+
+    def excludes_file(self, path):
+        """@return True if the given file path is excluded, either explicitly or for lack of an include rule"""
+        if self.excludes(path):
+            return True
+        if self._include_regex is None or self._scope_regex.match(path) is None:
+            return False
+        return self._include_regex.match(path) is None
+
+    def prune_directories(self, root, dirs):
+        """Remove all excluded directories from dirs, in place. Useful with os.walk()
+        @param root the directory containing all dirs
+        @param dirs a list of directory names
+        @return dirs"""
+        if self._exclude_regex is not None:
+            join = os.path.join
+            dirs[:] = [d for d in dirs if not self.excludes(join(root, d))]
+        # end handle exclusion
+        return dirs
+
+    ## -- End Interface -- @}
+
+# end class PathFilter
+
+
+class HardLinkCache(object):
+    """Remembers the digest and compression ratio of files with more than one hard link, to allow
+    reading each of these inodes only once.
+
+    Entries are kept in memory up to a budget, after which all of them are spilled into a dbm file on disk.
+    """
+    __slots__ = (
+                    '_memory',      # dict of key -> value, both packed strings
+                    '_max_entries', # amount of entries we keep in memory before spilling
+                    '_spill_dir',   # directory containing the spill database, or None
+                    '_spill',       # spill database, or None
+                    'hits'          # amount of successful lookups
+                )
+
+    ## (st_dev, st_ino)
+    key_format = '!QQ'
+
+    ## (st_size, st_mtime, ratio) followed by the digest
+    value_format = '!Qdd'
+    value_size = calcsize(value_format)
+
+    ## Estimated amount of bytes each entry takes in memory, including the dict overhead
+    bytes_per_entry = 200
+
+    def __init__(self, memory_budget):
+        """Initialize this instance
+        @param memory_budget amount of bytes our entries may occupy in memory"""
+        self._memory = dict()
+        self._max_entries = max(1, memory_budget / self.bytes_per_entry)
+        self._spill_dir = None
+        self._spill = None
+        self.hits = 0
+
+    def __len__(self):
+        return len(self._memory) + (self._spill is not None and len(self._spill) or 0)
+
+    # -------------------------
+    ## @name Utilities
+    # @{
+
+    def _key(self, stat):
+        """@return packed key for the given stat"""
+        return pack(self.key_format, stat.st_dev, stat.st_ino)
+
+    def _spill_to_disk(self):
+        """Move all in-memory entries into our spill database"""
+        if self._spill is None:
+            self._spill_dir = tempfile.mkdtemp(prefix='fsstat-hardlinks')
+            self._spill = anydbm.open(os.path.join(self._spill_dir, 'cache'), 'n')
+        # end create spill database
+        for key, value in self._memory.iteritems():
+            self._spill[key] = value
+        # end for each entry
+        self._memory.clear()
+
+    ## -- End Utilities -- @}
+
+    # -------------------------
+    ## @name Interface
+    # @{
+
+    def get(self, stat):
+        """@return tuple of (digest, ratio) previously stored for the inode of the given stat, or None if 
+        there is no such entry or if the file changed in the meanwhile"""
+        key = self._key(stat)
+        value = self._memory.get(key)
+        if value is None and self._spill is not None and key in self._spill:
+            value = self._spill[key]
+        # end check spill database
+        if value is None:
+            return None
+        # end handle miss
+
+        size, mtime, ratio = unpack(self.value_format, value[:self.value_size])
+        if size != stat.st_size or mtime != stat.st_mtime:
+            return None
+        # end handle changed file
+        if ratio < 0:
+            ratio = None
+        # end handle unset ratio
+        self.hits += 1
+        return value[self.value_size:], ratio
+
+    def set(self, stat, digest, ratio):
+        """Remember digest and ratio for the inode of the given stat
+        @return self"""
+        if len(self._memory) >= self._max_entries:
+            self._spill_to_disk()
+        # end handle budget
+        self._memory[self._key(stat)] = pack(self.value_format, stat.st_size, stat.st_mtime,
+                                             ratio is None and -1.0 or ratio) + digest
+        return self
+
+    def close(self):
+        """Release all resources, including the spill database"""
+        self._memory.clear()
+        if self._spill is not None:
+            self._spill.close()
+            self._spill = None
+            shutil.rmtree(self._spill_dir, ignore_errors=True)
+            self._spill_dir = None
+        # end remove spill database
+
+    ## -- End Interface -- @}
+
+# end class HardLinkCache
+
+
+class RecordWriterThread(threading.Thread):
+    """A thread to execute batches of records on its own database connection, which allows the producer 
+    of records to keep going while the database commits.
+
+    The amount of batches in flight is bounded, which makes producers wait if the database falls behind.
+    Errors in the writer are re-raised in the producer on the next call to submit() or finish().
+    """
+    __slots__ = (
+                    '_execute',    # function to execute a batch, see FSStatSubCommand.do_execute_records()
+                    '_engine',     # engine to create our connection with
+                    '_log',        # logger to use
+                    '_queue',      # queue of batches to execute
+                    '_exc_info'    # exc_info of the first error we encountered, or None
+                )
+
+    def __init__(self, execute, engine, log, queue_size):
+        """Initialize this instance
+        @param execute a function like FSStatSubCommand.do_execute_records()
+        @param engine used to create our own connection
+        @param log a logger instance
+        @param queue_size maximum amount of batches which are waiting to be executed"""
+        super(RecordWriterThread, self).__init__(name='fs-stat record writer')
+        self.daemon = True
+        self._execute = execute
+        self._engine = engine
+        self._log = log
+        self._queue = Queue.Queue(queue_size)
+        self._exc_info = None
+
+    def _raise_error(self):
+        """Raise the error encountered by the writer, if there was one"""
+        if self._exc_info is not None:
+            exc_info, self._exc_info = self._exc_info, None
+            raise exc_info[0], exc_info[1], exc_info[2]
+        # end handle error
+
+    def run(self):
+        connection = None
+        while True:
+            batch = self._queue.get()
+            if batch is None:
+                break
+            # end handle end of work
+            if self._exc_info is not None:
+                # just drain the queue to unblock producers
+                continue
+            # end skip batches after errors
+            try:
+                if connection is None:
+                    connection = self._engine.connect()
+                # end connect lazily
+                self._execute(connection, *batch)
+            except Exception:
+                self._log.error("Database writer failed - dropping all remaining batches", exc_info=True)
+                self._exc_info = sys.exc_info()
+            # end keep error for the producer
+        # end for each batch
+        if connection is not None:
+            connection.close()
+        # end close connection
+
+    # -------------------------
+    ## @name Interface
+    # @{
+
+    def submit(self, statement, records, overall_start_time = None, total_num_records = None):
+        """Queue the given records for execution, blocking if too many batches are waiting already.
+        Parameters are similar to FSStatSubCommand.do_execute_records().
+        @note records will be cleared, as the writer takes ownership of all contained items"""
+        if self._exc_info is not None:
+            # stop the writer and raise its error
+            self.finish()
+        # end handle writer errors
+        if not records:
+            return
+        # end skip empty batches
+        batch = (statement, list(records), self._log, overall_start_time, total_num_records)
+        del records[:]
+        if self._queue.full():
+            self._log.info("Waiting for database writer to catch up ...")
+        # end inform about backpressure
+        self._queue.put(batch)
+
+    def finish(self):
+        """Wait for all batches to be executed, and stop the thread.
+        @throw the error encountered by the writer, if there was one"""
+        self._queue.put(None)
+        self.join()
+        self._raise_error()
+
+    ## -- End Interface -- @}
+
+# end class RecordWriterThread
+
+
 class Streamer(object):
     """A utility which streams a file in chunks of a given size, and calls a handler which can be implemented
     by subclasses"""
@@ -240,7 +587,21 @@ class FSStatSubCommand(IToolSubCommand, bapp.plugin_type(), ApplicationSettingsM
     """Implements interaction with filesystem info caches"""
     __slots__ = ()
 
-    _schema = KeyValueStoreSchema('itool', {'fs_stat' : {'db_url' : str}})
+    _schema = KeyValueStoreSchema('itool', {'fs_stat' : {'db_url' : str,
+                                                         # digest to use for new tables, see --digest
+                                                         'digest' : DIGEST_SHA1,
+                                                         # memory to use for remembering digests of hard-linked
+                                                         # files, before spilling them to disk
+                                                         'hardlink_memory' : '128m',
+                                                         # amount of record batches which may wait for the
+                                                         # database writer. 0 commits synchronously.
+                                                         'write_queue_size' : 4,
+                                                         # Rules to apply to all roots, see PathFilter
+                                                         'filter' : {'include' : StringList,
+                                                                     'exclude' : StringList},
+                                                         # name : {'path' : root, 'include' : [...], 'exclude' : [...]}
+                                                         # Rules which only apply to the given root path
+                                                         'roots' : {AnyKey : dict()}}})
     
     # -------------------------
     ## @name Baseclass Configuration
@@ -304,13 +665,35 @@ class FSStatSubCommand(IToolSubCommand, bapp.plugin_type(), ApplicationSettingsM
         parser.add_argument('-m', '--merge', dest='merge_paths', nargs='+', metavar='SQLITE_DB_FILE', 
                            help=help)
 
+        help = "Glob or 're:' prefixed regular expression of files or directories to exclude when crawling. "
+        help += "Added to the exclude rules configured in itool.fs_stat.filter.exclude"
+        parser.add_argument('-x', '--exclude', dest='exclude', nargs='+', metavar='RULE', default=list(),
+                            help=help)
+
+        help = "Glob or 're:' prefixed regular expression of files to include when crawling - all other files "
+        help += "are skipped. Added to the include rules configured in itool.fs_stat.filter.include"
+        parser.add_argument('-in', '--include', dest='include', nargs='+', metavar='RULE', default=list(),
+                            help=help)
+
+        help = "The digest algorithm to use when creating a new table, default is '%s'. " % config.fs_stat.digest
+        help += "Existing tables always use the algorithm they were created with. "
+        help += "'%s' picks the digest with the highest throughput on this host" % DIGEST_FASTEST
+        parser.add_argument('-dg', '--digest', dest='digest', default=None,
+                            choices=digest_names() + [DIGEST_FASTEST], help=help)
+
+        help = "Measure the throughput of all digests available on this host and exit"
+        parser.add_argument('--benchmark-digests', dest='benchmark_digests', action='store_true',
+                            default=False, help=help)
+
         help = "Causes all duplicate paths to be removed, keeping only the most recent sample"
         parser.add_argument('-rd', '--remove-duplicate-paths', dest='remove_duplicates', action='store_true', 
                             default=False)
         return self
         
     def execute(self, args, remaining_args):
-        if args.update_db:
+        if args.benchmark_digests:
+            return self._benchmark_digests()
+        elif args.update_db:
             return self._update_db(args)
         else:
             self.log().error("--update-database not set or configured")
@@ -329,6 +712,75 @@ class FSStatSubCommand(IToolSubCommand, bapp.plugin_type(), ApplicationSettingsM
             return path
         return "sqlite:///%s" % path
 
+    def _benchmark_digests(self):
+        """Print the throughput of all digests as report
+        @return error code"""
+        report = Report(columns=(('digest', str, str),
+                                 ('throughput[MB/s]', float, lambda f: '%.2f' % f)))
+        report.records.extend(benchmark_digests())
+        report.serialize(Report.SERIALIZE_TTY, sys.stdout.write)
+        return self.SUCCESS
+
+    def _recorded_digest(self, connection, table_name):
+        """@return name of the digest algorithm used by the given table, or None if there is no record
+        @param connection to a database which contains the digest table"""
+        digest = fsstat_schema.digest
+        row = connection.execute(select([digest.c.algorithm], digest.c.table_name == table_name)).fetchone()
+        return row and row[0] or None
+
+    def _record_digest(self, connection, table_name, algorithm):
+        """Store the given algorithm as the one used by the given table, replacing a previous record, which 
+        remains if a table is dropped and re-created under the same name"""
+        digest = fsstat_schema.digest
+        connection.execute(digest.delete().where(digest.c.table_name == table_name))
+        connection.execute(digest.insert(), table_name=table_name, algorithm=algorithm)
+
+    def _record_writer(self, engine):
+        """@return a started RecordWriterThread as configured, or None if writes should be synchronous"""
+        queue_size = self.settings_value().fs_stat.write_queue_size
+        if queue_size < 1:
+            return None
+        # end handle synchronous writes
+        if engine.dialect.name == 'sqlite':
+            # sqlite would just lock the writer out while we read
+            self.log().info("Committing synchronously to sqlite database")
+            return None
+        # end handle sqlite
+        writer = RecordWriterThread(self.do_execute_records, engine, self.log(), queue_size)
+        writer.start()
+        return writer
+
+    def _records_executor(self, engine, connection):
+        """@return a tuple of (submit, finish) functions. submit(statement, records, overall_start_time,
+        total_num_records) will execute the records, possibly asynchronously, and finish() must be called 
+        once all records were submitted"""
+        writer = self._record_writer(engine)
+        if writer is None:
+            log = self.log()
+            def submit(statement, records, overall_start_time = None, total_num_records = None):
+                self.do_execute_records(connection, statement, records, log, overall_start_time, total_num_records)
+            return submit, lambda: None
+        # end handle synchronous writes
+        return writer.submit, writer.finish
+
+    def _hardlink_cache(self):
+        """@return a new HardLinkCache as configured"""
+        return HardLinkCache(size_to_int(self.settings_value().fs_stat.hardlink_memory))
+
+    def _path_filter(self, args):
+        """@return a compiled PathFilter based on our configuration and the given commandline arguments"""
+        config = self.settings_value().fs_stat
+        path_filter = PathFilter().add_rules('', list(config.filter.include) + args.include,
+                                                 list(config.filter.exclude) + args.exclude)
+        for name, root in config.roots.iteritems():
+            if not root.get('path'):
+                self.log().warn("Filter rules for root '%s' don't specify a path - ignored", name)
+                continue
+            # end skip invalid roots
+            path_filter.add_rules(root['path'], root.get('include') or tuple(), root.get('exclude') or tuple())
+        # end for each root
+        return path_filter.compile()
+
     def _fetch_record_iterator(self, connection, selector, window):
         """@return an iterator which uses a window to retrieve 'window' amount of items based on the selector statement.
             It yields a cursor that should be iterated to obtain rows
@@ -459,7 +911,10 @@ class FSStatSubCommand(IToolSubCommand, bapp.plugin_type(), ApplicationSettingsM
         isabs = os.path.isabs
         dirname = os.path.dirname
         basename = os.path.basename
-        streamer = HashStreamer(hashlib.sha1, lz4dumps)
+        streamer = HashStreamer(digest_constructor(args.digest), lz4dumps)
+        path_filter = self._path_filter(args)
+        hardlinks = self._hardlink_cache()
+        submit, finish_writes = self._records_executor(engine, connection)
         ## A mapping from directory names to all of its files (as names)
         dir_entries = dict()
         
@@ -576,7 +1031,8 @@ class FSStatSubCommand(IToolSubCommand, bapp.plugin_type(), ApplicationSettingsM
                         # taking another sha. Otherwise we assume that it's just any other change, which we will
                         # put into the database in the form of a new commit, of course.
                         if self._append_path_record(updates, path, streamer, log, stat,
-                                                    size == stat.st_size and (sha1, ratio) or None):
+                                                    size == stat.st_size and (sha1, ratio) or None,
+                                                    hardlinks):
                             # add the rid to have everything we need for the update
                             updates[-1]['rid'] = rid
                             modified_count += 1
@@ -593,7 +1049,7 @@ class FSStatSubCommand(IToolSubCommand, bapp.plugin_type(), ApplicationSettingsM
                 
                 if len(updates) >= commit_every_records or time() - time_of_last_commit >= commit_every_seconds:
                     total_num_updates += len(updates)
-                    self.do_execute_records(connection, update, updates, log, st, total_num_updates)
+                    submit(update, updates, st, total_num_updates)
                     time_of_last_commit = time()
                 #end handle executions
             # end for each file in database windows
@@ -607,7 +1063,7 @@ class FSStatSubCommand(IToolSubCommand, bapp.plugin_type(), ApplicationSettingsM
         
         progress()
         total_num_updates += len(updates)
-        self.do_execute_records(connection, update, updates, log, st, total_num_updates)
+        submit(update, updates, st, total_num_updates)
         
         ########################
         # HANDLE ADDITIONS ###
@@ -631,19 +1087,29 @@ class FSStatSubCommand(IToolSubCommand, bapp.plugin_type(), ApplicationSettingsM
             """Find all entries recursively in path and append them
             @param path directory or path
             @return amount of added items"""
+            # Prune before touching the filesystem
+            if path_filter.excludes(path):
+                return added_count
+            # end handle exclusion
+
+            path_ascii = to_ascii(path)
+            is_dir = os.path.isdir(path_ascii)
+            if not is_dir and path_filter.excludes_file(path):
+                return added_count
+            # end handle file exclusion
+
             # no matter what, add the entry
-            if self._append_path_record(new_records, path, streamer, log):
+            if self._append_path_record(new_records, path, streamer, log, hardlinks=hardlinks):
                 added_count += 1
                 if added_count % stats_info_every == 0:
                     log.info("Found %i ADDED paths", added_count)
                 # end info printing
                 if len(new_records) >= commit_every_records or time() - last_commit_time[0] >= commit_every_seconds:
-                    self.do_execute_records(connection, insert, new_records, log, st, added_count)
+                    submit(insert, new_records, st, added_count)
                     last_commit_time[0] = time()
             # end handle path
             
-            path_ascii = to_ascii(path)
-            if os.path.isdir(path_ascii):
+            if is_dir:
                 entries = list_dir_safely(path_ascii)
                 for entry in entries:
                     added_count = append_records_recursive(join(path, entry), added_count)
@@ -670,9 +1136,12 @@ class FSStatSubCommand(IToolSubCommand, bapp.plugin_type(), ApplicationSettingsM
         
         if new_records:
             log.info("Committing remaining %i new records", len(new_records))
-            self.do_execute_records(connection, insert, new_records, log, st, added_count)
+            submit(insert, new_records, st, added_count)
         # end commit new records
+        finish_writes()
         connection.close()
+        log.info("Re-used digests of %i hard-linked files", hardlinks.hits)
+        hardlinks.close()
         
         elapsed = time() - st
         log.info("== Statistics ==")
@@ -685,10 +1154,12 @@ class FSStatSubCommand(IToolSubCommand, bapp.plugin_type(), ApplicationSettingsM
         return nr
     
     
-    def _append_path_record(self, records, path, streamer, log, ex_stat = None, digest_ratio = None):
+    def _append_path_record(self, records, path, streamer, log, ex_stat = None, digest_ratio = None, hardlinks = None):
         """Append meta-data about the given path to the given list of records
         @param stat if you have received the stat already, we will not get it again
         @param digest_ratio if not None, we will use the given digest and ration  instead of creating our own
+        @param hardlinks if not None, a HardLinkCache to obtain digests of hard-linked files from, and to 
+        store them in. That way, each inode is read only once.
         @return stat structure of the path, or None if the path could not be read"""
         # minimize file access
         try:
@@ -706,10 +1177,14 @@ class FSStatSubCommand(IToolSubCommand, bapp.plugin_type(), ApplicationSettingsM
             
             
             
+            # Only files with multiple links are tracked, which keeps the cache small
+            is_hardlink = hardlinks is not None and stat.st_nlink > 1 and isreg(stat.st_mode)
+            if is_hardlink and not digest:
+                digest, ratio = hardlinks.get(stat) or (None, None)
+            # end lookup hardlink
+
             if islink(stat.st_mode):
                 # Don't follow symlinks as this tricks us into thinking we have duplicates.
-                # Hower, we would also have to check for hardlinks, but tracking those 
-                # can easliy cost too much memory. Hardlinks are rare anyway, so its okay.
                 ldest = unicode(readlink(ascii_path))
             elif isreg(stat.st_mode) and not digest:
                 fd = os.open(ascii_path, os.O_RDONLY)
@@ -737,6 +1212,9 @@ class FSStatSubCommand(IToolSubCommand, bapp.plugin_type(), ApplicationSettingsM
                     log.error("Failed to stream file '%s' - skipping", ascii_path, exc_info=True)
                     return None
                 # end handle io errors gracefully
+                if is_hardlink:
+                    hardlinks.set(stat, digest, ratio)
+                # end remember hardlink
             finally:
                 os.close(fd)
             # end assure we close the file
@@ -881,6 +1359,15 @@ class FSStatSubCommand(IToolSubCommand, bapp.plugin_type(), ApplicationSettingsM
                 raise AssertionError("Cannot remove duplicates on non-existing table")
             # end handle remove duplicates
             
+            digest = args.digest or self.settings_value().fs_stat.digest
+            if digest == DIGEST_FASTEST:
+                digest = fastest_digest()
+                log.info("Picked '%s' as fastest digest on this host", digest)
+            # end handle fastest digest
+            # fail early if it's unavailable
+            digest_constructor(digest)
+            args.digest = digest
+
             meta = fsstat_schema.meta
             fsstat_schema.record.name = args.table_name
             meta.bind = engine
@@ -890,6 +1377,8 @@ class FSStatSubCommand(IToolSubCommand, bapp.plugin_type(), ApplicationSettingsM
             # assure we have the meta-data with the proper name - renaming the table before we create_all
             # is kind of a hack
             meta = MetaData(engine, reflect=True)
+            connection = engine.connect()
+            self._record_digest(connection, args.table_name, args.digest)
         else:
             if args.with_index:
                 log.info("Cannot create index on exiting table without additional logic - turning index creation off")
@@ -898,12 +1387,21 @@ class FSStatSubCommand(IToolSubCommand, bapp.plugin_type(), ApplicationSettingsM
             
             fsitem = meta.tables[args.table_name]
             log.info("Updating database '%s' at '%s'", path, args.table_name)
+
+            # Databases created before digests were recorded don't have the table yet
+            fsstat_schema.digest.create(engine, checkfirst=True)
+            connection = engine.connect()
+            digest = self._recorded_digest(connection, args.table_name) or DIGEST_SHA1
+            if args.digest and args.digest != digest:
+                raise AssertionError("Table '%s' uses digest '%s', cannot update it using '%s'" 
+                                     % (args.table_name, digest, args.digest))
+            # end verify digest
+            args.digest = digest
         # end initialize table
-        
+        log.info("Using '%s' digest", args.digest)
         
         strip = str.strip
         basename = os.path.basename
-        connection = engine.connect()
         insert = fsitem.insert()
         
         st = time()
@@ -925,7 +1423,10 @@ class FSStatSubCommand(IToolSubCommand, bapp.plugin_type(), ApplicationSettingsM
         #########################
         elif args.directories:
             
-            streamer = HashStreamer(hashlib.sha1, lz4dumps)
+            streamer = HashStreamer(digest_constructor(args.digest), lz4dumps)
+            path_filter = self._path_filter(args)
+            hardlinks = self._hardlink_cache()
+            submit, finish_writes = self._records_executor(engine, connection)
             join = os.path.join
             normalize = os.path.normpath
             totalbcount = 0 # total amount of bytes processed
@@ -950,6 +1451,13 @@ class FSStatSubCommand(IToolSubCommand, bapp.plugin_type(), ApplicationSettingsM
                 # normalize to prevent extra stuff
                 directory = normalize(directory) 
                 for root, dirs, files in os.walk(directory, followlinks=False):
+                    # Prune excluded directories before os.walk descends into them, and skip excluded files
+                    # before they are stat'ed
+                    if not path_filter.is_empty():
+                        path_filter.prune_directories(root, dirs)
+                        files = [f for f in files if not path_filter.excludes_file(join(root, f))]
+                    # end apply filter
+
                     # NOTE: We also take directories, as it allows to find directories with many files, or with
                     # no files (empty directories). Also, we can optimize updates that way
                     # Just to also handle root ! It must be in the database, otherwise we can never
@@ -964,7 +1472,7 @@ class FSStatSubCommand(IToolSubCommand, bapp.plugin_type(), ApplicationSettingsM
                         # only join if we are not seeing the root. Otherwise we get a slash appended
                         # Which is something we really don't want as it could hinder later updates
                         path = filename and join(root, filename) or root 
-                        stat = self._append_path_record(records, path, streamer, log)
+                        stat = self._append_path_record(records, path, streamer, log, hardlinks=hardlinks)
                         if stat:
                             totalbcount += stat.st_size
                                 
@@ -976,19 +1484,23 @@ class FSStatSubCommand(IToolSubCommand, bapp.plugin_type(), ApplicationSettingsM
                         if time() - lct >= commit_every_seconds or nr % commit_every_fcount == 0:
                             lct = time()
                             progress()
-                            self.do_execute_records(connection, insert, records, log, st, nr)
+                            submit(insert, records, st, nr)
                         # end commit
                 # end for each file
             # end for each directory to traverse
             # final execute
             progress()
-            self.do_execute_records(connection, insert, records, log, st, nr)
+            submit(insert, records, st, nr)
+            finish_writes()
+            log.info("Re-used digests of %i hard-linked files", hardlinks.hits)
+            hardlinks.close()
         #########################
         ## Database Merges  ####
         ######################
         elif args.merge_paths:
             ## Commit this amount of records at once
             commit_count = 100000
+            submit, finish_writes = self._records_executor(engine, connection)
             
             def progress():
                 elapsed = time() - st
@@ -1010,7 +1522,18 @@ class FSStatSubCommand(IToolSubCommand, bapp.plugin_type(), ApplicationSettingsM
                 
                 
                 try:
+                    has_digests = fsstat_schema.digest.name in md.tables
                     for table in md.tables.itervalues():
+                        if table.name == fsstat_schema.digest.name:
+                            continue
+                        # end skip meta-data
+                        digest = has_digests and self._recorded_digest(mcon, table.name) or DIGEST_SHA1
+                        if digest != args.digest:
+                            log.error("Table '%s' uses digest '%s', but '%s' is required - skipping", 
+                                      table.name, digest, args.digest)
+                            continue
+                        # end skip incompatible digests
+
                         # If id is part of it, and we rollback because of a unicode error, the counter
                         # will be offset and we cannot commit anymore. Just let it be done automatically, no
                         # matter what
@@ -1033,7 +1556,7 @@ class FSStatSubCommand(IToolSubCommand, bapp.plugin_type(), ApplicationSettingsM
                                 must_break = len(records) < commit_count
                                 
                                 ##############
-                                self.do_execute_records(connection, insert, records, log, st, nr)
+                                submit(insert, records, st, nr)
                                 progress()
                                 ##############
                                 
@@ -1049,6 +1572,7 @@ class FSStatSubCommand(IToolSubCommand, bapp.plugin_type(), ApplicationSettingsM
                     mcon.close()
                 # end assure we close resources
             # end for each merge path
+            finish_writes()
         else:
             raise AssertionError("Reached unexpected mode") 
         # end handle mode of operation
@@ -0,0 +1,108 @@
+#-*-coding:utf-8-*-
+"""
+@package itool.fsstat_digest
+@brief Pluggable digest algorithms for use when hashing file contents
+
+@author Sebastian Thiel
+@copyright [GNU Lesser General Public License](https://www.gnu.org/licenses/lgpl.html)
+"""
+__all__ = ['digest_names', 'digest_constructor', 'benchmark_digests', 'fastest_digest',
+           'DIGEST_SHA1', 'DIGEST_FASTEST']
+
+import os
+import hashlib
+from time import time
+
+try:
+    # Only available in hashlib since python 3.6, see
+    # https://pypi.python.org/pypi/pyblake2
+    blake2b = getattr(hashlib, 'blake2b', None)
+    if blake2b is None:
+        from pyblake2 import blake2b
+    # end try pyblake2
+except ImportError:
+    blake2b = None
+# end ignore missing blake2
+
+try:
+    # see
+    # https://pypi.python.org/pypi/xxhash
+    import xxhash
+except ImportError:
+    xxhash = None
+# end ignore missing xxhash
+
+
+# -------------------------
+## @name Constants
+# @{
+
+## The digest used by all tables which didn't record their algorithm
+DIGEST_SHA1 = 'sha1'
+
+## A special name to indicate the fastest digest on this host should be used
+DIGEST_FASTEST = 'fastest'
+
+## Maximum size of digests in bytes, as limited by the size of the database column
+MAX_DIGEST_SIZE = 20
+
+## -- End Constants -- @}
+
+
+# A map of name -> constructor, producing objects with hashlib semantics
+_digests = { DIGEST_SHA1 : hashlib.sha1,
+             'md5' : hashlib.md5 }
+
+if blake2b is not None:
+    _digests['blake2b'] = lambda: blake2b(digest_size=MAX_DIGEST_SIZE)
+# end handle blake2b
+
+if xxhash is not None:
+    _digests['xxh64'] = xxhash.xxh64
+# end handle xxhash
+
+
+# ==============================================================================
+## @name Interface
+# ------------------------------------------------------------------------------
+## @{
+
+def digest_names():
+    """@return sorted list of names of all digests available on this host"""
+    return sorted(_digests.keys())
+
+def digest_constructor(name):
+    """@return a function to create a new hash object for the digest with the given name
+    @throw ValueError if the digest is unknown or unavailable on this host"""
+    try:
+        return _digests[name]
+    except KeyError:
+        raise ValueError("Digest '%s' is unavailable - choose one of %s" % (name, ', '.join(digest_names())))
+    # end handle unknown digest
+
+def benchmark_digests(size=64 * 1024**2, chunk_size=4 * 1024**2):
+    """Measure the throughput of all available digests
+    @param size amount of bytes to hash per digest
+    @param chunk_size size of each chunk handed to the digest
+    @return list of (name, MB/s) tuples, sorted descending by throughput"""
+    # Random data assures no digest can take shortcuts
+    chunk = os.urandom(chunk_size)
+    num_chunks = max(1, size / chunk_size)
+    res = list()
+    for name in digest_names():
+        hasher = _digests[name]()
+        st = time()
+        for cid in xrange(num_chunks):
+            hasher.update(chunk)
+        # end for each chunk
+        hasher.digest()
+        elapsed = time() - st
+        res.append((name, (num_chunks * chunk_size) / (1024**2 * (elapsed or 1e-6))))
+    # end for each digest
+    return sorted(res, key=lambda t: t[1], reverse=True)
+
+def fastest_digest():
+    """@return name of the digest with the highest throughput on this host"""
+    return benchmark_digests(size=16 * 1024**2)[0][0]
+
+## -- End Interface -- @}
@@ -0,0 +1,488 @@
+#-*-coding:utf-8-*-
+"""
+@package itool.fsstat_query
+@brief Canned, index-aware queries on databases created by the fs-stat subcommand
+
+@author Sebastian Thiel
+@copyright [GNU Lesser General Public License](https://www.gnu.org/licenses/lgpl.html)
+"""
+__all__ = ['FSStatQuerySubCommand']
+
+import sys
+import heapq
+from pwd import getpwuid
+from grp import getgrgid
+from binascii import b2a_hex
+from datetime import datetime
+from time import time
+
+import bapp
+from bapp import ApplicationSettingsMixin
+from butility import (Path,
+                      int_to_size_string)
+
+from bit.reports import Report
+from bit.utility import (datetime_to_date_string,
+                         none_support)
+from .base import IToolSubCommand
+from .fsstat import (FSStatSubCommand,
+                     is_url)
+
+from sqlalchemy import (create_engine,
+                        MetaData,
+                        Index,
+                        select,
+                        func)
+
+
+# ==============================================================================
+## @name Queries
+# ------------------------------------------------------------------------------
+## @{
+
+class FSStatQuery(object):
+    """Base for all canned queries.
+
+    Each query states the columns it needs an index on to avoid a full table scan. All queries only consider
+    entries which exist (e.g. have a ctime), and can be restricted to a path prefix.
+    """
+    __slots__ = ()
+
+    # -------------------------
+    ## @name Configuration
+    # @{
+
+    ## Name of the query on the commandline
+    # Must be set in subclass
+    name = None
+
+    ## Description of what the query does
+    # Must be set in subclass
+    description = None
+
+    ## Names of columns which should be indexed for the query to run efficiently
+    index_columns = tuple()
+
+    ## If True, the query has to look at all files below the prefix, even if all its index_columns are indexed
+    scans_all_files = False
+
+    ## A schema compatible to the Report type, see Table.columns
+    # Must be set in subclass
+    report_schema = None
+
+    ## -- End Configuration -- @}
+
+    # -------------------------
+    ## @name Utilities
+    # @{
+
+    @classmethod
+    def _is_file(cls, fsitem):
+        """@return a clause matching regular files only - only those have a sha1"""
+        return fsitem.c.sha1 != None
+
+    @classmethod
+    def _where(cls, fsitem, args):
+        """@return the where clause shared by all queries"""
+        clause = fsitem.c.ctime != None
+        if args.prefix:
+            clause = clause & fsitem.c.path.like(args.prefix + '%')
+        # end handle prefix
+        return clause
+
+    ## -- End Utilities -- @}
+
+    # -------------------------
+    ## @name Interface
+    # @{
+
+    @classmethod
+    def setup_argparser(cls, parser):
+        """Add arguments specific to this query to the given parser"""
+
+    @classmethod
+    def required_index_columns(cls, args):
+        """@return names of columns which should be indexed for the query with the given arguments
+        @note defaults to our index_columns"""
+        return cls.index_columns
+
+    def records(self, connection, fsitem, args):
+        """@return iterator yielding records compatible to our report_schema
+        @param connection to use for queries
+        @param fsitem the table to query
+        @param args parsed commandline arguments"""
+        raise NotImplementedError("To be implemented in subclass")
+
+    ## -- End Interface -- @}
+
+# end class FSStatQuery
+
+
+class LargestFilesQuery(FSStatQuery):
+    """Find the largest files"""
+    __slots__ = ()
+
+    name = 'largest-files'
+    description = 'Show the N largest files'
+    index_columns = ('size',)
+    report_schema = (('path', str, str),
+                     ('size', int, int_to_size_string),
+                     ('mtime', datetime, none_support(datetime_to_date_string)),
+                     ('uid', int, str))
+
+    def records(self, connection, fsitem, args):
+        c = fsitem.c
+        selector = select([c.path, c.size, c.mtime, c.uid], self._where(fsitem, args) & self._is_file(fsitem))\
+                                                            .order_by(c.size.desc())
+        if args.limit:
+            selector = selector.limit(args.limit)
+        # end handle limit
+        return iter(connection.execute(selector))
+
+# end class LargestFilesQuery
+
+
+class LargestDirectoriesQuery(FSStatQuery):
+    """Find directories whose direct children are using most space.
+
+    The database groups files by their directory, if it is one we know how to obtain the directory of a path
+    with. Otherwise, files are grouped in python, which keeps all directories in memory.
+    """
+    __slots__ = ()
+
+    name = 'largest-directories'
+    description = 'Show the N directories with the largest amount of bytes in files they contain directly'
+    index_columns = ('path',)
+    scans_all_files = True
+    report_schema = (('path', str, str),
+                     ('num_files', int, str),
+                     ('size', int, int_to_size_string))
+
+    @classmethod
+    def _dirname(cls, dialect, path):
+        """@return an sql expression yielding the directory of the given path column, with a trailing slash,
+        or None if we don't know how to do that for the given dialect name"""
+        if dialect == 'sqlite':
+            # strip all characters from the right which aren't a slash
+            return func.rtrim(path, func.replace(path, '/', ''))
+        elif dialect == 'mysql':
+            return func.left(path, func.char_length(path) - func.char_length(func.substring_index(path, '/', -1)))
+        elif dialect == 'postgresql':
+            return func.regexp_replace(path, '[^/]*$', '')
+        # end handle dialect
+        return None
+
+    def records(self, connection, fsitem, args):
+        c = fsitem.c
+        where = self._where(fsitem, args) & self._is_file(fsitem)
+        dirname = self._dirname(connection.dialect.name, c.path)
+        if dirname is not None:
+            total = func.sum(c.size)
+            selector = select([dirname, func.count(c.id), total], where).group_by(dirname)\
+                                                                        .order_by(total.desc())
+            if args.limit:
+                selector = selector.limit(args.limit)
+            # end handle limit
+
+            for path, count, size in connection.execute(selector):
+                yield path.rstrip('/') or '/', count, int(size or 0)
+            # end for each directory
+            return
+        # end handle grouping in database
+
+        selector = select([c.path, c.size], where)
+        dirs = dict()
+        for path, size in connection.execute(selector):
+            info = dirs.setdefault(path[:path.rfind('/')] or '/', [0, 0])
+            info[0] += 1
+            info[1] += size or 0
+        # end for each row
+
+        for path, (count, size) in heapq.nlargest(args.limit or len(dirs), dirs.iteritems(), key=lambda t: t[1][1]):
+            yield path, count, size
+        # end for each largest directory
+
+# end class LargestDirectoriesQuery
+
+
+class UsageQuery(FSStatQuery):
+    """Aggregate usage per owner"""
+    __slots__ = ()
+
+    name = 'usage'
+    description = 'Show amount of files and bytes per user or group id - needs index on the chosen id'
+    report_schema = (('owner', str, str),
+                     ('id', int, str),
+                     ('num_files', int, str),
+                     ('size', int, int_to_size_string))
+
+    BY_UID = 'uid'
+    BY_GID = 'gid'
+    valid_owners = (BY_UID, BY_GID)
+
+    @classmethod
+    def setup_argparser(cls, parser):
+        help = "The owner id to aggregate usage by, default is %(default)s"
+        parser.add_argument('--by', dest='by', default=cls.BY_UID, choices=cls.valid_owners, help=help)
+
+    @classmethod
+    def required_index_columns(cls, args):
+        return (args.by,)
+
+    def _owner_name(self, by, oid):
+        """@return name of the given owner id, or the id as string if it cannot be resolved"""
+        try:
+            if by == self.BY_UID:
+                return getpwuid(oid).pw_name
+            return getgrgid(oid).gr_name
+        except (KeyError, TypeError):
+            return str(oid)
+        # end handle unknown ids
+
+    def records(self, connection, fsitem, args):
+        col = fsitem.c[args.by]
+        total = func.sum(fsitem.c.size)
+        selector = select([col, func.count(fsitem.c.id), total], self._where(fsitem, args) & self._is_file(fsitem))\
+                                                                .group_by(col)\
+                                                                .order_by(total.desc())
+        if args.limit:
+            selector = selector.limit(args.limit)
+        # end handle limit
+
+        for oid, count, size in connection.execute(selector):
+            yield self._owner_name(args.by, oid), oid, count, int(size or 0)
+        # end for each row
+
+# end class UsageQuery
+
+
+class UntouchedFilesQuery(FSStatQuery):
+    """Find files which were not accessed since a given date"""
+    __slots__ = ()
+
+    name = 'untouched-since'
+    description = 'Show files which were not accessed since the given date, oldest first'
+    index_columns = ('atime',)
+    report_schema = (('path', str, str),
+                     ('size', int, int_to_size_string),
+                     ('atime', datetime, none_support(datetime_to_date_string)),
+                     ('mtime', datetime, none_support(datetime_to_date_string)))
+
+    @classmethod
+    def setup_argparser(cls, parser):
+        help = "The date in format YYYY-MM-DD. Files accessed before that date are shown"
+        parser.add_argument('date', type=lambda s: datetime.strptime(s, '%Y-%m-%d'), help=help)
+
+    def records(self, connection, fsitem, args):
+        c = fsitem.c
+        selector = select([c.path, c.size, c.atime, c.mtime], self._where(fsitem, args) &
+                                                                  self._is_file(fsitem) &
+                                                                  (c.atime < args.date)).order_by(c.atime)
+        if args.limit:
+            selector = selector.limit(args.limit)
+        # end handle limit
+        return iter(connection.execute(selector))
+
+# end class UntouchedFilesQuery
+
+
+class DuplicatesQuery(FSStatQuery):
+    """Find sets of files with the same content"""
+    __slots__ = ()
+
+    name = 'duplicates'
+    description = 'Show the N sets of files with equal sha1 that waste the most space'
+    index_columns = ('sha1',)
+    report_schema = (('sha1', str, str),
+                     ('count', int, str),
+                     ('wasted', int, int_to_size_string),
+                     ('path', str, str))
+
+    def records(self, connection, fsitem, args):
+        c = fsitem.c
+        where = self._where(fsitem, args) & self._is_file(fsitem) & (c.size > 0)
+        count = func.count(c.id)
+        wasted = (func.sum(c.size) - func.max(c.size))
+        sets = select([c.sha1.label('sha1'), count.label('count'), wasted.label('wasted')], where)\
+                                                                    .group_by(c.sha1)\
+                                                                    .having(count > 1)\
+                                                                    .order_by(wasted.desc())
+        if args.limit:
+            sets = sets.limit(args.limit)
+        # end handle limit
+        sets = sets.alias('sets')
+
+        # Fetch the paths of all sets at once, by joining them with the files they consist of
+        selector = select([sets.c.sha1, sets.c.count, sets.c.wasted, c.path], where & (c.sha1 == sets.c.sha1))\
+                                                    .order_by(sets.c.wasted.desc(), sets.c.sha1, c.path)
+        for sha1, count, wasted, path in connection.execute(selector):
+            yield b2a_hex(sha1), count, int(wasted), path
+        # end for each path of each duplicate set
+
+# end class DuplicatesQuery
+
+## -- End Queries -- @}
+
+
+class FSStatQuerySubCommand(IToolSubCommand, bapp.plugin_type(), ApplicationSettingsMixin):
+    """Run canned queries against databases generated by the fs-stat subcommand"""
+    __slots__ = ()
+
+    _schema = FSStatSubCommand._schema
+
+    name = 'fs-stat-query'
+    description = 'Run canned, index-aware queries against fs-stat databases'
+    version = '0.1.0'
+
+    # -------------------------
+    ## @name Configuration
+    # @{
+
+    ## All query types we know, in order
+    query_types = (LargestFilesQuery, LargestDirectoriesQuery, UsageQuery, UntouchedFilesQuery, DuplicatesQuery)
+
+    ## Default limit for queries
+    LIMIT_DEFAULT = 100
+
+    ## Keyword arguments for indices on columns which are too large to be indexed entirely
+    # Those are only used by mysql
+    index_kwargs = {'path' : dict(mysql_length=255),
+                    'sha1' : dict(mysql_length=20)}
+
+    ## -- End Configuration -- @}
+
+    # -------------------------
+    ## @name Utilities
+    # @{
+
+    def _url_from_path(self, path):
+        """@return sqlite url from the given filepath, or leave it the url it is"""
+        if is_url(path):
+            return path
+        return "sqlite:///%s" % path
+
+    def _indexed_columns(self, fsitem):
+        """@return set of names of all columns that are the leading column of an index, and thus are usable
+        for lookups"""
+        res = set(c.name for c in fsitem.primary_key)
+        for index in fsitem.indexes:
+            columns = list(index.columns)
+            if columns:
+                res.add(columns[0].name)
+            # end handle index
+        # end for each index
+        return res
+
+    def _assure_indices(self, engine, fsitem, columns, build):
+        """Check that all given columns are indexed, and build the missing indices if build is True
+        @return True if all required indices are present"""
+        log = self.log()
+        missing = [name for name in columns if name not in self._indexed_columns(fsitem)]
+        for name in missing:
+            index_name = 'idx_%s_%s' % (fsitem.name, name)
+            if not build:
+                log.warn("Column '%s' is not indexed - use --build-index to create index '%s' beforehand",
+                         name, index_name)
+                continue
+            # end just inform
+
+            ist = time()
+            log.info("Creating index '%s' ...", index_name)
+            Index(index_name, fsitem.c[name], **self.index_kwargs.get(name, dict())).create(engine)
+            log.info("Created index '%s' in %.2fs", index_name, time() - ist)
+        # end for each missing column
+        return build or not missing
+
+    ## -- End Utilities -- @}
+
+    def setup_argparser(self, parser):
+        super(FSStatQuerySubCommand, self).setup_argparser(parser)
+
+        config = self.settings_value()
+        help = "The database to query, as sqlalchemy url or path to an sqlite database"
+        parser.add_argument('-db', '--database', dest='db', metavar='SQLALCHEMY_URL',
+                            type=Path, default=config.fs_stat.db_url, help=help)
+
+        help = "The table to query, as previously specified by fs-stat -t"
+        parser.add_argument('-t', '--table-name', dest='table_name', metavar='TABLE', required=True, help=help)
+
+        help = "Only consider paths starting with the given prefix"
+        parser.add_argument('-p', '--prefix', dest='prefix', metavar='ABS_PATH', default=None, help=help)
+
+        help = "Return at most the given amount of results, 0 disables the limit. Default: %(default)s"
+        parser.add_argument('-n', '--limit', dest='limit', default=self.LIMIT_DEFAULT, type=int, help=help)
+
+        help = "If set, indices required by the query will be built before running it, if they don't exist yet. "
+        help += "Building an index can take a long time on large tables, but makes all subsequent queries fast"
+        parser.add_argument('--build-index', dest='build_index', default=False, action='store_true', help=help)
+
+        help = "Specifies the way results are presented to the user, either in human-readable form, or as CSV"
+        parser.add_argument('-o', '--output-mode', dest='output_mode', default=Report.SERIALIZE_TTY,
+                            choices=(Report.SERIALIZE_TTY, Report.SERIALIZE_CSV), help=help)
+
+        help = "If set, column names will not be printed as first line. Useful for scripting"
+        parser.add_argument('--skip-header', dest='no_header', default=False, action='store_true', help=help)
+
+        help = "The query to run"
+        subparsers = parser.add_subparsers(title='Queries', help=help)
+        for cls in self.query_types:
+            desc = cls.description
+            if cls.index_columns:
+                desc += " - needs index on %s" % ', '.join(cls.index_columns)
+            # end document index
+            if cls.scans_all_files:
+                desc += " - scans all files below the prefix"
+            # end document full scan
+            subparser = subparsers.add_parser(cls.name, description=desc, help=desc)
+            cls.setup_argparser(subparser)
+            subparser.set_defaults(query_type=cls)
+        # end for each query type
+
+        return self
+
+    def execute(self, args, remaining_args):
+        log = self.log()
+        if not args.db:
+            log.error("--database not set or configured")
+            return self.ERROR
+        # end handle db
+
+        engine = create_engine(self._url_from_path(args.db))
+        meta = MetaData(engine, reflect=True)
+        if args.table_name not in meta.tables:
+            log.error("Table '%s' didn't exist in database at '%s'", args.table_name, args.db)
+            return self.ERROR
+        # end verify table
+        fsitem = meta.tables[args.table_name]
+
+        query = args.query_type()
+        if not self._assure_indices(engine, fsitem, query.required_index_columns(args), args.build_index):
+            log.warn("Query '%s' will scan the whole table as it lacks indices", query.name)
+        # end handle missing indices
+
+        num_records = [0]
+        def counted(records):
+            """Count records while they are streamed into the report"""
+            for rec in records:
+                num_records[0] += 1
+                yield rec
+            # end for each record
+        # end counter
+
+        connection = engine.connect()
+        try:
+            st = time()
+            # Records are streamed from the cursor, which must stay open until the report is written
+            report = Report(columns=query.report_schema, records=counted(query.records(connection, fsitem, args)))
+            if report.is_empty():
+                sys.stderr.write("Query didn't yield a result\n")
+            else:
+                report.serialize(args.output_mode, sys.stdout.write, column_names=not args.no_header)
+            # end handle empty report
+            log.info("Query '%s' yielded %i records in %.2fs", query.name, num_records[0], time() - st)
+        finally:
+            connection.close()
+        # end assure connection is closed
+        return self.SUCCESS
+
+# end class FSStatQuerySubCommand
@@ -45,6 +45,7 @@ record = Table('fsitem', meta,
                 # The destination of a sylink, or null
                 Column('ldest', String(312), nullable=True),
                 # SHA will be NULL if we are seeing a symlink
+                # NOTE: the name is historical, the digest algorithm is recorded per table in the 'fsstat_digest' table
                 Column('sha1', LargeBinary(length=20)),
                 # Compression ration - the higher the better
                 Column('ratio', Float, nullable=True),
@@ -54,3 +55,14 @@ record = Table('fsitem', meta,
                 mysql_charset='utf8'
                 )
 
+
+## Keeps the digest algorithm used for each fsitem table.
+# Tables without entry are assumed to use sha1
+digest = Table('fsstat_digest', meta,
+                Column('table_name', String(255), primary_key=True),
+                Column('algorithm', String(32)),
+
+                # MYSQL Options
+                mysql_engine='MyISAM',
+                mysql_charset='utf8'
+                )
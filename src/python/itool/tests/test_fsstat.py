@@ -0,0 +1,188 @@
+#-*-coding:utf-8-*-
+"""
+@package itool.tests.test_fsstat
+@brief tests for itool.fsstat
+
+@author Sebastian Thiel
+@copyright [GNU Lesser General Public License](https://www.gnu.org/licenses/lgpl.html)
+"""
+__all__ = []
+
+import os
+import logging
+import threading
+from collections import namedtuple
+
+from itool.tests import ItoolTestCase
+from itool.fsstat import (PathFilter,
+                          HardLinkCache,
+                          RecordWriterThread)
+
+
+## The parts of a stat result the HardLinkCache looks at
+_Stat = namedtuple('_Stat', ('st_dev', 'st_ino', 'st_size', 'st_mtime'))
+
+
+class _Engine(object):
+    """An engine handing out connections which don't do anything"""
+    __slots__ = ('num_connections')
+
+    def __init__(self):
+        self.num_connections = 0
+
+    def connect(self):
+        self.num_connections += 1
+        return self
+
+    def close(self):
+        self.num_connections -= 1
+
+# end class _Engine
+
+
+class FSStatTests(ItoolTestCase):
+    __slots__ = ()
+
+    def test_path_filter(self):
+        """Verify rules match basenames, paths below their root, or any trailing path if they have no root"""
+        path_filter = PathFilter()
+        assert path_filter.compile().is_empty()
+        assert not path_filter.excludes('/mnt/proj/tmp')
+        assert not path_filter.excludes_file('/mnt/proj/a.exr')
+
+        path_filter.add_rules('', exclude=['.snapshot', 'tmp/*', 're:\\.bak$'])
+        path_filter.add_rules('/mnt/proj/', include=['renders/*.exr'], exclude=['cache'])
+        path_filter.add_rules('/mnt/other', exclude=['sub/*.tif'])
+        assert not path_filter.compile().is_empty()
+
+        # basename rules apply at any depth, but only to the full last component
+        assert path_filter.excludes('/mnt/.snapshot')
+        assert path_filter.excludes('/mnt/proj/renders/.snapshot')
+        assert not path_filter.excludes('/mnt/proj/.snapshots')
+
+        # global rules with slashes match any trailing part of the path
+        assert path_filter.excludes('/mnt/proj/tmp/x')
+        assert path_filter.excludes('/tmp/x')
+        assert not path_filter.excludes('/mnt/proj/mytmp/x')
+        assert path_filter.excludes('/mnt/proj/a.bak')
+        assert not path_filter.excludes('/mnt/proj/a.bak.exr')
+
+        # rules with a root only apply below it, and slashes are relative to it
+        assert path_filter.excludes('/mnt/proj/cache')
+        assert path_filter.excludes('/mnt/proj/renders/cache')
+        assert not path_filter.excludes('/mnt/cache')
+        assert path_filter.excludes('/mnt/other/sub/a.tif')
+        assert not path_filter.excludes('/mnt/other/deep/sub/a.tif')
+        assert not path_filter.excludes('/mnt/other2/sub/a.tif')
+
+        # include rules only drop files below their root, directories are never affected
+        assert not path_filter.excludes_file('/mnt/proj/renders/a.exr')
+        assert path_filter.excludes_file('/mnt/proj/renders/a.tif')
+        assert path_filter.excludes_file('/mnt/proj/other.txt')
+        assert not path_filter.excludes('/mnt/proj/other')
+        assert not path_filter.excludes_file('/mnt/other/a.txt')
+        assert path_filter.excludes_file('/mnt/other/a.bak')
+
+        # global include rules with slashes keep matching files anywhere
+        path_filter = PathFilter().add_rules('', include=['renders/*.exr'], exclude=['tmp/*']).compile()
+        assert path_filter.excludes('/mnt/proj/tmp/x')
+        assert not path_filter.excludes_file('/mnt/proj/renders/a.exr')
+        assert path_filter.excludes_file('/mnt/proj/other.txt')
+
+        dirs = ['tmp', '.snapshot', 'renders']
+        assert PathFilter().add_rules('', exclude=['.snapshot']).compile().prune_directories('/mnt', dirs) is dirs
+        assert dirs == ['tmp', 'renders']
+
+    def test_hard_link_cache(self):
+        """Verify entries are spilled to disk once the memory budget is exhausted, and can still be found"""
+        cache = HardLinkCache(2 * HardLinkCache.bytes_per_entry)
+        stats = [_Stat(1, ino, 10 * ino, 1000.5) for ino in xrange(5)]
+        for stat in stats[:2]:
+            assert cache.set(stat, 'digest%i' % stat.st_ino, None) is cache
+        # end for each entry within budget
+        assert cache._spill is None and len(cache) == 2
+
+        cache.set(stats[2], 'digest2', 0.5)
+        spill_dir = cache._spill_dir
+        assert os.path.isdir(spill_dir)
+        assert len(cache._memory) == 1 and len(cache) == 3
+
+        # entries are found no matter where they are
+        assert cache.get(stats[0]) == ('digest0', None)
+        assert cache.get(stats[2]) == ('digest2', 0.5)
+        assert cache.get(stats[3]) is None
+        assert cache.hits == 2
+
+        # later spills add to the database, and entries of changed files are ignored
+        cache.set(stats[3], 'digest3', None).set(stats[4], 'digest4', None)
+        assert len(cache._memory) == 1 and len(cache) == 5
+        assert cache.get(stats[3]) == ('digest3', None)
+        assert cache.get(stats[1]._replace(st_mtime=1001.0)) is None
+        assert cache.get(stats[1]._replace(st_size=1)) is None
+        assert cache.get(stats[1]._replace(st_dev=2)) is None
+        assert cache.hits == 3
+
+        cache.close()
+        assert not os.path.exists(spill_dir)
+        assert len(cache) == 0 and cache.get(stats[0]) is None
+
+    def test_record_writer(self):
+        """Verify the writer makes producers wait if it falls behind, and hands its errors to them"""
+        log = logging.getLogger('itool.tests.fsstat')
+        engine = _Engine()
+        release = threading.Event()
+        executed = list()
+
+        def execute(connection, statement, records, log, overall_start_time, total_num_records):
+            assert connection is engine
+            release.wait()
+            if statement == 'fail':
+                raise ValueError(records)
+            # end fail on demand
+            executed.append(records)
+        # end execute
+
+        writer = RecordWriterThread(execute, engine, log, 1)
+        writer.start()
+        records = [1, 2]
+        writer.submit('insert', records)
+        assert records == [], "writer takes ownership of the records"
+        writer.submit('insert', [])
+        writer.submit('insert', [3])
+
+        # The first batch is blocked in execute, the second one fills the queue
+        producer = threading.Thread(target=writer.submit, args=('insert', [4]))
+        producer.start()
+        producer.join(0.05)
+        assert producer.is_alive(), "producer should wait for the writer to catch up"
+        release.set()
+        producer.join(5.0)
+        assert not producer.is_alive()
+        writer.finish()
+        assert not writer.is_alive()
+        assert executed == [[1, 2], [3], [4]]
+        assert engine.num_connections == 0
+
+        # Errors are raised on the next call to submit(), batches after the error are dropped
+        writer = RecordWriterThread(execute, engine, log, 2)
+        writer.start()
+        writer.submit('fail', [5])
+        writer.submit('insert', [6])
+        while writer._exc_info is None and writer.is_alive():
+            writer.join(0.01)
+        # end wait for the writer to fail
+        self.failUnlessRaises(ValueError, writer.submit, 'insert', [7])
+        assert not writer.is_alive()
+        assert executed[-1] == [4]
+        assert engine.num_connections == 0
+
+        # ... or on finish()
+        writer = RecordWriterThread(execute, engine, log, 2)
+        writer.start()
+        writer.submit('insert', [8])
+        writer.submit('fail', [9])
+        self.failUnlessRaises(ValueError, writer.finish)
+        assert executed[-1] == [8]
+        assert engine.num_connections == 0
+
+# end class FSStatTests
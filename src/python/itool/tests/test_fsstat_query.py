@@ -0,0 +1,107 @@
+#-*-coding:utf-8-*-
+"""
+@package itool.tests.test_fsstat_query
+@brief tests for itool.fsstat_query
+
+@author Sebastian Thiel
+@copyright [GNU Lesser General Public License](https://www.gnu.org/licenses/lgpl.html)
+"""
+__all__ = []
+
+from argparse import Namespace
+from datetime import datetime
+
+from sqlalchemy import create_engine
+
+from itool.tests import ItoolTestCase
+from itool import fsstat_schema
+from itool.fsstat_query import (LargestFilesQuery,
+                                LargestDirectoriesQuery,
+                                UsageQuery,
+                                UntouchedFilesQuery,
+                                DuplicatesQuery)
+
+
+class _PythonGroupingQuery(LargestDirectoriesQuery):
+    """Groups directories like it would for databases we don't know"""
+    __slots__ = ()
+
+    @classmethod
+    def _dirname(cls, dialect, path):
+        return None
+
+# end class _PythonGroupingQuery
+
+
+class FSStatQueryTests(ItoolTestCase):
+    __slots__ = ()
+
+    def _args(self, **kwargs):
+        """@return arguments as parsed from the commandline"""
+        args = Namespace(prefix=None, limit=0)
+        args.__dict__.update(kwargs)
+        return args
+
+    def _database(self):
+        """@return a connection to a database with a fsitem table and a few entries"""
+        engine = create_engine('sqlite://')
+        fsstat_schema.record.create(engine)
+        old, new = datetime(2010, 1, 1), datetime(2014, 1, 1)
+        a, b, c = 'a' * 20, 'b' * 20, 'c' * 20
+        rows = (('/mnt',                None, 4096, new, 0,  None),
+                ('/mnt/proj',           None, 4096, new, 0,  None),
+                ('/mnt/proj/a.exr',     a,    100,  new, 10, None),
+                ('/mnt/proj/b.exr',     a,    100,  old, 10, None),
+                ('/mnt/proj/c.exr',     b,    50,   old, 11, None),
+                ('/mnt/proj/sub',       None, 4096, new, 0,  None),
+                ('/mnt/proj/sub/a.exr', a,    100,  new, 11, None),
+                ('/mnt/proj/sub/d.exr', c,    300,  new, 10, None),
+                ('/mnt/proj/sub/e.exr', b,    50,   new, 10, None),
+                ('/mnt/x.txt',          c,    300,  old, 11, None),
+                ('/mnt/gone.txt',       b,    50,   old, 11, 'deleted'))
+        connection = engine.connect()
+        connection.execute(fsstat_schema.record.insert(),
+                           [dict(path=path, sha1=sha1, size=size, atime=atime, mtime=atime, uid=uid,
+                                 ctime=deleted is None and atime or None)
+                            for path, sha1, size, atime, uid, deleted in rows])
+        return connection, fsstat_schema.record
+
+    def test_queries(self):
+        """Verify all queries consider existing files only, and respect prefix and limit"""
+        connection, fsitem = self._database()
+        records = lambda query, **kwargs: list(query().records(connection, fsitem, self._args(**kwargs)))
+
+        largest = records(LargestFilesQuery, limit=3)
+        assert [r[0] for r in largest] == ['/mnt/proj/sub/d.exr', '/mnt/x.txt', largest[2][0]]
+        assert largest[2][1] == 100
+        assert [r[1] for r in records(LargestFilesQuery, prefix='/mnt/proj/sub/')] == [300, 100, 50]
+
+        for query in (LargestDirectoriesQuery, _PythonGroupingQuery):
+            assert records(query) == [('/mnt/proj/sub', 3, 450), ('/mnt', 1, 300), ('/mnt/proj', 3, 250)]
+            assert records(query, limit=1, prefix='/mnt/proj') == [('/mnt/proj/sub', 3, 450)]
+        # end for each way of grouping
+        assert LargestDirectoriesQuery._dirname('oracle', fsitem.c.path) is None
+
+        usage = records(UsageQuery, by=UsageQuery.BY_UID)
+        assert [r[1:] for r in usage] == [(10, 4, 550), (11, 3, 450)]
+        assert UsageQuery.required_index_columns(self._args(by=UsageQuery.BY_GID)) == ('gid',)
+
+        untouched = records(UntouchedFilesQuery, date=datetime(2012, 1, 1))
+        assert [r[0] for r in untouched] == ['/mnt/proj/b.exr', '/mnt/proj/c.exr', '/mnt/x.txt']
+
+        # The deleted file doesn't count towards the set of b
+        assert records(DuplicatesQuery) == [('63' * 20, 2, 300, '/mnt/proj/sub/d.exr'),
+                                            ('63' * 20, 2, 300, '/mnt/x.txt'),
+                                            ('61' * 20, 3, 200, '/mnt/proj/a.exr'),
+                                            ('61' * 20, 3, 200, '/mnt/proj/b.exr'),
+                                            ('61' * 20, 3, 200, '/mnt/proj/sub/a.exr'),
+                                            ('62' * 20, 2, 50, '/mnt/proj/c.exr'),
+                                            ('62' * 20, 2, 50, '/mnt/proj/sub/e.exr')]
+        assert [r[3] for r in records(DuplicatesQuery, limit=1)] == ['/mnt/proj/sub/d.exr', '/mnt/x.txt']
+        assert [r[3] for r in records(DuplicatesQuery, prefix='/mnt/proj/')] == ['/mnt/proj/a.exr',
+                                                                                 '/mnt/proj/b.exr',
+                                                                                 '/mnt/proj/sub/a.exr',
+                                                                                 '/mnt/proj/c.exr',
+                                                                                 '/mnt/proj/sub/e.exr']
+
+# end class FSStatQueryTests
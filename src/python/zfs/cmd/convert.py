@@ -23,8 +23,8 @@ from bkvstore import KeyValueStoreSchema
 from zfs.sql import (ZSession,
                      ZPool,
                      ZDataset)
-from bit.utility import (graphite_submit,
-                         CARBON_PORT)
+from bit.utility import CARBON_PORT
+from bit.graphite import GraphiteSender
 
 
 # -------------------------
@@ -51,12 +51,22 @@ class GraphiteConverter(ApplicationSettingsMixin):
 
     _schema = KeyValueStoreSchema('graphite', {'carbon' :  
                                                     { 'host' : 'unknown_host',
-                                                      'port' : CARBON_PORT }})
+                                                      'port' : CARBON_PORT },
+                                               # file to keep samples in while carbon is down, to send them later
+                                               'spill_path' : str(),
+                                               # seconds to wait for all samples to be sent before exiting
+                                               'timeout' : 30.0})
 
     zpool_metrics       = ('size', 'free', 'alloc', 'cap', 'health', 'dedup')
     zfilesystem_metrics = ('used', 'avail', 'refer', 'ratio', 'quota', 'reserv')
 
-    def send(self, timestamp, host, samples, ztype):
+    def sender(self):
+        """@return a new GraphiteSender configured according to our settings"""
+        graphite = self.settings_value()
+        return GraphiteSender(graphite.carbon.host, port=graphite.carbon.port,
+                              spill_path=graphite.spill_path or None)
+
+    def send(self, timestamp, host, samples, ztype, sender=None):
         """Convert the samples into a carbon sample tree and send it to the carbon server. 
         The tree is looking like this:
 
@@ -66,7 +76,10 @@ class GraphiteConverter(ApplicationSettingsMixin):
         @param samples an iterator yielding samples of the respective datatype
         @param host name of the host whose samples we are looking at
         @param timestamp time since epoch at which the samples were taken
+        @param sender if not None, a GraphiteSender to submit the samples to, which sends them in the background.
+        Otherwise, a sender is created and closed before returning
         @return this instances
+        @throw IOError if we created the sender, and not all samples could be sent or spilled
         """
         gsamples = list()
         graphite = self.settings_value()
@@ -86,7 +99,20 @@ class GraphiteConverter(ApplicationSettingsMixin):
                 gsamples.append((key + metric, (timestamp, val)))
             # end for each metric
         # end for each sample
-        graphite_submit(graphite.carbon.host, gsamples, port=graphite.carbon.port)
+        if sender is None:
+            sender = self.sender()
+            sender.submit(gsamples, block=True)
+            if not sender.close(graphite.timeout):
+                raise IOError("Not all samples could be sent to graphite in time")
+            # end handle timeout
+            if sender.num_dropped or sender.num_rejected:
+                raise IOError("Failed to send %i of %i samples to graphite"
+                              % (sender.num_dropped + sender.num_rejected, len(gsamples)))
+            # end handle lost samples
+        else:
+            sender.submit(gsamples, block=True)
+        # end handle sender
+        return self
 # end class GraphiteConverter
 
 
@@ -157,14 +183,28 @@ class ConverterZFSSubCommand(ZFSSubCommand, bapp.plugin_type()):
             # end for each sample
         else:
             samples = list(parser.parse_stream(sys.stdin))
+            conv = sender = None
+            if args.format in (self.FORMAT_GRAPHITE, self.FORMAT_SQL_GRAPHITE):
+                # samples are sent in the background while we sync
+                conv = GraphiteConverter()
+                sender = conv.sender()
+                conv.send(time(), args.host, samples, ZType, sender)
+            # end handle sql/graphite
             if args.format in (self.FORMAT_SQL, self.FORMAT_SQL_GRAPHITE):
                 session = ZSession.new()
                 session.sync(args.host, samples, ZType).commit()
             # end handle sql/graphite
-            if args.format in (self.FORMAT_GRAPHITE, self.FORMAT_SQL_GRAPHITE):
-                conv = GraphiteConverter()
-                conv.send(time(), args.host, samples, ZType)
-            # end handle sql/graphite
+            if sender is not None:
+                if not sender.close(conv.settings_value().timeout):
+                    self.log().error("Not all samples could be sent to graphite in time")
+                    return self.ERROR
+                # end handle timeout
+                if sender.num_dropped or sender.num_rejected:
+                    self.log().error("Failed to send %i samples to graphite, and couldn't spill them",
+                                     sender.num_dropped + sender.num_rejected)
+                    return self.ERROR
+                # end handle lost samples
+            # end wait for samples to be sent
         # handle any other format than csv
 
         return self.SUCCESS
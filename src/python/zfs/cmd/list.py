@@ -29,7 +29,8 @@ from bit.utility import (delta_to_tty_string,
                          float_to_tty_string,
                          rsum,
                          ravg,
-                         DistinctStringReducer)
+                         DistinctStringReducer,
+                         TableAggregator)
 
 
 class ListSubCommand(ZFSSubCommand, ApplicationSettingsMixin, bapp.plugin_type()):
@@ -176,6 +177,10 @@ class ListSubCommand(ZFSSubCommand, ApplicationSettingsMixin, bapp.plugin_type()
         help = "If set, only the aggregate line will be shown"
         parser.add_argument('-a', '--aggregate-only', dest='aggregate_only', action='store_true', default=False, help=help)
 
+        help = "If set, the amount of records to determine column widths from. "
+        help += "Records are printed as soon as they are read, instead of after all of them are known"
+        parser.add_argument('-w', '--window', dest='window', type=int, help=help)
+
         return self
 
     def execute(self, args, remaining_args):
@@ -257,47 +262,60 @@ class ListSubCommand(ZFSSubCommand, ApplicationSettingsMixin, bapp.plugin_type()
         ##############
         col_to_attr = zcls.__mapper__.get_property_by_column
         name_to_col = table.columns.__getitem__
-        for inst in query:
-            rec = list()
-
-            if isinstance(inst, ZDataset) and args.leaf and not inst.is_snapshot() and list(inst.children()):
-                continue
-            # end skip non-leaf datasets
+        def records():
+            for inst in query:
+                rec = list()
 
-            for cid, name in enumerate(columns):
-                if name == self.COLUMN_URL:
-                    val = str(ZFSURL.new_from_dataset(inst.host, inst.name))
-                else:
-                    val = getattr(inst, col_to_attr(name_to_col(name)).key)
-                    if isinstance(val, datetime):
-                        val = now - val
-                    # end handle conversions
-                # end handle special case
-                rec.append(val)
-            # end for each colum
-            rep.records.append(rec)
-        # end for each row
+                if isinstance(inst, ZDataset) and args.leaf and not inst.is_snapshot() and list(inst.children()):
+                    continue
+                # end skip non-leaf datasets
+
+                for cid, name in enumerate(columns):
+                    if name == self.COLUMN_URL:
+                        val = str(ZFSURL.new_from_dataset(inst.host, inst.name))
+                    else:
+                        val = getattr(inst, col_to_attr(name_to_col(name)).key)
+                        if isinstance(val, datetime):
+                            val = now - val
+                        # end handle conversions
+                    # end handle special case
+                    rec.append(val)
+                # end for each colum
+                yield rec
+            # end for each row
+        # end records
 
         # AGGREGATION
         ##################
-        if len(rep.records) > 1:
-            agr = rep.aggregate_record()
-            agr[0] = now - now
-            rep.records.append(agr)
-
-            if args.aggregate_only:
-                rep.records = rep.records[-1:]
-            # end remove all records but aggregate
-        # end aggregate only if there is something
-
-        # Finally, make sure updated_at becomes seen - we now have the values and no one cares about the schema
-        # names anymore
+        aggregator = TableAggregator(rep.columns)
+        def aggregated(records):
+            last = None
+            for rec in aggregator.iter_added(records):
+                if args.aggregate_only:
+                    last = rec
+                else:
+                    yield rec
+                # end remove all records but aggregate
+            # end for each record
+
+            if aggregator.num_records > 1:
+                agr = aggregator.record()
+                agr[0] = now - now
+                yield agr
+            elif last is not None:
+                yield last
+            # end aggregate only if there is something
+        # end aggregated records
+        rep.records = aggregated(records())
+
+        # Finally, make sure updated_at becomes seen - records refer to columns by index, no one cares about the 
+        # schema names anymore
         for col in rep.columns:
             if col[0] == 'updated_at':
                 col[0] = 'seen'
         # end rename updated_at
 
-        rep.serialize(Report.SERIALIZE_TTY, sys.stdout.write)
+        rep.serialize(Report.SERIALIZE_TTY, sys.stdout.write, window=args.window)
         return self.SUCCESS
 
 # end class ListSubCommand
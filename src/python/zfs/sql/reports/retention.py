@@ -38,7 +38,8 @@ class ZRetentionReportGenerator(ZReportGenerator, bapp.plugin_type()):
                                                             applied_every = str,
                                                             hosts = StringList,
                                                             debug = int,
-                                                            name_like = str))
+                                                            name_like = str,
+                                                            num_processes = 1)) # amount of processes to filter with
 
     PolicyType = RetentionPolicy
 
@@ -97,9 +98,10 @@ class ZRetentionReportGenerator(ZReportGenerator, bapp.plugin_type()):
         kept_comment = 'kept by policy'
         removed_comment = 'removed by policy'
         summaries = list()              # summary-records
-        for (fs_host, fs_name), samples in by_fs_map.iteritems():
-            # Apply policy and prepare actual report
-            remaining, deleted = policy.filter(now_time, samples)
+        # Apply policy to all filesystems at once, and prepare actual report
+        for (fs_host, fs_name), (remaining, deleted) in policy.filter_groups(now_time, by_fs_map.iteritems(),
+                                                                    processes=self._config.num_processes):
+            samples = by_fs_map[(fs_host, fs_name)]
 
             # in debug mode, we want to see it even there are no deletions
             # Otherwise this is just a shortcut
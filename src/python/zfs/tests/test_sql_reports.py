@@ -16,6 +16,7 @@ from zfs.sql.reports import *
 from zfs.url import ZFSURL
 from sqlalchemy import create_engine
 from bit.utility import seconds_to_datetime
+from bit.retention_simulator import RetentionSimulator
 from time import time
 
 from butility.compat import StringIO
@@ -141,6 +142,34 @@ class ReportsTestCase(ZFSTestCase):
 
         assert policy.num_rule_samples()[0] == 1
 
+        # Groups are filtered like individual policies would
+        policy_string = '2-1h:1d,1d:14d,14d:28d,30d:1y'
+        groups = [('a', samples), ('b', samples[:5]), ('c', list()), ('d', samples[3:])]
+        expected = [(key, RetentionPolicy(policy_string).filter(now, group)) for key, group in groups]
+        policy = RetentionPolicy(policy_string)
+        for processes in (1, 2):
+            assert list(policy.filter_groups(now, iter(groups), processes=processes)) == expected
+        # end for each amount of processes
+        assert policy.keep() == 2, "initial samples are kept for each group"
+
+    def test_retention_simulation(self):
+        """Verify a simulated policy never keeps more samples than it allows, even with irregular snapshots"""
+        policy = RetentionPolicy('1h:1d,1d:14d,14d:28d,30d:1y')
+        max_samples = policy.num_rule_samples()[0]
+        num_taken = list()
+        for jitter, gap_probability in ((0.0, 0.0), (0.3, 0.1)):
+            simulator = RetentionSimulator(policy, '1h', applied_every='6h', jitter=jitter, 
+                                           gap_probability=gap_probability, change_rate=10, seed=1)
+            steps = list(simulator.run('120d', start=1400000000))
+            assert len(steps) == 120 * 4
+            last = steps[-1]
+            assert last.num_kept <= max_samples + 1, "the oldest sample may remain to fill the last period"
+            assert last.num_taken - sum(s.num_removed for s in steps) == last.num_kept
+            assert 0 < last.storage < 120 * 24 * 3600 * 10, "we can't keep more than what was changed"
+            num_taken.append(last.num_taken)
+        # end for each configuration
+        assert num_taken[0] == 120 * 24 and num_taken[1] < num_taken[0], "there should be gaps"
+
     @with_application(from_file=__file__)
     def test_retention(self):
         """Verify retention policy report"""